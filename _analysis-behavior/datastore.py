@@ -0,0 +1,249 @@
+"""Typed, columnar copy of every task's data, updated incrementally.
+
+    python datastore.py ingest ../_data/demos            # -> ../_data/demos/_store
+
+Each run parses only the CSV files that are new or changed since the last one
+(size and mtime first, then the content hash) and drops the rows of files that
+were deleted. Rows are mapped to one schema (SCHEMA), split by task, and each
+task's columns are saved as .npy files, so analysis reads only the columns and
+tasks it asks for:
+
+    df = load('../_data/demos/_store', ['participant_name', 'n', 'correct', 'rt'], tasks=['nback'])
+
+Text columns are stored as categoricals (int32 codes plus the distinct values).
+Understands the jsPsych web demo exports (rows without a 'task' are
+instructions or fixations and are skipped), tasks-python sessions and
+nback_beh/nback_mri files (trial events only).
+"""
+import argparse, hashlib, json, os, shutil, time
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'manifest.json'
+TASKS = ('paired_associate', 'flanker', 'nback', 'srtt') # for files without a 'task' column: first name in the path
+
+# canonical column -> dtype ('category' columns hold text)
+SCHEMA = {
+    'task': 'category', 'participant_name': 'category', 'source': 'category',
+    'run': 'float32', 'block': 'float32', 'trial_index': 'float64', 'phase': 'category',
+    'type': 'category', 'n': 'float32', 'stim_type': 'category', 'stimulus': 'category',
+    'is_target': 'float32', 'response': 'category', 'correct': 'float32', 'rt': 'float64',
+}
+
+# canonical column -> source columns; each row takes the first one that isn't empty
+COLUMNS = {
+    'participant_name': ['participant_name', 'subject_id', 'subject_name'],
+    'trial_index': ['trial_index', 'trial'],
+    'response': ['response', 'resp_key', 'response_position'],
+    'rt': ['rt', 'resp_rt', 'response_time'],
+}
+TASK_COLUMNS = {
+    'srtt': {'type': ['block_type', 'trial_type'], 'stimulus': ['target_pos', 'target_position']},
+    'nback': {'stimulus': ['letter', 'stimulus']},
+    'paired_associate': {'stimulus': ['cue', 'image', 'stimulus']},
+}
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_number(values):
+    """'true'/'false' (jsPsych, Python) as 1/0, everything else numeric or NaN."""
+    return pd.to_numeric(values.str.lower().replace({'true': '1', 'false': '0'}), errors='coerce')
+
+
+def _task_of(relpath):
+    path = relpath.lower()
+    return next((task for task in TASKS if task in path), None)
+
+
+def read_file(path, relpath):
+    """One CSV as text, with 'source' and, where the file doesn't say, 'task' and 'participant_name' filled in."""
+    raw = pd.read_csv(path, dtype=str)
+    raw['source'] = relpath
+    if 'task' not in raw:
+        raw['task'] = _task_of(relpath)
+    if not any(c in raw for c in COLUMNS['participant_name']): # nback_mri: one subject per file
+        raw['participant_name'] = os.path.splitext(os.path.basename(relpath))[0]
+    return raw
+
+
+def normalize(raw):
+    """Rows of read_file() frames (one or many, concatenated) in the canonical schema, not yet categorical."""
+    if 'event_type' in raw:
+        raw = raw[raw['event_type'].fillna('trial') == 'trial']
+    raw = raw[raw['task'].notna()]
+    task = raw['task']
+    out = pd.DataFrame({'task': task, 'source': raw['source']}, index=raw.index)
+
+    def pick(col, candidates):
+        values = pd.Series(np.nan, index=raw.index, dtype=object)
+        for c in candidates:
+            if c in raw:
+                values = values.fillna(raw[c]) if values.notna().any() else raw[c]
+        return values
+
+    for col, dtype in SCHEMA.items():
+        if col in ('task', 'source'):
+            continue
+        # per-task source columns apply to that task's rows only
+        values = pick(col, COLUMNS.get(col, [col]))
+        for name, columns in TASK_COLUMNS.items():
+            if col in columns:
+                rows = (task == name).to_numpy()
+                if rows.any():
+                    values = values.mask(rows, pick(col, columns[col]))
+        out[col] = values if dtype == 'category' else _to_number(values)
+    return out
+
+
+def _write_partition(path, df):
+    if os.path.isdir(path): # left by an ingest that died before saving the manifest
+        shutil.rmtree(path)
+    os.makedirs(path)
+    for col, dtype in SCHEMA.items():
+        if dtype == 'category':
+            cat = pd.Categorical(df[col].astype(object))
+            np.save(os.path.join(path, f'{col}.codes.npy'), cat.codes.astype(np.int32))
+            np.save(os.path.join(path, f'{col}.cats.npy'), np.array(list(cat.categories), dtype=str))
+        else:
+            np.save(os.path.join(path, f'{col}.npy'), df[col].to_numpy(dtype=dtype, na_value=np.nan))
+
+
+def _read_column(path, col):
+    if SCHEMA[col] == 'category':
+        codes = np.load(os.path.join(path, f'{col}.codes.npy'), mmap_mode='r')
+        cats = np.load(os.path.join(path, f'{col}.cats.npy'))
+        return pd.Categorical.from_codes(codes, pd.Index(cats.tolist(), dtype='str'))
+    return np.load(os.path.join(path, f'{col}.npy'), mmap_mode='r')
+
+
+def _read_manifest(store_dir):
+    path = os.path.join(store_dir, MANIFEST)
+    if not os.path.isfile(path):
+        return {'files': {}, 'tasks': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _scan(data_dir, store_dir):
+    """Every data CSV under data_dir, except schedules and tasklib.shards merge outputs (their shards are read instead)."""
+    found = {}
+    skip = os.path.abspath(store_dir)
+    for root, dirs, files in os.walk(data_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != skip)
+        for f in sorted(files):
+            if not f.endswith('.csv') or f.endswith('_schedule.csv'):
+                continue
+            path = os.path.join(root, f)
+            if os.path.isfile(path + '.merged.json'):
+                continue
+            found[os.path.relpath(path, data_dir).replace(os.sep, '/')] = path
+    return found
+
+
+def ingest(data_dir, store_dir=None):
+    """Bring the store up to date with data_dir; returns counts of new/changed/removed files and rows parsed."""
+    store_dir = store_dir or os.path.join(data_dir, '_store')
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = _read_manifest(store_dir)
+    files = _scan(data_dir, store_dir)
+
+    parsed, changed, info = [], set(), {}
+    for relpath, path in files.items():
+        st = os.stat(path)
+        old = manifest['files'].get(relpath)
+        if old and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+            continue
+        sha1 = file_hash(path)
+        info[relpath] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': sha1}
+        if old and old['sha1'] == sha1: # touched, not changed
+            info[relpath]['rows'] = old['rows']
+            continue
+        parsed.append(read_file(path, relpath))
+        if old:
+            changed.add(relpath)
+    removed = set(manifest['files']) - set(files)
+    stale = changed | removed
+
+    # one vectorized pass over all new rows, not one per file
+    new = normalize(pd.concat(parsed, ignore_index=True)) if parsed else pd.DataFrame(columns=list(SCHEMA))
+    counts = new.groupby(['source', 'task']).size()
+    for relpath in (f for f in info if 'rows' not in info[f]):
+        info[relpath]['rows'] = {task: int(k) for task, k in counts.get(relpath, pd.Series()).items()}
+    tasks = set(new['task']) | {task for f in stale for task in manifest['files'][f]['rows']}
+    old_dirs = []
+    for task in sorted(tasks):
+        part = manifest['tasks'].get(task)
+        frames = [new[new['task'] == task]]
+        if part:
+            path = os.path.join(store_dir, part['dir'])
+            old = pd.DataFrame({col: _read_column(path, col) for col in SCHEMA})
+            frames.insert(0, old[~old['source'].isin(stale)])
+            old_dirs.append(path)
+        df = pd.concat(frames, ignore_index=True)
+        generation = part['generation'] + 1 if part else 1
+        name = f'{task}.{generation}'
+        _write_partition(os.path.join(store_dir, name), df)
+        manifest['tasks'][task] = {'dir': name, 'generation': generation, 'n_rows': len(df)}
+
+    for f in removed:
+        del manifest['files'][f]
+    manifest['files'].update(info)
+    _write_json(os.path.join(store_dir, MANIFEST), manifest) # the new partitions become current here
+    for path in old_dirs:
+        shutil.rmtree(path)
+    return {'new': len(parsed) - len(changed), 'changed': len(changed), 'removed': len(removed),
+            'rows_parsed': len(new), 'files': len(files)}
+
+
+def load(store_dir, columns=None, tasks=None):
+    """DataFrame of the given columns (default: all) for the given tasks (default: all)."""
+    manifest = _read_manifest(store_dir)
+    columns = list(columns or SCHEMA)
+    tasks = [t for t in (tasks or sorted(manifest['tasks'])) if t in manifest['tasks']]
+    parts = [os.path.join(store_dir, manifest['tasks'][t]['dir']) for t in tasks]
+    data = {}
+    for col in columns:
+        values = [_read_column(path, col) for path in parts]
+        if SCHEMA[col] == 'category':
+            data[col] = pd.api.types.union_categoricals(values) if values else pd.Categorical([])
+        else:
+            data[col] = np.concatenate(values) if values else np.array([], dtype=SCHEMA[col])
+    return pd.DataFrame(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Update or summarize the columnar behavioral data store.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    ing = sub.add_parser('ingest', help='parse new or changed CSVs under DATA_DIR into the store')
+    ing.add_argument('data_dir')
+    ing.add_argument('--store', default=None, help='store directory (default: DATA_DIR/_store)')
+    info = sub.add_parser('info', help='rows per task')
+    info.add_argument('store')
+    args = parser.parse_args()
+
+    if args.cmd == 'ingest':
+        start = time.perf_counter()
+        counts = ingest(args.data_dir, args.store)
+        print(f"{counts['files']} files: {counts['new']} new, {counts['changed']} changed, {counts['removed']} removed, "
+              f"{counts['rows_parsed']} rows parsed in {time.perf_counter() - start:.2f}s")
+    else:
+        for task, part in _read_manifest(args.store)['tasks'].items():
+            print(f"{task}: {part['n_rows']} rows")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Signal-detection scoring of N-back trials, for any number of subjects at once.
+
+    python sdt.py ../_data/demos/_store --out nback_sdt.csv
+
+score_nback() counts hits, misses, false alarms and correct rejections and
+summarizes RTs per subject x run x block x n x stim_type (or any other
+grouping) with grouped pandas reductions, so rescoring the whole archive
+after a rule change is one call, not a loop over subjects.
+
+Rates of 0 or 1 give infinite z-scores. CORRECTIONS:
+    'loglinear' (Hautus, 1995): (count + 0.5) / (trials + 1), applied to every cell
+    '1/2n' (Macmillan & Kaplan, 1985): only rates of 0 or 1, moved to 1/2n or 1 - 1/2n
+    None: raw rates (d' is +-inf where a rate is 0 or 1)
+"""
+import argparse, time
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+GROUP_BY = ['participant_name', 'run', 'block', 'n', 'stim_type']
+COLUMNS = GROUP_BY + ['is_target', 'response', 'rt'] # what score_nback reads from the datastore
+CORRECTIONS = ('loglinear', '1/2n', None)
+
+
+def rates(count, trials, correction='loglinear'):
+    """count / trials with one of CORRECTIONS (arrays in, array out; NaN where there are no trials)."""
+    count = np.asarray(count, dtype=float)
+    trials = np.asarray(trials, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if correction == 'loglinear':
+            return np.where(trials > 0, (count + 0.5) / (trials + 1), np.nan)
+        rate = count / trials
+        if correction == '1/2n':
+            rate = np.clip(rate, 0.5 / trials, 1 - 0.5 / trials)
+        elif correction is not None:
+            raise ValueError(f'correction must be one of {CORRECTIONS}')
+        return rate
+
+
+def score_nback(df, by=GROUP_BY, correction='loglinear'):
+    """One row per group: trial counts, hit/false-alarm rates, d', criterion c and RTs.
+
+    df needs is_target and a response (a non-empty 'response' or an 'rt');
+    groups with missing keys (e.g. no run/block in the web demos) are kept.
+    """
+    by = [c for c in by if c in df]
+    target = df['is_target'].to_numpy(dtype=float) == 1
+    responded = np.zeros(len(df), dtype=bool)
+    if 'response' in df:
+        responded |= df['response'].notna().to_numpy() & (df['response'].astype(object) != '').to_numpy()
+    if 'rt' in df:
+        responded |= df['rt'].notna().to_numpy()
+    hit = target & responded
+    fa = ~target & responded
+    rt = df['rt'].to_numpy(dtype=float) if 'rt' in df else np.full(len(df), np.nan)
+
+    trials = pd.DataFrame({'targets': target, 'nontargets': ~target, 'hits': hit, 'false_alarms': fa,
+                           'rt_hit': np.where(hit, rt, np.nan), 'rt_fa': np.where(fa, rt, np.nan)}, index=df.index)
+    groups = trials.groupby([df[c] for c in by], observed=True, dropna=False, sort=True)
+    out = groups[['targets', 'nontargets', 'hits', 'false_alarms']].sum().astype(np.int64)
+    out['misses'] = out['targets'] - out['hits']
+    out['correct_rejections'] = out['nontargets'] - out['false_alarms']
+    out['accuracy'] = (out['hits'] + out['correct_rejections']) / (out['targets'] + out['nontargets'])
+
+    out['hit_rate'] = rates(out['hits'], out['targets'], None)
+    out['fa_rate'] = rates(out['false_alarms'], out['nontargets'], None)
+    z_hit = stats.norm.ppf(rates(out['hits'], out['targets'], correction))
+    z_fa = stats.norm.ppf(rates(out['false_alarms'], out['nontargets'], correction))
+    out['d_prime'] = z_hit - z_fa
+    out['criterion'] = -(z_hit + z_fa) / 2
+
+    out['rt_hit_mean'] = groups['rt_hit'].mean()
+    out['rt_hit_median'] = groups['rt_hit'].median()
+    out['rt_hit_sd'] = groups['rt_hit'].std()
+    out['rt_fa_mean'] = groups['rt_fa'].mean()
+    return out.reset_index()
+
+
+def main():
+    from datastore import load
+
+    parser = argparse.ArgumentParser(description="Hit/false-alarm rates, d' and criterion for every N-back block in the store.")
+    parser.add_argument('store', help='datastore directory, e.g. ../_data/demos/_store')
+    parser.add_argument('--by', nargs='*', default=GROUP_BY, help='grouping columns')
+    parser.add_argument('--correction', default='loglinear', choices=['loglinear', '1/2n', 'none'])
+    parser.add_argument('--out', default=None, help='CSV to write (default: print)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = load(args.store, COLUMNS, tasks=['nback'])
+    scores = score_nback(df, args.by, None if args.correction == 'none' else args.correction)
+    print(f'{len(df)} trials -> {len(scores)} groups in {time.perf_counter() - start:.2f}s')
+    if args.out:
+        scores.to_csv(args.out, index=False)
+    else:
+        print(scores.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""Run run_hcp_glm for many subjects in parallel, resumably.
+
+    python batch_glm.py subjects.txt --contrasts 2bk-0bk 2bk 0bk
+    python batch_glm.py 100307 100408 --contrasts 2bk-0bk --workers 4
+
+subjects.txt has one subject per line: "subject_id [out_name [contrast,contrast,...]]"
+(out_name defaults to the subject ID, contrasts to --contrasts; # starts a comment).
+
+Each subject runs in its own process, so a crash (or the kernel killing a worker
+that ran out of memory) costs only that subject, and its peak RSS is its own.
+A finished subject gets OUTPUT_DIR/_status/<out_name>.done.json; a rerun skips
+it unless it lacks a requested contrast, and retries everything that failed.
+The number of concurrent workers is capped so that workers x expected peak
+memory (the largest peak seen in earlier runs, or an estimate from the image
+size) fits in --mem-fraction of physical memory. --lean fits with
+lean_glm.LeanGLM, which needs a fraction of the memory, so more workers fit.
+With --cache-dir fits are kept (see glm_cache.py), and --contrasts-only then
+computes new contrasts from them without refitting.
+"""
+import argparse, csv, json, multiprocessing, os, sys, time, traceback
+import numpy as np
+
+from contrast_spec import CONTRASTS
+from run_individual_glm import HCP_DIR, OUTPUT_DIR, subject_paths
+
+STATUS_DIR = '_status'
+BASE_MEMORY_MB = 200 # interpreter, numpy, nilearn
+MEMORY_FACTOR = 3.3 # peak RSS beyond that / uncompressed float32 BOLD size (float64 copies, residuals, predictions)
+LEAN_MEMORY_FACTOR = 0.2 # the same for run_hcp_glm(lean=True)
+
+
+def read_subjects(args, default_contrasts):
+    """[(subject_id, out_name, contrasts)] from IDs and/or subject list files."""
+    subjects = []
+    for arg in args:
+        lines = open(arg).read().splitlines() if os.path.isfile(arg) else [arg]
+        for line in lines:
+            fields = line.split('#')[0].split()
+            if not fields:
+                continue
+            out_name = fields[1] if len(fields) > 1 else fields[0]
+            contrasts = fields[2].split(',') if len(fields) > 2 else list(default_contrasts)
+            subjects.append((fields[0], out_name, contrasts))
+    return subjects
+
+
+def physical_memory():
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def peak_rss_mb():
+    """This process's peak resident memory in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024 # bytes on macOS, KB on Linux
+
+
+def estimate_mb(subject_ids, hcp_dir, factor=MEMORY_FACTOR):
+    """Expected peak RSS per subject from the first readable BOLD header (no data is read); None if there is none."""
+    import nibabel as nib
+
+    for subject_id in subject_ids:
+        func_img = subject_paths(subject_id, hcp_dir)['func_img']
+        if os.path.isfile(func_img):
+            return BASE_MEMORY_MB + factor * np.prod(nib.load(func_img).shape) * 4 / 1024 / 1024
+    return None
+
+
+def status_path(output_dir, out_name, state):
+    return os.path.join(output_dir, STATUS_DIR, f'{out_name}.{state}.json')
+
+
+def _write_status(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def is_done(output_dir, out_name, contrasts):
+    path = status_path(output_dir, out_name, 'done')
+    if not os.path.isfile(path):
+        return False
+    with open(path) as f:
+        done = json.load(f)
+    return set(contrasts) <= set(done['contrasts']) and all(os.path.isfile(f) for f in done['outputs'])
+
+
+def run_subject(subject_id, out_name, contrasts, hcp_dir, output_dir, threads, glm_kwargs):
+    """Worker process: fit one subject and leave a done or failed marker."""
+    from threadpoolctl import threadpool_limits
+
+    from run_individual_glm import run_hcp_glm
+
+    start = time.perf_counter()
+    record = {'subject_id': subject_id, 'out_name': out_name, 'contrasts': contrasts, 'pid': os.getpid(),
+              'lean': bool(glm_kwargs.get('lean')), 'contrasts_only': bool(glm_kwargs.get('contrasts_only'))}
+    try:
+        missing = [p for p in subject_paths(subject_id, hcp_dir).values() if not os.path.exists(p)]
+        if missing:
+            raise FileNotFoundError(f'missing input(s): {", ".join(missing)}')
+        with threadpool_limits(threads): # workers x threads <= cores
+            outputs = run_hcp_glm(subject_id, out_name, contrasts, hcp_dir=hcp_dir, output_dir=output_dir, **glm_kwargs)
+    except BaseException as e:
+        record.update(error=f'{type(e).__name__}: {e}', traceback=traceback.format_exc(),
+                      wall_s=time.perf_counter() - start, peak_rss_mb=peak_rss_mb())
+        _write_status(status_path(output_dir, out_name, 'failed'), record)
+        raise SystemExit(1)
+    record.update(outputs=outputs, wall_s=time.perf_counter() - start, peak_rss_mb=peak_rss_mb(), finished=time.time())
+    done = status_path(output_dir, out_name, 'done')
+    if os.path.isfile(done): # keep the contrasts of earlier runs (e.g. before a --contrasts-only run)
+        with open(done) as f:
+            old = json.load(f)
+        record['contrasts'] = list(dict.fromkeys(old['contrasts'] + contrasts))
+        record['outputs'] = list(dict.fromkeys([o for o in old['outputs'] if o not in outputs] + outputs))
+    _write_status(done, record)
+    failed = status_path(output_dir, out_name, 'failed')
+    if os.path.isfile(failed):
+        os.remove(failed)
+
+
+def learned_mb(output_dir, lean=False):
+    """Largest peak RSS recorded by earlier runs in the same (lean or default) mode, if any."""
+    directory = os.path.join(output_dir, STATUS_DIR)
+    peaks = []
+    if os.path.isdir(directory):
+        for f in os.listdir(directory):
+            if f.endswith('.done.json'):
+                with open(os.path.join(directory, f)) as fh:
+                    done = json.load(fh)
+                if done.get('lean', False) == lean and not done.get('contrasts_only'): # those don't fit
+                    peaks.append(done.get('peak_rss_mb') or 0)
+    return max(peaks) if peaks else None
+
+
+def plan_workers(n_subjects, per_subject_mb, max_workers=None, mem_fraction=0.8):
+    """Concurrent workers that fit in memory (at least 1, at most the cores and the subjects)."""
+    budget = physical_memory() / 1024 / 1024 * mem_fraction
+    fit = int(budget // per_subject_mb) if per_subject_mb else os.cpu_count()
+    return max(1, min(fit, max_workers or os.cpu_count(), n_subjects))
+
+
+def run_batch(subjects, hcp_dir=HCP_DIR, output_dir=OUTPUT_DIR, max_workers=None, mem_fraction=0.8,
+              mem_per_subject_mb=None, force=False, glm_kwargs=None):
+    """Run every subject not already done; returns one summary row per subject."""
+    todo = [s for s in subjects if force or not is_done(output_dir, s[1], s[2])]
+    skipped = [s for s in subjects if s not in todo]
+    rows = [{'subject_id': s[0], 'out_name': s[1], 'status': 'skipped (done)'} for s in skipped]
+    if not todo:
+        return rows
+
+    lean = bool((glm_kwargs or {}).get('lean'))
+    per_subject = (mem_per_subject_mb or learned_mb(output_dir, lean)
+                   or estimate_mb([s[0] for s in todo], hcp_dir, LEAN_MEMORY_FACTOR if lean else MEMORY_FACTOR))
+    workers = plan_workers(len(todo), per_subject * 1.1 if per_subject else None, max_workers, mem_fraction)
+    threads = max(1, os.cpu_count() // workers)
+    print(f'[batch] {len(todo)} to run, {len(skipped)} already done; {workers} worker(s) x {threads} thread(s), '
+          f"~{f'{per_subject:.0f}' if per_subject else '?'} MB per subject")
+
+    ctx = multiprocessing.get_context('spawn') # fresh interpreter: per-subject peak RSS, no inherited state
+    pending = list(todo)
+    running = {}
+    start = time.perf_counter()
+    while pending or running:
+        while pending and len(running) < workers:
+            subject_id, out_name, contrasts = pending.pop(0)
+            proc = ctx.Process(target=run_subject, name=f'glm-{out_name}',
+                               args=(subject_id, out_name, contrasts, hcp_dir, output_dir, threads, glm_kwargs or {}))
+            proc.start()
+            running[proc] = (subject_id, out_name, contrasts)
+        for proc in list(running):
+            proc.join(timeout=0.2)
+            if proc.exitcode is None:
+                continue
+            subject_id, out_name, contrasts = running.pop(proc)
+            rows.append(_result_row(output_dir, subject_id, out_name, contrasts, proc.exitcode))
+            print(f"[batch] {out_name}: {rows[-1]['status']} ({len(rows) - len(skipped)}/{len(todo)})")
+    print(f'[batch] {len(todo)} subject(s) in {time.perf_counter() - start:.1f}s')
+    return rows
+
+
+def _result_row(output_dir, subject_id, out_name, contrasts, exitcode):
+    row = {'subject_id': subject_id, 'out_name': out_name}
+    done_path = status_path(output_dir, out_name, 'done')
+    if exitcode == 0 and os.path.isfile(done_path):
+        with open(done_path) as f:
+            done = json.load(f)
+        row.update(status='done', wall_s=done['wall_s'], peak_rss_mb=done['peak_rss_mb'])
+        return row
+    failed_path = status_path(output_dir, out_name, 'failed')
+    if not os.path.isfile(failed_path): # killed before it could say why
+        reason = 'killed (out of memory?)' if exitcode in (-9, 137) else f'exit code {exitcode}'
+        _write_status(failed_path, {'subject_id': subject_id, 'out_name': out_name, 'contrasts': contrasts, 'error': reason})
+    with open(failed_path) as f:
+        failed = json.load(f)
+    row.update(status='failed', error=failed['error'], wall_s=failed.get('wall_s'), peak_rss_mb=failed.get('peak_rss_mb'))
+    return row
+
+
+def write_summary(rows, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['subject_id', 'out_name', 'status', 'wall_s', 'peak_rss_mb', 'error'], restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the HCP working-memory GLM for many subjects, in parallel and resumably.')
+    parser.add_argument('subjects', nargs='+', help='subject IDs and/or files listing "subject_id [out_name [contrasts]]"')
+    parser.add_argument('--contrasts', nargs='+', default=['2bk-0bk'], help='contrasts (names in contrast_spec.CONTRASTS) for subjects that do not list their own')
+    parser.add_argument('--hcp-dir', default=HCP_DIR)
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--workers', type=int, default=None, help='upper limit on concurrent subjects (default: cores)')
+    parser.add_argument('--mem-fraction', type=float, default=0.8, help='share of physical memory the workers may use together')
+    parser.add_argument('--mem-per-subject-mb', type=float, default=None,
+                        help='expected peak RSS per subject (default: largest seen so far, else estimated from the image)')
+    parser.add_argument('--force', action='store_true', help='rerun subjects that are already done')
+    parser.add_argument('--lean', action='store_true', help='memory-lean chunked fit (lean_glm.LeanGLM)')
+    parser.add_argument('--cache-dir', default=None, help='reuse and keep fits in this glm_cache directory')
+    parser.add_argument('--contrasts-only', action='store_true', help='only compute contrasts from cached fits (needs --cache-dir)')
+    args = parser.parse_args()
+
+    if args.contrasts_only and not args.cache_dir:
+        parser.error('--contrasts-only needs --cache-dir')
+    subjects = read_subjects(args.subjects, args.contrasts)
+    unknown = sorted({c for s in subjects for c in s[2]} - set(CONTRASTS))
+    if unknown:
+        parser.error(f'unknown contrast(s) {", ".join(unknown)}; see python contrast_spec.py')
+    rows = run_batch(subjects, args.hcp_dir, args.output_dir, args.workers, args.mem_fraction,
+                     args.mem_per_subject_mb, args.force,
+                     {'lean': args.lean, 'cache_dir': args.cache_dir, 'contrasts_only': args.contrasts_only})
+    summary = os.path.join(args.output_dir, STATUS_DIR, 'batch_summary.csv')
+    write_summary(rows, summary)
+
+    print(f"{'out_name':<16}{'status':<18}{'wall_s':>8}{'peak_rss_mb':>13}")
+    for row in rows:
+        wall = f"{row['wall_s']:.1f}" if row.get('wall_s') is not None else '-'
+        rss = f"{row['peak_rss_mb']:.0f}" if row.get('peak_rss_mb') is not None else '-'
+        print(f"{row['out_name']:<16}{row['status']:<18}{wall:>8}{rss:>13}  {row.get('error', '')}")
+    print(f'summary: {summary}')
+    raise SystemExit(1 if any(r['status'] == 'failed' for r in rows) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Declarative first-level contrasts for the HCP working-memory task, computed together.
+
+    python contrast_spec.py                 # every contrast in CONTRASTS, as condition weights
+    python contrast_spec.py "faces - places"
+
+CONTRASTS maps a name to either
+  - an expression, a t contrast: '2bk - 0bk', 'faces - (body + places + tools) / 3'
+  - a list of expressions, an F test that any of them is nonzero.
+A name in an expression is a design column ('2bk_faces') or a part of one
+('2bk', 'faces') and stands for the mean of the columns it matches, so
+'2bk - 0bk' weighs each 2bk condition 1/4 and each 0bk condition -1/4.
+Expressions take +, -, numbers, * and / by numbers, and parentheses.
+
+compute_contrasts() evaluates all requested contrasts at once: the t
+contrasts as one product of the stacked contrast matrix with the betas and
+one quadratic form per AR bin for the variances, then effect, variance, t
+and z maps for all of them in one pass; each F test is one more product.
+"""
+import re, sys
+import numpy as np
+from scipy import stats
+from nilearn.glm.contrasts import DEF_DOFMAX, Contrast
+
+LOADS = ('0bk', '2bk')
+CATEGORIES = ('body', 'faces', 'places', 'tools')
+
+CONTRASTS = {
+    '2bk-0bk': '2bk - 0bk',
+    '2bk': '2bk',
+    '0bk': '0bk',
+    **{cat: cat for cat in CATEGORIES},
+    **{f'{cat}-others': f"{cat} - ({' + '.join(c for c in CATEGORIES if c != cat)}) / 3" for cat in CATEGORIES},
+    # load effect in one category minus the mean load effect in the other three
+    **{f'2bk-0bk_x_{cat}': f"(2bk_{cat} - 0bk_{cat}) - ({' + '.join(f'2bk_{c} - 0bk_{c}' for c in CATEGORIES if c != cat)}) / 3"
+       for cat in CATEGORIES},
+    'category': [f'{CATEGORIES[0]} - {cat}' for cat in CATEGORIES[1:]],
+    'load_x_category': [f'(2bk_{CATEGORIES[0]} - 0bk_{CATEGORIES[0]}) - (2bk_{cat} - 0bk_{cat})' for cat in CATEGORIES[1:]],
+    'task': [f'{load}_{cat}' for load in LOADS for cat in CATEGORIES],
+}
+
+# compute_contrasts() output -> file suffix; F tests have no single effect or variance
+MAPS = {'effect_size': 'beta', 'effect_variance': 'variance', 'stat': 't', 'z_score': 'z'}
+F_MAPS = {'stat': 'F', 'z_score': 'z'}
+
+_TOKEN = re.compile(r'\s*(?:(\d*\.?\d+(?!\w))|(\w+)|(.))')
+
+
+def select(name, columns):
+    """Weights averaging the design columns that are or contain `name` (as '_'-separated parts)."""
+    columns = list(columns)
+    if name in columns:
+        hits = [columns.index(name)]
+    else:
+        parts = set(name.split('_'))
+        hits = [i for i, col in enumerate(columns) if parts <= set(str(col).split('_'))]
+    if not hits:
+        raise ValueError(f'{name!r} matches no design column (columns: {", ".join(map(str, columns))})')
+    weights = np.zeros(len(columns))
+    weights[hits] = 1 / len(hits)
+    return weights
+
+
+def parse(expression, columns):
+    """Contrast vector over `columns` for one expression."""
+    tokens = []
+    for number, name, op in _TOKEN.findall(expression):
+        if op and op not in '+-*/()':
+            raise ValueError(f'unexpected {op!r} in contrast {expression!r}')
+        tokens.append(('num', float(number)) if number else ('name', name) if name else ('op', op))
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else ('end', None)
+
+    def take(kind=None, value=None):
+        nonlocal pos
+        tok = peek()
+        if (kind and tok[0] != kind) or (value and tok[1] != value):
+            raise ValueError(f'expected {value or kind} at {tok[1]!r} in contrast {expression!r}')
+        pos += 1
+        return tok
+
+    def expr():
+        value = term()
+        while peek() in (('op', '+'), ('op', '-')):
+            sign = 1 if take()[1] == '+' else -1
+            right = term()
+            if np.ndim(value) != np.ndim(right):
+                raise ValueError(f'can only add conditions to conditions in contrast {expression!r}')
+            value = value + sign * right
+        return value
+
+    def term():
+        value = factor()
+        while peek() in (('op', '*'), ('op', '/')):
+            op = take()[1]
+            right = factor()
+            if op == '/' and np.ndim(right):
+                raise ValueError(f'can only divide by a number in contrast {expression!r}')
+            if op == '*' and np.ndim(value) and np.ndim(right):
+                raise ValueError(f'can only multiply by a number in contrast {expression!r}')
+            value = value / right if op == '/' else value * right
+        return value
+
+    def factor():
+        kind, value = peek()
+        if (kind, value) in (('op', '-'), ('op', '+')):
+            take()
+            return -factor() if value == '-' else factor()
+        if kind == 'num':
+            return take()[1]
+        if kind == 'name':
+            return select(take()[1], columns)
+        take('op', '(')
+        value = expr()
+        take('op', ')')
+        return value
+
+    value = expr()
+    if peek()[0] != 'end':
+        raise ValueError(f'unexpected {peek()[1]!r} in contrast {expression!r}')
+    if not np.ndim(value):
+        raise ValueError(f'contrast {expression!r} names no condition')
+    return value
+
+
+def contrast_matrix(name, columns, spec=CONTRASTS):
+    """('t', 1 x p) or ('F', k x p) matrix for a contrast in `spec`."""
+    if name not in spec:
+        raise KeyError(f'unknown contrast {name!r} (known: {", ".join(spec)})')
+    definition = spec[name]
+    if isinstance(definition, str):
+        return 't', parse(definition, columns)[None]
+    return 'F', np.array([parse(d, columns) for d in definition])
+
+
+def glm_state(model):
+    """(theta, dispersion, label per voxel, covariance per label, dof, unmask) of a fitted LeanGLM or FirstLevelModel."""
+    if hasattr(model, 'theta_'):
+        return model.theta_, model.dispersion_, model.labels_, model.covs_, model.dof_, model.unmask
+    results = model.results_[0]
+    keys, labels = np.unique(model.labels_[0], return_inverse=True)
+    first = results[keys[0]]
+    theta = np.zeros((first.theta.shape[0], len(labels)))
+    dispersion = np.zeros(len(labels))
+    for i, key in enumerate(keys):
+        theta[:, labels == i] = results[key].theta
+        dispersion[labels == i] = results[key].dispersion
+    covs = np.array([results[key].cov for key in keys])
+    return theta, dispersion, labels, covs, first.df_residuals, model.masker_.inverse_transform
+
+
+def t_to_z(stat, dof):
+    """z-scores of t statistics, equal to nilearn's Contrast.z_score() but one t.sf per voxel instead of sf and cdf."""
+    p = stats.t.sf(np.abs(stat), min(dof, DEF_DOFMAX))
+    return np.sign(stat) * stats.norm.isf(np.clip(p, 1e-300, 1 - 1e-16))
+
+
+def compute_contrasts(model, names, spec=CONTRASTS):
+    """{name: {output: image}} for every contrast in `names`, outputs as in MAPS (t) or F_MAPS (F)."""
+    theta, dispersion, labels, covs, dof, unmask = glm_state(model)
+    columns = model.design_matrices_[0].columns
+    matrices = {name: contrast_matrix(name, columns, spec) for name in names}
+    out = {}
+
+    t_names = [n for n in names if matrices[n][0] == 't']
+    if t_names:
+        C = np.concatenate([matrices[n][1] for n in t_names]) # k x p
+        effect = C @ theta # k x voxels
+        variance = np.einsum('kp,lpq,kq->kl', C, covs, C)[:, labels] * dispersion
+        stat = Contrast(effect.ravel(), variance.ravel(), dim=1, dof=dof, stat_type='t').stat().reshape(effect.shape)
+        values = {'effect_size': effect, 'effect_variance': variance, 'stat': stat, 'z_score': t_to_z(stat, dof)}
+        for i, name in enumerate(t_names):
+            out[name] = {output: unmask(values[output][i]) for output in MAPS}
+
+    for name in (n for n in names if matrices[n][0] == 'F'):
+        C = matrices[name][1]
+        # whiten with a square root of inv(C cov C') per AR bin; sum of squares / dim is then F
+        effect = C @ theta
+        for i, cov in enumerate(covs):
+            cols = labels == i
+            effect[:, cols] = np.linalg.cholesky(np.linalg.inv(C @ cov @ C.T)).T @ effect[:, cols]
+        con = Contrast(effect, dispersion, dim=len(C), dof=dof, stat_type='F')
+        out[name] = {'stat': unmask(con.stat()), 'z_score': unmask(con.z_score())}
+    return out
+
+
+def main():
+    conditions = [f'{load}_{cat}' for load in LOADS for cat in CATEGORIES]
+    spec = {arg: arg for arg in sys.argv[1:]} or CONTRASTS
+    for name in spec:
+        kind, matrix = contrast_matrix(name, conditions, spec)
+        print(f'{name} ({kind}): {spec[name]}')
+        for row in matrix:
+            print('   ' + '  '.join(f'{c}={w:+.3g}' for c, w in zip(conditions, row) if w))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Disk cache of smoothed data and fitted GLMs, so new contrasts don't refit.
+
+    run_hcp_glm('100307', 'sub1', ['2bk-0bk'], cache_dir='/scratch/glm_cache')
+    run_hcp_glm('100307', 'sub1', ['faces-others'], cache_dir='/scratch/glm_cache', contrasts_only=True)
+    python glm_cache.py info /scratch/glm_cache
+    python glm_cache.py trim /scratch/glm_cache --max-gb 5
+
+Two kinds of entry, each a directory named after a hash of what produced it:
+  smooth-<key>  LeanGLM's smoothed, masked float32 data and voxel means
+                (key: BOLD image, mask, smoothing), reused when only the
+                design or noise model changes
+  fit-<key>     betas, residual variances, AR-bin covariances, design matrix
+                and mask (key: image, mask, events, confounds, GLM settings,
+                lean or not, nilearn version): all compute_contrasts() needs
+Input files are identified by path, size and modification time, not content.
+Entries are written under a temporary name and renamed, so concurrent
+workers never see half an entry. Reading an entry marks it used; after each
+write the least recently used entries are deleted until the cache is under
+max_bytes (the entry just written is kept even if it alone is larger).
+"""
+import argparse, hashlib, json, os, shutil, time
+import numpy as np
+import nibabel as nib
+import pandas as pd
+
+from contrast_spec import glm_state
+
+MAX_BYTES = 20 * 1024 ** 3
+
+
+def file_id(path):
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def _jsonable(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return hashlib.sha1(value.to_csv().encode()).hexdigest()
+    if isinstance(value, np.ndarray):
+        return hashlib.sha1(value.tobytes()).hexdigest()
+    return str(value)
+
+
+class GLMCache:
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, kind, *parts):
+        """Entry name for `kind` from any mix of JSON values, DataFrames and arrays."""
+        blob = json.dumps(parts, sort_keys=True, default=_jsonable)
+        return f'{kind}-{hashlib.sha1(blob.encode()).hexdigest()[:20]}'
+
+    def get(self, key):
+        """Path of the entry, marked as just used, or None."""
+        path = os.path.join(self.directory, key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key, write):
+        """Create the entry with write(directory) unless another process got there first; returns its path."""
+        path = os.path.join(self.directory, key)
+        tmp = f'{path}.tmp{os.getpid()}'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            write(tmp)
+            os.rename(tmp, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+        return path
+
+    def entries(self):
+        """[(key, bytes, last used)], least recently used first."""
+        out = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if '.tmp' in key or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                out.append((key, size, os.stat(path).st_mtime))
+            except FileNotFoundError: # evicted by another process meanwhile
+                pass
+        return sorted(out, key=lambda e: e[2])
+
+    def evict(self, keep=None, max_bytes=None):
+        """Delete least recently used entries until the total is under max_bytes; returns the keys deleted."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        deleted = []
+        for key, size, _ in entries:
+            if total <= max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total -= size
+            deleted.append(key)
+        return deleted
+
+    def load_fit(self, key):
+        """The cached fit as a FittedGLM, or None."""
+        path = self.get(key)
+        if path is None:
+            return None
+        with np.load(os.path.join(path, 'fit.npz')) as f:
+            design = pd.DataFrame(f['design'], columns=f['columns'].tolist())
+            return FittedGLM(f['theta'], f['dispersion'], f['labels'], f['covs'], float(f['dof']), f['mask'], f['affine'], design)
+
+    def save_fit(self, key, model):
+        """Store what compute_contrasts() needs from a fitted LeanGLM or FirstLevelModel."""
+        theta, dispersion, labels, covs, dof, _ = glm_state(model)
+        if hasattr(model, 'mask_'):
+            mask, affine = model.mask_, model.affine_
+        else:
+            mask, affine = np.asanyarray(model.masker_.mask_img_.dataobj) != 0, model.masker_.mask_img_.affine
+        design = model.design_matrices_[0]
+
+        def write(path):
+            np.savez(os.path.join(path, 'fit.npz'), theta=theta, dispersion=dispersion,
+                     labels=labels, covs=covs, dof=dof, mask=mask, affine=affine, design=design.to_numpy(),
+                     columns=np.array(design.columns, dtype=str))
+        return self.put(key, write)
+
+
+class FittedGLM:
+    """A fit restored from the cache, with the attributes compute_contrasts() reads."""
+
+    def __init__(self, theta, dispersion, labels, covs, dof, mask, affine, design):
+        self.theta_ = theta
+        self.dispersion_ = dispersion
+        self.labels_ = labels
+        self.covs_ = covs
+        self.dof_ = dof
+        self.mask_ = mask
+        self.affine_ = affine
+        self.design_matrices_ = [design]
+
+    def unmask(self, values):
+        out = np.zeros(self.mask_.shape, dtype=np.float32)
+        out[self.mask_] = values
+        return nib.Nifti1Image(out, self.affine_)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or shrink a GLM cache directory.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('info', help='entries, sizes and last use').add_argument('cache_dir')
+    trim = sub.add_parser('trim', help='delete least recently used entries down to --max-gb')
+    trim.add_argument('cache_dir')
+    trim.add_argument('--max-gb', type=float, required=True)
+    args = parser.parse_args()
+
+    cache = GLMCache(args.cache_dir)
+    if args.cmd == 'trim':
+        deleted = cache.evict(max_bytes=args.max_gb * 1024 ** 3)
+        print(f'deleted {len(deleted)} entr{"y" if len(deleted) == 1 else "ies"}')
+    entries = cache.entries()
+    for key, size, used in entries:
+        print(f"{key:<28}{size / 1024 ** 2:10.1f} MB  last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(used))}")
+    print(f'{len(entries)} entries, {sum(e[1] for e in entries) / 1024 ** 3:.2f} GB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Group-level tests on the subject beta maps run_hcp_glm writes, with permutation inference.
+
+    python group_glm.py one-sample 2bk-0bk                     # every subject with a done record for 2bk-0bk
+    python group_glm.py one-sample faces-others --subjects sub1 sub2 sub3 --n-perm 10000
+    python group_glm.py paired 2bk 0bk --subjects subjects.txt --workers 8
+
+one-sample tests mean(beta) > 0 over subjects; paired tests A > B within
+subjects (a one-sample test of the A - B maps). Subjects are out_names (or
+files listing them, as for batch_glm.py); by default, every subject whose
+batch_glm done record lists the contrast(s).
+
+Maps are never all held in memory. Each subject's map is read once, in turn,
+and written as one float32 row of a scratch matrix on disk; the group mask is
+the voxels that are finite and nonzero in every map (or --mask). Workers then
+take CHUNK_VOXELS columns at a time from the scratch file and sign-flip the
+subjects N_PERM times, the same flips for every chunk. The sum of squares
+doesn't change under sign flips, so every permuted t map of a chunk comes from
+one matrix product. Each chunk returns its t values, how often a permutation
+reached them, and its maximum t per permutation; the maximum over chunks is the
+max-t null distribution for family-wise error correction. Memory is a few maps
+plus, per worker, one subjects x CHUNK_VOXELS chunk; run time grows
+linearly with voxels x permutations x subjects and is split across workers.
+
+Writes, to --group-dir, {name}_mean.nii.gz (mean beta), _t, _logp (uncorrected
+-log10 p) and _logp_fwe (max-t corrected), name being the contrast or A-vs-B.
+"""
+import argparse, json, multiprocessing, os, tempfile, time
+import numpy as np
+import nibabel as nib
+
+from batch_glm import STATUS_DIR, read_subjects
+from lean_glm import _read_columns
+from run_individual_glm import OUTPUT_DIR
+
+N_PERM = 5000
+CHUNK_VOXELS = 2000 # in-mask voxels per task
+N_PERM_BATCH = 500 # permutations at a time (N_PERM_BATCH x CHUNK_VOXELS x 8 bytes of t values)
+SEED = 0
+
+
+def beta_path(output_dir, out_name, contrast):
+    return os.path.join(output_dir, f'{out_name}_{contrast}_beta.nii.gz')
+
+
+def done_subjects(output_dir, contrasts):
+    """out_names whose batch_glm done record lists all of `contrasts`, in name order."""
+    directory = os.path.join(output_dir, STATUS_DIR)
+    names = []
+    for f in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        if f.endswith('.done.json'):
+            with open(os.path.join(directory, f)) as fh:
+                done = json.load(fh)
+            if set(contrasts) <= set(done['contrasts']):
+                names.append(done['out_name'])
+    return names
+
+
+def write_matrix(paths, scratch, mask_img=None):
+    """Stack subject maps (or A - B differences, for pairs of paths) as float32 rows of a file, one map in memory at a time.
+
+    Returns (mask, affine): the voxels finite and nonzero in every map, within mask_img if given.
+    """
+    mask, affine = None, None
+    with open(scratch, 'wb') as f:
+        for path in paths:
+            pair = path if isinstance(path, tuple) else (path,)
+            imgs = [nib.load(p) for p in pair]
+            if mask is None:
+                affine = imgs[0].affine
+                mask = (np.asanyarray(nib.load(mask_img).dataobj) != 0) if mask_img else np.ones(imgs[0].shape[:3], bool)
+            for p, img in zip(pair, imgs):
+                if img.shape[:3] != mask.shape or not np.allclose(img.affine, affine):
+                    raise ValueError(f'{p} is not on the grid of the first map {mask.shape}')
+            maps = [np.asarray(img.dataobj, dtype=np.float32).reshape(mask.shape) for img in imgs]
+            for m in maps:
+                mask &= np.isfinite(m) & (m != 0)
+            row = maps[0] - maps[1] if len(maps) == 2 else maps[0]
+            f.write(np.nan_to_num(row).ravel().tobytes())
+    return mask, affine
+
+
+def flips(n_subjects, n_perm, seed=SEED):
+    """n_perm x n_subjects random signs; the first row is the unpermuted data."""
+    signs = np.random.default_rng(seed).choice(np.array([-1.0, 1.0]), size=(n_perm, n_subjects))
+    signs[0] = 1
+    return signs
+
+
+def _t(sums, sumsq, n):
+    """One-sample t from sums and sums of squares over n subjects, computed in place of `sums`."""
+    denom = sums * sums
+    np.subtract(n * sumsq, denom, out=denom) # n^2 (n - 1) x variance
+    np.maximum(denom, 1e-30, out=denom)
+    denom /= n - 1
+    np.sqrt(denom, out=denom)
+    return np.divide(sums, denom, out=sums)
+
+
+_shared = {} # per worker process: the scratch file, its shape, the flips and the tail
+
+
+def _init_worker(scratch, n_subjects, n_grid, signs, two_sided):
+    from threadpoolctl import threadpool_limits
+
+    threadpool_limits(1) # workers x 1 thread
+    _shared.update(scratch=scratch, n_subjects=n_subjects, n_grid=n_grid, signs=signs, two_sided=two_sided)
+
+
+def permute_chunk(c0, c1, voxels):
+    """Worker: mean, t, exceedance count and per-permutation max t for the in-mask `voxels` of grid range c0:c1."""
+    n, signs, two_sided = _shared['n_subjects'], _shared['signs'], _shared['two_sided']
+    with open(_shared['scratch'], 'rb') as f:
+        Y = _read_columns(f, n, _shared['n_grid'], c0, c1)[:, voxels - c0].astype(np.float64)
+    sumsq = (Y ** 2).sum(axis=0)
+    mean = Y.mean(axis=0)
+    t = _t(Y.sum(axis=0), sumsq, n)
+    observed = np.abs(t) if two_sided else t
+    count = np.zeros(len(voxels), dtype=np.int64)
+    maxima = np.empty(len(signs))
+    for p0 in range(0, len(signs), N_PERM_BATCH):
+        perm = _t(signs[p0:p0 + N_PERM_BATCH] @ Y, sumsq, n)
+        if two_sided:
+            np.abs(perm, out=perm)
+        count += (perm >= observed - 1e-12).sum(axis=0)
+        maxima[p0:p0 + N_PERM_BATCH] = perm.max(axis=1)
+    return mean, t, count, maxima
+
+
+def group_test(paths, name, group_dir, n_perm=N_PERM, workers=None, mask_img=None, two_sided=False, seed=SEED,
+               scratch_dir=None):
+    """One-sample permutation test over subject maps (pairs of paths: over their differences); returns the files written."""
+    n = len(paths)
+    if n < 2:
+        raise ValueError(f'need at least 2 subjects, got {n}')
+    missing = [p for pair in paths for p in (pair if isinstance(pair, tuple) else (pair,)) if not os.path.isfile(p)]
+    if missing:
+        raise FileNotFoundError(f'missing map(s): {", ".join(missing)}')
+    os.makedirs(group_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    signs = flips(n, n_perm, seed)
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='group_glm_', dir=scratch_dir) as tmp:
+        scratch = os.path.join(tmp, 'maps.f32')
+        mask, affine = write_matrix(paths, scratch, mask_img)
+        loaded = time.perf_counter()
+        flat_mask = np.flatnonzero(mask.ravel())
+        n_grid = mask.size
+        # contiguous grid ranges holding about CHUNK_VOXELS in-mask voxels each
+        bounds = flat_mask[::CHUNK_VOXELS].tolist() + [flat_mask[-1] + 1] if len(flat_mask) else []
+        tasks = [(c0, c1, flat_mask[(flat_mask >= c0) & (flat_mask < c1)]) for c0, c1 in zip(bounds[:-1], bounds[1:])]
+        mean, t = np.zeros(n_grid), np.zeros(n_grid)
+        count = np.full(n_grid, n_perm)
+        maxima = np.full(n_perm, -np.inf)
+        with multiprocessing.get_context('spawn').Pool(min(workers, max(len(tasks), 1)), _init_worker,
+                                                       (scratch, n, n_grid, signs, two_sided)) as pool:
+            for (_, _, idx), (m, tv, cnt, mx) in zip(tasks, pool.starmap(permute_chunk, tasks, chunksize=1)):
+                mean[idx], t[idx], count[idx] = m, tv, cnt
+                maxima = np.maximum(maxima, mx)
+    observed = np.abs(t) if two_sided else t
+    logp = -np.log10(count / n_perm)
+    exceed = n_perm - np.searchsorted(np.sort(maxima), observed[flat_mask] - 1e-12)
+    logp_fwe = np.zeros_like(logp)
+    logp_fwe[flat_mask] = -np.log10(exceed / n_perm)
+    print(f'[group] {name}: {n} subjects, {len(flat_mask)} voxels, {n_perm} permutations; '
+          f'maps read in {loaded - start:.1f}s, permutations in {time.perf_counter() - loaded:.1f}s ({workers} workers)')
+
+    written = []
+    for suffix, values in (('mean', mean), ('t', t), ('logp', logp), ('logp_fwe', logp_fwe)):
+        path = os.path.join(group_dir, f'{name}_{suffix}.nii.gz')
+        nib.Nifti1Image(np.where(mask.ravel(), values, 0).reshape(mask.shape).astype(np.float32), affine).to_filename(path)
+        written.append(path)
+    print(f"[group] saved {os.path.join(group_dir, name)}_*.nii.gz; {(logp_fwe > -np.log10(0.05)).sum()} voxels at FWE p < .05")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Group-level permutation tests on subject beta maps.')
+    parser.add_argument('test', choices=['one-sample', 'paired'])
+    parser.add_argument('contrasts', nargs='+', help='one contrast (one-sample) or two, A B, for A > B (paired)')
+    parser.add_argument('--subjects', nargs='+', default=None,
+                        help='out_names and/or files listing them (default: every subject batch_glm finished)')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help='where the subject maps are (run_hcp_glm output_dir)')
+    parser.add_argument('--group-dir', default=None, help='where to write group maps (default: OUTPUT_DIR/group)')
+    parser.add_argument('--mask', default=None, help='restrict to this mask (default: voxels nonzero in every map)')
+    parser.add_argument('--n-perm', type=int, default=N_PERM)
+    parser.add_argument('--two-sided', action='store_true')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: cores)')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--scratch-dir', default=None, help='for the temporary subjects x voxels file')
+    args = parser.parse_args()
+
+    if len(args.contrasts) != (2 if args.test == 'paired' else 1):
+        parser.error(f"{args.test} takes {'two contrasts' if args.test == 'paired' else 'one contrast'}")
+    if args.subjects:
+        out_names = [s[1] for s in read_subjects(args.subjects, [])]
+    else:
+        out_names = done_subjects(args.output_dir, args.contrasts)
+    if args.test == 'paired':
+        a, b = args.contrasts
+        paths = [(beta_path(args.output_dir, s, a), beta_path(args.output_dir, s, b)) for s in out_names]
+        name = f'{a}-vs-{b}'
+    else:
+        paths = [beta_path(args.output_dir, s, args.contrasts[0]) for s in out_names]
+        name = args.contrasts[0]
+    group_test(paths, name, args.group_dir or os.path.join(args.output_dir, 'group'), args.n_perm, args.workers,
+               args.mask, args.two_sided, args.seed, args.scratch_dir)
+
+
+if __name__ == '__main__':
+    main()
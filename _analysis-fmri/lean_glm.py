@@ -0,0 +1,208 @@
+"""Memory-lean first-level GLM, a drop-in for the FirstLevelModel settings in run_individual_glm.
+
+    run_hcp_glm('100307', 'sub1', ['2bk-0bk'], lean=True)
+    python lean_glm.py compare 100307 --hcp-dir /data/hcp --output-dir /tmp/glm_compare
+
+FirstLevelModel(minimize_memory=False) loads the whole 4D image, smooths it in
+float64-sized temporaries and keeps residuals and predicted time series for
+every voxel. LeanGLM instead:
+  - reads the BOLD image CHUNK_VOLUMES volumes at a time as float32 (a .nii.gz
+    is decompressed in one sequential pass), smooths each chunk and writes the
+    in-mask voxels to a scratch file on disk (or to a glm_cache entry, which
+    later fits of the same image reuse),
+  - fits the GLM (same design, percent-signal scaling, AR(1) with the same
+    coefficient bins as nilearn's run_glm) CHUNK_VOXELS voxels at a time,
+    reading just those columns back from the scratch file,
+  - keeps only what contrasts need: the betas, the residual variance of every
+    voxel and one unscaled covariance per AR(1) bin.
+Effect sizes match FirstLevelModel up to float32 rounding. `compare` fits one
+subject both ways in separate processes and reports runtime and peak RSS.
+"""
+import argparse, multiprocessing, os, tempfile, time
+import numpy as np
+import nibabel as nib
+import pandas as pd
+from nilearn import image
+from nilearn.glm.contrasts import Contrast
+from nilearn.glm.first_level import make_first_level_design_matrix, run_glm
+
+from glm_cache import file_id
+
+CHUNK_VOLUMES = 8 # volumes read and smoothed at a time
+CHUNK_VOXELS = 5000 # voxels fitted at a time (about 50 MB of run_glm temporaries for 405 volumes)
+NOISE_MODELS = ('ar1', 'ols') # ar2+ clusters AR coefficients over all voxels at once, so it can't be chunked
+
+
+def _read_columns(f, n_rows, n_cols, c0, c1):
+    """Columns c0:c1 of a row-major float32 matrix in file f, one read per row.
+
+    Not np.memmap: the kernel maps the page cache in large folios, so a
+    column slice through a map pulls most of the file into our RSS.
+    """
+    out = np.empty((n_rows, c1 - c0), dtype=np.float32)
+    for i in range(n_rows):
+        f.seek((i * n_cols + c0) * 4)
+        f.readinto(out[i])
+    return out
+
+
+class LeanGLM:
+    """Single-run GLM with the FirstLevelModel interface run_hcp_glm uses: fit(), design_matrices_, compute_contrast()."""
+
+    def __init__(self, t_r, mask_img, smoothing_fwhm=None, noise_model='ar1', hrf_model='glover', drift_model='cosine',
+                 high_pass=0.01, chunk_volumes=CHUNK_VOLUMES, chunk_voxels=CHUNK_VOXELS, scratch_dir=None, cache=None):
+        if noise_model not in NOISE_MODELS:
+            raise ValueError(f'noise_model must be one of {NOISE_MODELS}, not {noise_model!r}')
+        self.t_r = t_r
+        self.mask_img = mask_img
+        self.smoothing_fwhm = smoothing_fwhm
+        self.noise_model = noise_model
+        self.hrf_model = hrf_model
+        self.drift_model = drift_model
+        self.high_pass = high_pass
+        self.chunk_volumes = chunk_volumes
+        self.chunk_voxels = chunk_voxels
+        self.scratch_dir = scratch_dir
+        self.cache = cache # a glm_cache.GLMCache: keep the smoothed data there for the next fit
+
+    def make_design(self, n_scans, events, confounds=None):
+        """The design matrix FirstLevelModel would build (slice_time_ref=0)."""
+        names = None
+        if isinstance(confounds, pd.DataFrame):
+            names = confounds.columns.tolist()
+            confounds = confounds.to_numpy()
+        frame_times = np.linspace(0, (n_scans - 1) * self.t_r, n_scans)
+        return make_first_level_design_matrix(frame_times, events, self.hrf_model, self.drift_model, self.high_pass,
+                                              add_regs=confounds, add_reg_names=names)
+
+    def fit(self, run_img, events, confounds=None):
+        img = nib.load(run_img, keep_file_open=True) if isinstance(run_img, str) else run_img
+        if len(img.shape) != 4:
+            raise ValueError(f'expected a 4D image, got shape {img.shape}')
+        mask = np.asanyarray(nib.load(self.mask_img).dataobj) != 0
+        if mask.shape != img.shape[:3] or not np.allclose(nib.load(self.mask_img).affine, img.affine):
+            raise ValueError(f'mask {mask.shape} is not on the grid of the BOLD image {img.shape[:3]}')
+        self.mask_ = mask
+        self.affine_ = img.affine
+        n_scans = img.shape[3]
+        design = self.make_design(n_scans, events, confounds)
+        self.design_matrices_ = [design]
+
+        if self.cache is not None and isinstance(run_img, str):
+            key = self.cache.key('smooth', file_id(run_img), file_id(self.mask_img), self.smoothing_fwhm)
+            path = self.cache.get(key) or self.cache.put(key, lambda d: self._write_masked(img, mask, d))
+            self._fit_chunks(path, n_scans, design.to_numpy())
+        else:
+            with tempfile.TemporaryDirectory(prefix='lean_glm_', dir=self.scratch_dir) as path:
+                self._write_masked(img, mask, path)
+                self._fit_chunks(path, n_scans, design.to_numpy())
+        return self
+
+    def _write_masked(self, img, mask, directory):
+        """Smoothed in-mask voxels to directory/data.f32 (time x voxel float32) and their means to mean.npy."""
+        total = np.zeros(int(mask.sum()))
+        with open(os.path.join(directory, 'data.f32'), 'wb') as f:
+            for t0 in range(0, img.shape[3], self.chunk_volumes):
+                chunk = np.asarray(img.dataobj[..., t0:t0 + self.chunk_volumes], dtype=np.float32)
+                if self.smoothing_fwhm:
+                    chunk = image.smooth_img(nib.Nifti1Image(chunk, img.affine), self.smoothing_fwhm).get_fdata(dtype=np.float32)
+                masked = np.ascontiguousarray(chunk[mask].T) # (volumes, voxels), the masker's voxel order
+                del chunk
+                total += masked.sum(axis=0)
+                f.write(masked.tobytes())
+        np.save(os.path.join(directory, 'mean.npy'), total / img.shape[3])
+
+    def _fit_chunks(self, directory, n_scans, X):
+        mean = np.load(os.path.join(directory, 'mean.npy'))
+        n_voxels = len(mean)
+        self.theta_ = np.zeros((X.shape[1], n_voxels), dtype=np.float32)
+        self.dispersion_ = np.zeros(n_voxels)
+        self.labels_ = np.zeros(n_voxels, dtype=np.int32) # index into covs_
+        keys, covs = {}, []
+        # percent signal change, as mean_scaling(Y, 0)
+        scale = np.maximum(mean, 1).astype(np.float32)
+        with open(os.path.join(directory, 'data.f32'), 'rb') as f:
+            for v0 in range(0, n_voxels, self.chunk_voxels):
+                v1 = min(v0 + self.chunk_voxels, n_voxels)
+                Y = _read_columns(f, n_scans, n_voxels, v0, v1)
+                Y /= scale[v0:v1]
+                Y -= 1
+                Y *= 100
+                labels, results = run_glm(Y, X, noise_model=self.noise_model)
+                del Y
+                for key, res in results.items():
+                    if key not in keys:
+                        keys[key] = len(covs)
+                        covs.append(res.cov)
+                    cols = v0 + np.flatnonzero(labels == key)
+                    self.theta_[:, cols] = res.theta
+                    self.dispersion_[cols] = res.dispersion
+                    self.labels_[cols] = keys[key]
+                    self.dof_ = res.df_residuals
+        self.covs_ = np.array(covs)
+
+    def contrast(self, con_val):
+        """nilearn Contrast (t) for one contrast vector, from the stored betas and covariances."""
+        con_val = np.asarray(con_val, dtype=float)
+        effect = con_val @ self.theta_.astype(np.float64)
+        variance = self.dispersion_ * np.einsum('p,kpq,q->k', con_val, self.covs_, con_val)[self.labels_]
+        return Contrast(effect=effect, variance=variance, dim=1, dof=self.dof_, stat_type='t')
+
+    def compute_contrast(self, contrast_def, output_type='z_score'):
+        """Map of one t contrast: 'effect_size', 'effect_variance', 'stat', 'p_value' or 'z_score'."""
+        con = self.contrast(contrast_def)
+        values = {'effect_size': con.effect_size, 'effect_variance': con.effect_variance, 'stat': con.stat,
+                  'p_value': con.p_value, 'z_score': con.z_score}[output_type]()
+        return self.unmask(values)
+
+    def unmask(self, values):
+        out = np.zeros(self.mask_.shape, dtype=np.float32)
+        out[self.mask_] = values
+        return nib.Nifti1Image(out, self.affine_)
+
+
+def _compare_worker(subject_id, out_name, contrasts, hcp_dir, output_dir, lean, queue):
+    from batch_glm import peak_rss_mb
+    from run_individual_glm import run_hcp_glm
+
+    start = time.perf_counter()
+    outputs = run_hcp_glm(subject_id, out_name, contrasts, hcp_dir=hcp_dir, output_dir=output_dir, lean=lean)
+    queue.put({'outputs': outputs, 'wall_s': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()})
+
+
+def compare(subject_id, contrasts, hcp_dir, output_dir):
+    """Fit one subject with the current settings and with LeanGLM, each in a fresh process."""
+    ctx = multiprocessing.get_context('spawn')
+    runs = {}
+    for mode, lean in (('default', False), ('lean', True)):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_compare_worker, args=(subject_id, f'{subject_id}_{mode}', contrasts, hcp_dir,
+                                                         output_dir, lean, queue))
+        proc.start()
+        runs[mode] = queue.get()
+        proc.join()
+    for mode, run in runs.items():
+        print(f"{mode:<8} {run['wall_s']:7.1f} s {run['peak_rss_mb']:8.0f} MB peak RSS")
+    for default, lean in zip(runs['default']['outputs'], runs['lean']['outputs']):
+        a, b = nib.load(default).get_fdata(), nib.load(lean).get_fdata()
+        name = os.path.basename(default)[len(subject_id) + len('_default_'):]
+        print(f'{name}: max |default - lean| = {np.abs(a - b).max():.2g} (max |value| {np.abs(a).max():.3g})')
+    return runs
+
+
+def main():
+    from run_individual_glm import HCP_DIR
+
+    parser = argparse.ArgumentParser(description='Compare runtime and peak memory of the default and lean GLM.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    cmp = sub.add_parser('compare', help='fit one subject both ways and compare')
+    cmp.add_argument('subject_id')
+    cmp.add_argument('--contrasts', nargs='+', default=['2bk-0bk'])
+    cmp.add_argument('--hcp-dir', default=HCP_DIR)
+    cmp.add_argument('--output-dir', default=os.path.join(tempfile.gettempdir(), 'lean_glm_compare'))
+    args = parser.parse_args()
+    compare(args.subject_id, args.contrasts, args.hcp_dir, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
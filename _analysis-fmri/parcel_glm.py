@@ -0,0 +1,255 @@
+"""Region-level GLM for the HCP working-memory run: ROI mean time series, all subjects fitted in one batch.
+
+    python parcel_glm.py subjects.txt --atlas parcels.nii.gz --labels parcels.txt --contrasts 2bk-0bk faces-others
+    python parcel_glm.py 100307 100408 --roi dlpfc=dlpfc.nii.gz --roi ffa=ffa.nii.gz --cache-dir /scratch/glm_cache
+
+Regions are binary masks (--roi, repeatable) and/or the labels of an integer
+atlas (--atlas, named by --labels: one name per line for labels 1, 2, ...,
+or "label name" lines), resampled onto the BOLD grid if needed and restricted
+to each subject's brain mask. One pass over a subject's BOLD image gives the
+mean signal of every region; with --cache-dir it is kept in the glm_cache
+directory (as parcels-<key>), so later runs with other contrasts or subjects
+read only a small array. Subjects are extracted in parallel worker processes.
+
+The GLM is run_hcp_glm's (same design matrix, percent signal change, AR(1)
+with nilearn's coefficient bins; GLM_SETTINGS' smoothing is skipped, as
+averaging over a region already pools the voxels), fitted for every subject
+and region at once. AR(1) prewhitening is rewritten in terms of the lag-0 and
+lag-1 cross-products of X and Y, so the whitened normal equations of all
+(subject, region) pairs are one stacked solve, without building any whitened
+design matrices. Contrasts are those of contrast_spec; the result is one table
+with a row per subject, contrast and region holding effect_size,
+effect_variance, stat (t or F) and z_score, as compute_contrasts' maps.
+"""
+import argparse, json, multiprocessing, os, time
+import numpy as np
+import nibabel as nib
+import pandas as pd
+from scipy import sparse
+from nilearn.glm.contrasts import Contrast
+
+from batch_glm import read_subjects
+from contrast_spec import CONTRASTS, contrast_matrix, t_to_z
+from glm_cache import GLMCache, file_id
+from lean_glm import CHUNK_VOLUMES, LeanGLM
+from realtime_glm import load_rois
+from run_individual_glm import GLM_SETTINGS, HCP_DIR, OUTPUT_DIR, load_confounds, load_events, subject_paths
+
+AR_BINS = 100 # AR(1) coefficients are truncated to multiples of 1 / AR_BINS, as in nilearn's run_glm
+BATCH_BYTES = 256 * 1024 ** 2 # subjects per stacked solve: about this much of (subject, region) covariances
+
+
+def read_labels(path):
+    """{'label_<value>': name} from one name per line (label 1, 2, ...) or "value name" lines."""
+    names = {}
+    with open(path) as f:
+        for i, line in enumerate(l.strip() for l in f if l.strip()):
+            value, _, name = line.partition(' ')
+            if value.isdigit() and name:
+                names[f'label_{value}'] = name.strip()
+            else:
+                names[f'label_{i + 1}'] = line
+    return names
+
+
+def roi_means(func_img, mask_img, roi_paths=(), atlas=None, chunk_volumes=CHUNK_VOLUMES):
+    """([region names], volumes x regions mean signal) of a 4D image within its brain mask, in one pass over the file."""
+    img = nib.load(func_img, keep_file_open=True)
+    mask = nib.load(mask_img)
+    if mask.shape[:3] != img.shape[:3]:
+        raise ValueError(f'mask {mask.shape} is not on the grid of the BOLD image {img.shape[:3]}')
+    in_mask = np.asanyarray(mask.dataobj).ravel(order='F') != 0
+    rois = load_rois(roi_paths, atlas, target=mask)
+    if not rois:
+        raise ValueError('no regions: give an atlas and/or ROI masks')
+    idx = [i[in_mask[i]] for _, i in rois]
+    sizes = np.array([len(i) for i in idx])
+    weights = sparse.csr_matrix((np.concatenate([np.full(len(i), 1 / max(len(i), 1)) for i in idx]),
+                                 (np.repeat(np.arange(len(idx)), sizes), np.concatenate(idx))),
+                                shape=(len(idx), in_mask.size))
+    out = np.empty((img.shape[3], len(rois)))
+    for t0 in range(0, img.shape[3], chunk_volumes):
+        chunk = np.asarray(img.dataobj[..., t0:t0 + chunk_volumes], dtype=np.float32)
+        out[t0:t0 + chunk.shape[3]] = (weights @ chunk.reshape(-1, chunk.shape[3], order='F')).T
+    out[:, sizes == 0] = np.nan # no voxel in the brain mask
+    return [name for name, _ in rois], out
+
+
+def subject_timeseries(subject_id, hcp_dir=HCP_DIR, roi_paths=(), atlas=None, cache_dir=None):
+    """roi_means() of one subject's run, from the cache if it has them."""
+    paths = subject_paths(subject_id, hcp_dir)
+    if not cache_dir:
+        return roi_means(paths['func_img'], paths['mask_img'], roi_paths, atlas)
+    cache = GLMCache(cache_dir)
+    key = cache.key('parcels', file_id(paths['func_img']), file_id(paths['mask_img']),
+                    [(spec, file_id(spec.split('=', 1)[-1])) for spec in roi_paths], atlas and file_id(atlas))
+
+    def write(directory):
+        names, values = roi_means(paths['func_img'], paths['mask_img'], roi_paths, atlas)
+        np.save(os.path.join(directory, 'timeseries.npy'), values)
+        with open(os.path.join(directory, 'rois.json'), 'w') as f:
+            json.dump(names, f)
+    path = cache.get(key) or cache.put(key, write)
+    with open(os.path.join(path, 'rois.json')) as f:
+        return json.load(f), np.load(os.path.join(path, 'timeseries.npy'))
+
+
+def _extract_worker(subject_id, hcp_dir, roi_paths, atlas, cache_dir):
+    from threadpoolctl import threadpool_limits
+
+    start = time.perf_counter()
+    try:
+        with threadpool_limits(1):
+            names, values = subject_timeseries(subject_id, hcp_dir, roi_paths, atlas, cache_dir)
+    except Exception as e:
+        return subject_id, None, f'{type(e).__name__}: {e}', time.perf_counter() - start
+    return subject_id, (names, values), None, time.perf_counter() - start
+
+
+def fit_batch(X, Y, noise_model='ar1'):
+    """GLM of every (subject, region) pair at once: X subjects x scans x regressors, Y subjects x scans x regions.
+
+    Returns beta (subjects x regions x regressors), unscaled covariance (subjects x regions x p x p),
+    dispersion (subjects x regions) and residual degrees of freedom.
+    """
+    n_scans, p = X.shape[1:]
+    XtX = np.einsum('stp,stq->spq', X, X)
+    XtY = np.einsum('stp,str->srp', X, Y)
+    rho = np.zeros(Y.shape[::2])
+    if noise_model == 'ar1': # as run_glm: Yule-Walker on the OLS residuals, truncated to AR_BINS bins
+        beta = np.linalg.solve(XtX[:, None], XtY[..., None])[..., 0]
+        resid = Y - np.einsum('stp,srp->str', X, beta)
+        rho = (resid[:, 1:] * resid[:, :-1]).sum(axis=1) / (resid ** 2).sum(axis=1) * n_scans / (n_scans - 1)
+        rho = np.trunc(rho * AR_BINS) / AR_BINS
+    # ARModel whitens row t > 0 as x_t - rho x_{t-1} (row 0 as is), so the whitened products are
+    # X'X - rho (lag-1 products) + rho^2 (X'X without the last scan), and the same for X'Y and Y'Y
+    lag_XX = np.einsum('stp,stq->spq', X[:, 1:], X[:, :-1])
+    lag_XX += lag_XX.transpose(0, 2, 1)
+    head_XX = XtX - np.einsum('sp,sq->spq', X[:, -1], X[:, -1])
+    lag_XY = np.einsum('stp,str->srp', X[:, 1:], Y[:, :-1]) + np.einsum('stp,str->srp', X[:, :-1], Y[:, 1:])
+    head_XY = XtY - np.einsum('sp,sr->srp', X[:, -1], Y[:, -1])
+    YtY = (Y ** 2).sum(axis=1)
+    r, r2 = rho[..., None], rho[..., None, None]
+    cov = np.linalg.inv(XtX[:, None] - r2 * lag_XX[:, None] + r2 ** 2 * head_XX[:, None])
+    Xty = XtY - r * lag_XY + r ** 2 * head_XY
+    yty = YtY - 2 * rho * (Y[:, 1:] * Y[:, :-1]).sum(axis=1) + rho ** 2 * (YtY - Y[:, -1] ** 2)
+    beta = np.einsum('srpq,srq->srp', cov, Xty)
+    dof = n_scans - p
+    dispersion = np.maximum(yty - (beta * Xty).sum(axis=-1), 0) / dof
+    return beta, cov, dispersion, dof
+
+
+def contrast_rows(beta, cov, dispersion, dof, columns, names, spec=CONTRASTS):
+    """{contrast: {output: subjects x regions}} with compute_contrasts' outputs (F tests: stat and z_score)."""
+    out = {}
+    for name in names:
+        kind, C = contrast_matrix(name, columns, spec)
+        if kind == 't':
+            c = C[0]
+            effect = beta @ c
+            variance = (cov @ c) @ c * dispersion
+            stat = effect / np.sqrt(variance)
+            out[name] = {'effect_size': effect, 'effect_variance': variance, 'stat': stat, 'z_score': t_to_z(stat, dof)}
+        else: # whiten with a square root of inv(C cov C'), as compute_contrasts
+            effect = np.einsum('kp,srp->srk', C, beta)
+            root = np.linalg.cholesky(np.linalg.inv(C @ cov @ C.T))
+            effect = np.einsum('srlk,srl->srk', root, effect)
+            con = Contrast(effect.reshape(-1, len(C)).T, dispersion.ravel(), dim=len(C), dof=dof, stat_type='F')
+            out[name] = {'stat': con.stat().reshape(dispersion.shape), 'z_score': con.z_score().reshape(dispersion.shape)}
+    return out
+
+
+def run_hcp_parcels(subjects, contrasts_to_run, roi_paths=(), atlas=None, labels=None, hcp_dir=HCP_DIR,
+                    cache_dir=None, spec=CONTRASTS, workers=None):
+    """
+    subjects: [(subject_id, out_name)]
+    contrasts_to_run: contrast names in spec, for every subject
+    roi_paths, atlas: regions as for realtime_glm.load_rois (masks as name=path); labels: atlas label names file
+    Returns the cohort table (DataFrame; one row per subject, contrast and region) and {subject_id: error}.
+    """
+    start = time.perf_counter()
+    extracted, errors = {}, {}
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(max(1, min(workers or os.cpu_count(), len(subjects)))) as pool:
+        jobs = [(s, hcp_dir, list(roi_paths), atlas, cache_dir) for s, _ in subjects]
+        for subject_id, result, error, seconds in pool.starmap(_extract_worker, jobs, chunksize=1):
+            if error:
+                errors[subject_id] = error
+                print(f'[parcels] {subject_id}: failed, {error}')
+            else:
+                extracted[subject_id] = result
+                print(f'[parcels] {subject_id}: {result[1].shape[1]} regions x {result[1].shape[0]} scans in {seconds:.1f}s')
+    extracted_s = time.perf_counter() - start
+    if not extracted:
+        return pd.DataFrame(), errors
+    roi_names = next(iter(extracted.values()))[0]
+    roi_names = [read_labels(labels).get(n, n) for n in roi_names] if labels else roi_names
+
+    # designs (and scaled data), grouped so that subjects in a batch share scans and columns
+    model = LeanGLM(mask_img=None, **GLM_SETTINGS)
+    groups = {}
+    for subject_id, out_name in subjects:
+        if subject_id not in extracted:
+            continue
+        values = extracted[subject_id][1]
+        paths = subject_paths(subject_id, hcp_dir)
+        design = model.make_design(len(values), load_events(paths['ev_dir']), load_confounds(paths['confounds_file']))
+        scaled = (values / np.maximum(values.mean(axis=0), 1) - 1) * 100 # percent signal change
+        groups.setdefault((len(values), tuple(design.columns)), []).append((subject_id, out_name, design.to_numpy(), scaled))
+
+    tables = []
+    for (n_scans, columns), members in groups.items():
+        per_subject = len(roi_names) * len(columns) ** 2 * 8
+        size = max(1, BATCH_BYTES // per_subject)
+        for b0 in range(0, len(members), size):
+            batch = members[b0:b0 + size]
+            X = np.array([m[2] for m in batch])
+            Y = np.array([m[3] for m in batch])
+            empty = np.isnan(Y).any(axis=1) # regions with no voxel in a subject's brain mask
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fit = fit_batch(X, np.nan_to_num(Y), GLM_SETTINGS['noise_model'])
+                results = contrast_rows(*fit, list(columns), contrasts_to_run, spec)
+            for name, outputs in results.items():
+                table = pd.DataFrame({'subject_id': np.repeat([m[0] for m in batch], len(roi_names)),
+                                      'out_name': np.repeat([m[1] for m in batch], len(roi_names)),
+                                      'contrast': name, 'roi': np.tile(roi_names, len(batch))})
+                for output, values in outputs.items():
+                    table[output] = np.where(empty, np.nan, values).ravel()
+                tables.append(table)
+    table = pd.concat(tables, ignore_index=True)
+    print(f"[parcels] {table['out_name'].nunique()} subjects: extraction {extracted_s:.1f}s, "
+          f'fit and {len(contrasts_to_run)} contrast(s) {time.perf_counter() - start - extracted_s:.2f}s')
+    return table, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the HCP working-memory GLM on region mean time series, all subjects at once.')
+    parser.add_argument('subjects', nargs='+', help='subject IDs and/or files listing "subject_id [out_name]" (as batch_glm.py)')
+    parser.add_argument('--atlas', default=None, help='integer label image; one region per label')
+    parser.add_argument('--labels', default=None, help='names of the atlas labels')
+    parser.add_argument('--roi', action='append', default=[], help='binary mask, as name=path or path (repeatable)')
+    parser.add_argument('--contrasts', nargs='+', default=['2bk-0bk'], help='contrasts (names in contrast_spec.CONTRASTS)')
+    parser.add_argument('--hcp-dir', default=HCP_DIR)
+    parser.add_argument('--cache-dir', default=None, help='keep region time series in this glm_cache directory')
+    parser.add_argument('--workers', type=int, default=None, help='subjects extracted in parallel (default: cores)')
+    parser.add_argument('--out', default=os.path.join(OUTPUT_DIR, 'parcel_glm.csv'), help='cohort table (CSV)')
+    args = parser.parse_args()
+
+    if not args.atlas and not args.roi:
+        parser.error('give --atlas and/or --roi')
+    unknown = sorted(set(args.contrasts) - set(CONTRASTS))
+    if unknown:
+        parser.error(f'unknown contrast(s) {", ".join(unknown)}; see python contrast_spec.py')
+    subjects = [(s[0], s[1]) for s in read_subjects(args.subjects, args.contrasts)]
+    table, errors = run_hcp_parcels(subjects, args.contrasts, args.roi, args.atlas, args.labels, args.hcp_dir,
+                                    args.cache_dir, workers=args.workers)
+    if len(table):
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        table.to_csv(args.out, index=False)
+        print(table.groupby(['contrast', 'roi'], sort=False)['stat'].mean().unstack(0).round(2).head(20).to_string())
+        print(f'saved: {args.out} (mean stat over subjects above)')
+    raise SystemExit(1 if errors else 0)
+
+
+if __name__ == '__main__':
+    main()
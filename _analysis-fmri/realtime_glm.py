@@ -0,0 +1,352 @@
+"""Real-time ROI GLM for nback_mri.py runs, updated as each volume arrives.
+
+    python realtime_glm.py watch /scanner/export --events _data/nback_mri --run 1 --roi dlpfc=dlpfc.nii.gz
+    python realtime_glm.py replay run1_bold.nii.gz --events _data/nback_mri/<session>.csv --run 1 --atlas parcels.nii.gz
+    python realtime_glm.py replay run1_bold.nii.gz --events _data/nback_mri/<session>.csv --run 1 --speed 0   # benchmark
+
+Volumes come from a directory the scanner exports one NIfTI per volume into
+(taken in name order, each once it is complete) or from a 4D NIfTI replayed at
+one volume per TR, the local stand-in for the scanner. Events come from the CSV
+nback_mri.py is writing: trial rows are read as TrialLogger appends them and
+timed from the run's run_start trigger (volume 0). Given its folder instead,
+the newest session file is followed. watch only reads rows written after it
+started (start it before the run's trigger); replay reads the whole file. If
+the run starts again (a new run_start), the events read so far are dropped.
+
+The model is OLS on ROI mean signals with one block regressor per N (trial
+boxcars convolved with the Glover HRF), a constant and polynomial drifts in
+time. Drift terms don't depend on the run length, which isn't known until the
+run ends, so nothing already accumulated has to be revised. IncrementalGLM
+keeps X'X, X'Y and Y'Y; a volume's design row is final once SETTLE_S has
+passed (trials are logged when they end), and until then it is recomputed with
+each estimate. Each volume costs O(p^2 x ROIs) no matter how long the run is,
+and the final estimates equal a batch OLS fit of the whole run.
+
+Each volume prints the 2-back - 1-back effect (% of the ROI's baseline) and t
+per ROI; --out writes every estimate to a CSV. At the end the per-volume
+update latency (volume available -> estimates reported) is summarized
+against the TR.
+"""
+import argparse, contextlib, csv, glob, io, os, time
+import numpy as np
+import nibabel as nib
+from nilearn.glm.first_level import glover_hrf
+
+TR = 2.0 # nback_mri.py
+TRIAL_DURATION = 2.0 # nback_mri.py; trials are logged when they end
+SETTLE_S = TRIAL_DURATION + 0.5 # a design row can still change until this long after its volume
+CONDITIONS = ('1back', '2back')
+CONTRASTS = {'2back-1back': {'2back': 1, '1back': -1}, '2back': {'2back': 1}, '1back': {'1back': 1}}
+DRIFT_ORDER = 3 # polynomial drift terms (t, t^2, t^3)
+DRIFT_SCALE_S = 420.0 # time is scaled by about one run's length to keep X'X well conditioned
+POLL_S = 0.01
+
+
+class IncrementalGLM:
+    """OLS of ROI signals on a block design, updated one volume (and one event) at a time."""
+
+    def __init__(self, tr=TR, conditions=CONDITIONS, drift_order=DRIFT_ORDER, settle=SETTLE_S, oversampling=50):
+        self.conditions = list(conditions)
+        self.columns = self.conditions + ['constant'] + [f'drift_{k}' for k in range(1, drift_order + 1)]
+        self.drift_order = drift_order
+        self.settle = settle
+        hrf = glover_hrf(tr, oversampling)
+        self._hrf_t = np.arange(len(hrf)) * tr / oversampling
+        self._hrf_cum = np.cumsum(hrf) # HRF response to a unit step, sampled every tr / oversampling
+        self.events = {c: [] for c in self.conditions} # condition -> [(onset, duration)]
+        self.XtX = None
+        self.n = 0
+        self.pending = [] # (time, y) of volumes whose design row can still change
+        self.committed = [] # (time, y) of the others, kept for reset_events()
+
+    def add_event(self, onset, duration, condition):
+        if condition in self.events:
+            self.events[condition].append((onset, duration))
+
+    def reset_events(self):
+        """Forget every event (the run started over); committed volumes are refit once new events settle."""
+        self.events = {c: [] for c in self.conditions}
+        self.pending = self.committed + self.pending
+        self.committed = []
+        if self.XtX is not None:
+            self.XtX[:], self.XtY[:], self.YtY[:] = 0, 0, 0
+        self.n = 0
+
+    def design_row(self, t):
+        """Regressors at scan time t (s) from the events known now."""
+        row = np.empty(len(self.columns))
+        for i, cond in enumerate(self.conditions):
+            ev = np.array(self.events[cond]).reshape(-1, 2)
+            ev = ev[ev[:, 0] <= t]
+            # boxcar * HRF = step response at onset minus step response at offset
+            row[i] = (np.interp(t - ev[:, 0], self._hrf_t, self._hrf_cum, left=0) -
+                      np.interp(t - ev.sum(axis=1), self._hrf_t, self._hrf_cum, left=0)).sum()
+        row[len(self.conditions)] = 1
+        row[len(self.conditions) + 1:] = (t / DRIFT_SCALE_S) ** np.arange(1, self.drift_order + 1)
+        return row
+
+    def add_volume(self, t, y):
+        """Add the ROI signals y of the volume acquired at scan time t; commits rows that can't change anymore."""
+        y = np.asarray(y, dtype=float)
+        if self.XtX is None:
+            p = len(self.columns)
+            self.XtX, self.XtY, self.YtY = np.zeros((p, p)), np.zeros((p, len(y))), np.zeros(len(y))
+        self.pending.append((t, y))
+        while self.pending and self.pending[0][0] <= t - self.settle:
+            t0, y0 = self.pending.pop(0)
+            self._accumulate(self.XtX, self.XtY, self.YtY, t0, y0)
+            self.committed.append((t0, y0))
+            self.n += 1
+
+    def _accumulate(self, XtX, XtY, YtY, t, y):
+        x = self.design_row(t)
+        XtX += np.outer(x, x)
+        XtY += np.outer(x, y)
+        YtY += y * y
+
+    def estimate(self, contrasts=CONTRASTS):
+        """{contrast: (effect, t, percent)} per ROI, arrays of NaN until the contrast is estimable."""
+        XtX, XtY, YtY = self.XtX.copy(), self.XtY.copy(), self.YtY.copy()
+        for t, y in self.pending:
+            self._accumulate(XtX, XtY, YtY, t, y)
+        n = self.n + len(self.pending)
+        active = np.diag(XtX) > 1e-6 # conditions not shown yet have all-zero regressors
+        n_rois = XtY.shape[1]
+        out = {name: (np.full(n_rois, np.nan),) * 3 for name in contrasts}
+        dof = n - active.sum()
+        if dof < 1 or np.linalg.cond(XtX[np.ix_(active, active)]) > 1e12:
+            return out
+        inv = np.linalg.inv(XtX[np.ix_(active, active)])
+        beta = inv @ XtY[active]
+        sigma2 = np.maximum(YtY - (beta * XtY[active]).sum(axis=0), 0) / dof
+        baseline = beta[list(np.flatnonzero(active)).index(len(self.conditions))]
+        for name, weights in contrasts.items():
+            c = np.zeros(len(self.columns))
+            for cond, w in weights.items():
+                c[self.columns.index(cond)] = w
+            if c[~active].any():
+                continue
+            c = c[active]
+            effect = c @ beta
+            t = effect / np.sqrt(sigma2 * (c @ inv @ c))
+            out[name] = (effect, t, 100 * effect / baseline)
+        return out
+
+
+class EventTail:
+    """Trial events of one run, read from the growing CSV nback_mri.py writes.
+
+    path is the session's CSV (<session>.csv.part while it runs) or the folder of session
+    CSVs (the newest is followed, across its rename when the session ends).
+    With from_end, rows already in the file when the tail starts are skipped.
+    """
+
+    def __init__(self, path, run, trial_duration=TRIAL_DURATION, from_end=False):
+        self.folder = path if os.path.isdir(path) else None
+        self.run = str(run)
+        self.trial_duration = trial_duration
+        self.restarted = False # set when the events returned so far no longer hold; cleared by the caller
+        self._follow(self._newest() if self.folder else path)
+        if from_end and self.path and os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            self.offset = data.rfind(b'\n') + 1
+
+    def _newest(self):
+        # a live session is <session>.csv.part, renamed to <session>.csv when it ends
+        names = sorted(f for f in os.listdir(self.folder)
+                       if f.endswith(('.csv', '.csv.part')) and not f.endswith('_schedule.csv'))
+        return os.path.join(self.folder, names[-1]) if names else None
+
+    def _follow(self, path):
+        self.path = path
+        self.offset = 0
+        self.header = None
+        self.run_start = None
+        self.trials = [] # (timestamp, n) since run_start
+        self.n_returned = 0 # of those, handed out by poll()
+
+    def poll(self):
+        """[(onset, duration, condition)] for trials logged since the last call (onsets from run_start)."""
+        if self.folder:
+            newest = self._newest()
+            if newest and self.path and newest.removesuffix('.part') == self.path.removesuffix('.part'):
+                self.path = newest # the same session, finished (renamed): keep reading where we were
+            elif newest != self.path: # a new session began
+                self.restarted = self.restarted or self.n_returned > 0
+                self._follow(newest)
+        elif self.path and self.path.endswith('.part') and not os.path.isfile(self.path):
+            self.path = self.path.removesuffix('.part') # the session ended and its file was renamed
+        if not self.path or not os.path.isfile(self.path):
+            return []
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError: # renamed since the check; found again on the next poll
+            return []
+        with f:
+            if self.header is None: # the header, even when the rows before offset are skipped
+                first = f.readline()
+                if not first.endswith(b'\n'):
+                    return []
+                self.header = next(csv.reader([first.decode()]))
+                self.offset = max(self.offset, f.tell())
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b'\n') + 1 # a row still being written waits for the next poll
+        self.offset += end
+        new = []
+        for row in csv.DictReader(io.StringIO(data[:end].decode()), fieldnames=self.header):
+            if row.get('run') != self.run:
+                continue
+            if row['event_type'] == 'run_start':
+                # a rerun of this run starts over, including trials already handed out
+                self.restarted = self.restarted or self.n_returned > 0
+                self.run_start, self.trials, self.n_returned, new = float(row['timestamp']), [], 0, []
+            elif row['event_type'] == 'trial':
+                self.trials.append((float(row['timestamp']), row['n']))
+                new.append(self.trials[-1])
+        if self.run_start is None:
+            return []
+        self.n_returned += len(new)
+        return [(ts - self.run_start, self.trial_duration, f'{n}back') for ts, n in new]
+
+
+def replay_volumes(path, tr=TR, speed=1.0):
+    """(index, volume, time it became available) for each volume of a 4D image, one per TR / speed (0: no waiting)."""
+    img = nib.load(path, keep_file_open=True)
+    start = time.perf_counter()
+    for i in range(img.shape[3]):
+        if speed:
+            # a volume is available once it has been acquired, at the end of its TR
+            time.sleep(max(0, start + (i + 1) * tr / speed - time.perf_counter()))
+        available = time.perf_counter()
+        yield i, np.asarray(img.dataobj[..., i], dtype=np.float32), available
+
+
+def watch_volumes(directory, pattern='*.nii*', timeout=30.0):
+    """(index, volume, time its file appeared) for each new file in name order; stops after `timeout` idle seconds."""
+    seen = set()
+    appeared = {}
+    i = 0
+    last = time.perf_counter()
+    while time.perf_counter() - last < timeout:
+        ready = False
+        for path in sorted(glob.glob(os.path.join(directory, pattern))):
+            if path in seen:
+                continue
+            appeared.setdefault(path, time.perf_counter())
+            try:
+                volume = np.asarray(nib.load(path).dataobj, dtype=np.float32)
+            except Exception: # still being written
+                break
+            seen.add(path)
+            last = time.perf_counter()
+            yield i, volume.reshape(volume.shape[:3]), appeared.pop(path)
+            i += 1
+            ready = True
+        if not ready:
+            time.sleep(POLL_S)
+
+
+def _roi_data(path, target=None):
+    img = nib.load(path)
+    if target is not None and (img.shape[:3] != target.shape[:3] or not np.allclose(img.affine, target.affine)):
+        from nilearn import image
+
+        img = image.resample_to_img(img, target, interpolation='nearest')
+    return np.asanyarray(img.dataobj).ravel(order='F')
+
+
+def load_rois(roi_paths=(), atlas=None, reference=None, target=None):
+    """[(name, flat voxel indices)] from binary masks (name=path) and/or a label atlas; the whole brain if none.
+
+    With a target image, masks and atlas are resampled (nearest neighbour) onto its grid if they aren't on it.
+    """
+    rois = []
+    for spec in roi_paths:
+        name, path = spec.split('=', 1) if '=' in spec else (os.path.basename(spec).split('.')[0], spec)
+        rois.append((name, np.flatnonzero(_roi_data(path, target) > 0)))
+    if atlas:
+        labels = _roi_data(atlas, target).astype(int)
+        order = np.argsort(labels, kind='stable')
+        values, starts = np.unique(labels[order], return_index=True)
+        for value, idx in zip(values, np.split(order, starts[1:])):
+            if value:
+                rois.append((f'label_{value}', idx))
+    if not rois and reference is not None: # voxels brighter than the first volume's mean
+        flat = reference.ravel(order='F')
+        rois.append(('brain', np.flatnonzero(flat > flat.mean())))
+    return rois
+
+
+def run(volumes, events, rois=None, tr=TR, out=None, show=4):
+    """Fit as volumes arrive; returns the per-volume latencies (s) and the final estimates (None without volumes)."""
+    glm = None
+    latencies = []
+    estimates = None
+    with open(out, 'w', newline='') if out else contextlib.nullcontext() as f:
+        writer = csv.writer(f) if out else None
+        for i, volume, available in volumes:
+            if glm is None:
+                rois = rois or load_rois(reference=volume)
+                names = [name for name, _ in rois]
+                glm = IncrementalGLM(tr)
+                if writer:
+                    writer.writerow(['volume', 'contrast', 'roi', 'effect', 't', 'percent', 'latency_ms'])
+            new = events.poll()
+            if events.restarted: # the run started over: the events added so far are the aborted attempt's
+                glm.reset_events()
+                events.restarted = False
+            for onset, duration, condition in new:
+                glm.add_event(onset, duration, condition)
+            flat = volume.ravel(order='F')
+            glm.add_volume(i * tr, [flat[idx].mean() for _, idx in rois])
+            estimates = glm.estimate()
+            latencies.append(time.perf_counter() - available)
+
+            effect, t, percent = estimates['2back-1back']
+            print(f'vol {i:4d} {latencies[-1] * 1000:6.1f} ms  2back-1back ' +
+                  '  '.join(f'{name}: {p:+.2f}% t={tv:+.1f}' for name, p, tv in list(zip(names, percent, t))[:show]), flush=True)
+            if writer:
+                for con, (effect, t, percent) in estimates.items():
+                    for name, e, tv, p in zip(names, effect, t, percent):
+                        writer.writerow([i, con, name, f'{e:.6g}', f'{tv:.4g}', f'{p:.4g}', f'{latencies[-1] * 1000:.2f}'])
+    return np.array(latencies), estimates
+
+
+def summarize(latencies, tr=TR):
+    if not len(latencies):
+        print('no volumes received')
+        return
+    ms = latencies * 1000
+    print(f'{len(ms)} volumes; update latency median {np.median(ms):.1f} ms, p95 {np.percentile(ms, 95):.1f} ms, '
+          f'max {ms.max():.1f} ms; TR {tr * 1000:.0f} ms; {(ms > tr * 1000).sum()} over the TR')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Real-time ROI GLM of an nback_mri.py run.')
+    parser.add_argument('mode', choices=['watch', 'replay'])
+    parser.add_argument('source', help='directory of per-volume NIfTIs (watch) or a 4D NIfTI (replay)')
+    parser.add_argument('--events', required=True,
+                        help="the session CSV nback_mri.py is writing, or its folder (the newest session is followed)")
+    parser.add_argument('--run', type=int, required=True)
+    parser.add_argument('--roi', action='append', default=[], help='binary mask, as name=path or path (repeatable)')
+    parser.add_argument('--atlas', default=None, help='integer label image; one ROI per label')
+    parser.add_argument('--tr', type=float, default=TR)
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed-up (0: as fast as possible)')
+    parser.add_argument('--timeout', type=float, default=30.0, help='watch: stop after this many seconds without a volume')
+    parser.add_argument('--out', default=None, help='CSV of every estimate')
+    args = parser.parse_args()
+
+    rois = load_rois(args.roi, args.atlas) or None
+    if args.mode == 'replay':
+        volumes = replay_volumes(args.source, args.tr, args.speed)
+    else:
+        volumes = watch_volumes(args.source, timeout=args.timeout)
+    events = EventTail(args.events, args.run, from_end=args.mode == 'watch') # replay: the file is already complete
+    latencies, _ = run(volumes, events, rois, args.tr, args.out)
+    summarize(latencies, args.tr)
+
+
+if __name__ == '__main__':
+    main()
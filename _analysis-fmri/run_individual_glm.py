@@ -1,93 +1,118 @@
 import os
 import numpy as np
 import pandas as pd
+import nilearn
 from nilearn.glm.first_level import FirstLevelModel
 from nilearn import image
 
-def run_hcp_glm(subject_id, out_name, contrasts_to_run):
+from contrast_spec import CONTRASTS, F_MAPS, MAPS, compute_contrasts
+from glm_cache import GLMCache, file_id
+from lean_glm import LeanGLM
+
+HCP_DIR = "/Users/chrisiyer/Downloads" # one folder per HCP subject ID
+OUTPUT_DIR = "/Users/chrisiyer/_Current/classes/task-demos/_analysis-fmri/images"
+CONDITIONS = ['0bk_body', '0bk_faces', '0bk_places', '0bk_tools',
+              '2bk_body', '2bk_faces', '2bk_places', '2bk_tools']
+GLM_SETTINGS = {'t_r': 0.72, 'smoothing_fwhm': 5, 'noise_model': 'ar1', 'drift_model': 'cosine'} # both fits; part of the cache key
+
+
+def subject_paths(subject_id, hcp_dir=HCP_DIR):
+    """The tfMRI_WM_LR inputs of one HCP subject."""
+    base_path = os.path.join(hcp_dir, str(subject_id), "MNINonLinear", "Results", "tfMRI_WM_LR")
+    return {'func_img': os.path.join(base_path, "tfMRI_WM_LR_hp0_clean_rclean_tclean.nii.gz"),
+            'mask_img': os.path.join(base_path, "brainmask_fs.2.nii.gz"),
+            'ev_dir': os.path.join(base_path, "EVs"),
+            'confounds_file': os.path.join(base_path, "Movement_Regressors.txt")}
+
+
+def load_events(ev_dir):
+    """Events of the HCP EV files (onset, duration, weight per line) for the conditions present."""
+    all_events = []
+    for cond in CONDITIONS:
+        ev_file = os.path.join(ev_dir, f"{cond}.txt")
+        if os.path.exists(ev_file) and os.path.getsize(ev_file) > 0:
+            data = pd.read_csv(ev_file, sep='\t', names=['onset', 'duration', 'weight'])
+            data['trial_type'] = cond
+            all_events.append(data)
+    return pd.concat(all_events).sort_values('onset')
+
+
+def load_confounds(confounds_file):
+    """The 12 HCP movement regressors."""
+    confounds = pd.read_csv(confounds_file, sep='  ', engine='python', header=None)
+    confounds.columns = [f'mot_{i}' for i in range(12)]
+    return confounds
+
+
+def run_hcp_glm(subject_id, out_name, contrasts_to_run, hcp_dir=HCP_DIR, output_dir=OUTPUT_DIR, lean=False,
+                spec=CONTRASTS, cache_dir=None, contrasts_only=False):
     """
     subject_id: The HCP ID (e.g., 100307)
     out_name: The output prefix (e.g., sub1)
-    contrasts_to_run: List of contrast types (e.g., ['2bk-0bk', '2bk', '0bk'])
+    contrasts_to_run: List of contrast names in spec (e.g., ['2bk-0bk', 'faces-others', 'category'])
+    spec: Contrast definitions (see contrast_spec.py); each t contrast writes _beta, _variance, _t
+          and _z maps, each F test _F and _z
+    lean: Fit with lean_glm.LeanGLM (chunked, float32; same maps, a fraction of the memory)
+    cache_dir: Keep fits (and, if lean, smoothed data) in this glm_cache.GLMCache directory
+    contrasts_only: Only compute contrasts from the cached fit; LookupError if there is none
+    Returns the list of files written.
     """
     print(f"--- Processing Subject: {subject_id} ({out_name}) ---")
+    if contrasts_only and not cache_dir:
+        raise ValueError("contrasts_only needs a cache_dir")
     
     # Paths
-    base_path = f"/Users/chrisiyer/Downloads/{subject_id}/MNINonLinear/Results/tfMRI_WM_LR"
-    func_img = os.path.join(base_path, "tfMRI_WM_LR_hp0_clean_rclean_tclean.nii.gz")
-    mask_img = os.path.join(base_path, "brainmask_fs.2.nii.gz")
-    ev_dir = os.path.join(base_path, "EVs")
-    confounds_file = os.path.join(base_path, "Movement_Regressors.txt")
-    output_dir = "/Users/chrisiyer/_Current/classes/task-demos/_analysis-fmri/images"
+    paths = subject_paths(subject_id, hcp_dir)
+    func_img = paths['func_img']
+    mask_img = paths['mask_img']
+    ev_dir = paths['ev_dir']
+    confounds_file = paths['confounds_file']
     os.makedirs(output_dir, exist_ok=True)
 
     # 1. Load Timing (EVs)
-    conditions = ['0bk_body', '0bk_faces', '0bk_places', '0bk_tools', 
-                  '2bk_body', '2bk_faces', '2bk_places', '2bk_tools']
-    
-    all_events = []
-    for cond in conditions:
-        ev_file = os.path.join(ev_dir, f"{cond}.txt")
-        if os.path.exists(ev_file) and os.path.getsize(ev_file) > 0:
-            data = pd.read_csv(ev_file, sep='\t', names=['onset', 'duration', 'weight'])
-            data['trial_type'] = cond
-            all_events.append(data)
-    
-    events = pd.concat(all_events).sort_values('onset')
+    events = load_events(ev_dir)
 
     # 2. Load Confounds (Movement)
-    confounds = pd.read_csv(confounds_file, sep='  ', engine='python', header=None)
-    confounds.columns = [f'mot_{i}' for i in range(12)]
+    confounds = load_confounds(confounds_file)
+
+    # 3. Initialize & Run GLM, or reuse a cached fit of the same inputs
+    cache = GLMCache(cache_dir) if cache_dir else None
+    model = None
+    if cache:
+        key = cache.key('fit', lean, file_id(func_img), file_id(mask_img), events, confounds, GLM_SETTINGS,
+                        nilearn.__version__)
+        model = cache.load_fit(key)
+    if model is not None:
+        print("Using cached fit")
+    elif contrasts_only:
+        raise LookupError(f"No cached fit for {subject_id} in {cache_dir}; run once without contrasts_only")
+    else:
+        if lean:
+            model = LeanGLM(mask_img=mask_img,
+                            cache=cache,
+                            **GLM_SETTINGS)
+        else:
+            model = FirstLevelModel(mask_img=mask_img,
+                                    standardize=True,
+                                    signal_scaling=0,
+                                    minimize_memory=False,
+                                    **GLM_SETTINGS)
+
+        print("Fitting model...")
+        model.fit(func_img, events=events, confounds=confounds)
+        if cache:
+            cache.save_fit(key, model)
 
-    # 3. Initialize & Run GLM
-    model = FirstLevelModel(t_r=0.72,
-                            mask_img=mask_img,
-                            smoothing_fwhm=5,
-                            standardize=True,
-                            signal_scaling=0,
-                            noise_model='ar1',
-                            drift_model='cosine',
-                            minimize_memory=False)
-
-    print("Fitting model...")
-    model.fit(func_img, events=events, confounds=confounds)
-    design_columns = model.design_matrices_[0].columns
-
-    # 4. Compute requested contrasts
-    for con_type in contrasts_to_run:
-        contrast_val = np.zeros(len(design_columns))
-        
-        if con_type == '2bk-0bk':
-            # 2-Back minus 0-Back
-            for i, col in enumerate(design_columns):
-                if '2bk' in col:
-                    contrast_val[i] = 1.0
-                elif '0bk' in col:
-                    contrast_val[i] = -1.0
-        elif con_type == '2bk':
-            # Mean activation during all 2-Back blocks
-            for i, col in enumerate(design_columns):
-                if '2bk' in col:
-                    contrast_val[i] = 1.0
-        elif con_type == '0bk':
-            # Mean activation during all 0-Back blocks
-            for i, col in enumerate(design_columns):
-                if '0bk' in col:
-                    contrast_val[i] = 1.0
-        
-        # Normalize weights so they average to 1/0 as appropriate
-        n_pos = np.sum(contrast_val > 0)
-        n_neg = np.sum(contrast_val < 0)
-        if n_pos > 0: contrast_val[contrast_val > 0] /= n_pos
-        if n_neg > 0: contrast_val[contrast_val < 0] /= n_neg
-
-        print(f"Running Contrast: {con_type}")
-        
-        # Save Parameter Estimates (Effect Size)
-        eff_map = model.compute_contrast(contrast_val, output_type='effect_size')
-        out_file = os.path.join(output_dir, f"{out_name}_{con_type}_beta.nii.gz")
-        eff_map.to_filename(out_file)
-        print(f"Saved: {out_file}")
+    # 4. Compute requested contrasts, all in one pass
+    print(f"Running Contrasts: {', '.join(contrasts_to_run)}")
+    written = []
+    for con_type, maps in compute_contrasts(model, contrasts_to_run, spec).items():
+        for output, suffix in (MAPS if 'effect_size' in maps else F_MAPS).items():
+            out_file = os.path.join(output_dir, f"{out_name}_{con_type}_{suffix}.nii.gz")
+            maps[output].to_filename(out_file)
+            written.append(out_file)
+        print(f"Saved: {os.path.join(output_dir, out_name)}_{con_type}_*.nii.gz")
+    return written
 
 if __name__ == "__main__":
     # Subject 1 requirements: 2bk-0bk, 2bk, 0bk
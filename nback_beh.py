@@ -1,6 +1,12 @@
-from psychopy import visual, core, event, gui
-from psychopy.hardware import keyboard
-import random, csv, os
+import os, time
+from tasklib import startup, telemetry
+from tasklib.stim_cache import TextureCache
+from tasklib.texture_store import TextureStore
+from tasklib.frame_timing import FramePresenter
+from tasklib.responses import ResponseBox
+from tasklib.schedule import build_session, save_schedule, group_by_block
+from tasklib.shards import session_path
+from tasklib.trial_logger import TrialLogger
 
 # ===== PARAMETERS =====
 # Total duration: 6 blocks * 1 min = 6 min
@@ -14,18 +20,19 @@ N_TRIALS_PER_BLOCK = 30
 N_TARGETS_PER_BLOCK = 10
 
 RESPONSE_KEY = 'space' 
+FRAME_LOCKED = False # count onset/offset in screen refreshes (timestamps from the flip) instead of polling a clock
+TELEMETRY = False # record per-frame timings by phase, GC pauses and flip intervals; saved next to DATA_FILE (tasklib.telemetry)
+DATA_FILE = '_data/nback.csv' # each session writes its own file in ./_data/nback/ (merge: python -m tasklib.shards compact _data/nback)
+SCHEDULE_FILE = None # set per session: <session>_schedule.csv next to its data file
 STIMULI_DIR = '_stimuli'
+SEED = None # set to regenerate a previous session's schedule (seed is saved in SCHEDULE_FILE)
+STIM_CACHE_MB = 256 # decoded image textures kept in memory before LRU eviction
+TEXTURE_STORE = os.path.join(STIMULI_DIR, '_store') # pre-resized images (python -m tasklib.texture_store build _stimuli); JPEGs are decoded if it isn't built
 
-# Get subject information
-dlg = gui.Dlg(title="N-back Task")
-dlg.addField('Name:')
-dlg.show()
-if not dlg.OK:
-    core.quit()
-subject_name = dlg.data[0]
-
-# Update data file name
-DATA_FILE = f'_data/nback/{subject_name}.csv'
+# Output schema
+FIELDNAMES = ['subject_name', 'run', 'block', 'trial', 'event_type', 'timestamp', 'n', 'stim_type', 'stimulus', 'is_target',
+              'resp_key', 'resp_rt', 'correct', 'stim_swap_ms',
+              'intended_onset', 'actual_onset', 'intended_offset', 'actual_offset', 'dropped_frames', 'cpu_ms']
 
 # Stimuli definitions
 stimuli = {
@@ -35,80 +42,113 @@ stimuli = {
 }
 # ======================
 
-# Setup
-win = visual.Window([1024, 768], color='black', fullscr=True, units='height')
-win.mouseVisible = False
-
-# Fix: Restore missing stimuli definitions
-fixation = visual.TextStim(win, text='+', color='white', height=0.1)
-text_stim = visual.TextStim(win, text='', color='white', height=0.2)
-image_stim = visual.ImageStim(win, size=(0.5, 0.5))
-instr_text = visual.TextStim(win, text='', color='white', height=0.05, wrapWidth=0.8)
-
-# Global clock for absolute timing
-global_clock = core.Clock()
-rest_clock = core.Clock()
-kb = keyboard.Keyboard()
-
-def run_block(run_idx, block_idx, n, stim_type, results):
-    # Generate trial sequence for this block
-    is_targets = [True] * N_TARGETS_PER_BLOCK + [False] * (N_TRIALS_PER_BLOCK - N_TARGETS_PER_BLOCK - n)
-    random.shuffle(is_targets)
-    is_targets = [False] * n + is_targets # add 'n' non-target trials at the start
-    
-    block_stimuli = []
-    for i in range(N_TRIALS_PER_BLOCK):
-        is_target = is_targets[i]
-        if is_target:
-            current_stim = block_stimuli[i - n]
-        else:
-            # Pick a stim that isn't the one n-back
-            if i >= n:
-                current_stim = random.choice([s for s in stimuli[stim_type] if s != block_stimuli[i-n]])
-            else:
-                current_stim = random.choice(stimuli[stim_type])
-        block_stimuli.append(current_stim)
-        
+def ask_subject():
+    """Startup dialog; points DATA_FILE and SCHEDULE_FILE at this session's own files."""
+    global subject_name, DATA_FILE, SCHEDULE_FILE
+    from psychopy import core, gui
+    dlg = gui.Dlg(title="N-back Task")
+    dlg.addField('Name:')
+    dlg.show()
+    if not dlg.OK:
+        core.quit()
+    subject_name = dlg.data[0]
+
+    # a new file per session, so a reused name never appends to an earlier session
+    DATA_FILE = session_path(DATA_FILE, subject_name)
+    SCHEDULE_FILE = os.path.splitext(DATA_FILE)[0] + '_schedule.csv'
+    startup.mark('dialog')
+
+
+def setup():
+    """Create the window and stimuli."""
+    global win, fixation, text_stim, image_cache, instr_text, global_clock, rest_clock, responses, presenter
+    win = visual.Window([1024, 768], color='black', fullscr=True, units='height')
+    win.mouseVisible = False
+    startup.mark('window')
+
+    # Fix: Restore missing stimuli definitions
+    fixation = visual.TextStim(win, text='+', color='white', height=0.1)
+    text_stim = visual.TextStim(win, text='', color='white', height=0.2)
+    image_cache = TextureCache(win, size=(0.5, 0.5), max_mb=STIM_CACHE_MB, store=TextureStore.open(TEXTURE_STORE))
+    instr_text = visual.TextStim(win, text='', color='white', height=0.05, wrapWidth=0.8)
+
+    # Global clock for absolute timing
+    global_clock = core.Clock()
+    rest_clock = core.Clock()
+    responses = ResponseBox() # hardware-timestamped keys where available
+    presenter = FramePresenter(win, responses.kb, global_clock) if FRAME_LOCKED else None
+    startup.mark('stimuli')
+
+
+def prepare_stimulus(stim_type, stim):
+    """Swap a trial's stimulus in and return the object to draw (images are already uploaded)."""
+    if stim_type == 'letters':
+        text_stim.text = stim
+        return text_stim
+    return image_cache.get(stim)
+
+
+def run_block(run_idx, block_idx, n, stim_type, trials, logger):
+    # Trial sequence was generated up front (see 'Trial schedule' below)
+    if FRAME_LOCKED:
+        presenter.start_block()
+    telemetry.block(f'run{run_idx + 1}-block{block_idx + 1}')
+    for i, trial in enumerate(trials):
+        telemetry.trial(i + 1)
+        is_target = bool(trial['is_target'])
+        current_stim = trial['stimulus']
+
         # Trial Timing
         trial_start_time = global_clock.getTime()
-        
-        # Show Stimulus
-        if stim_type == 'letters':
-            text_stim.text = current_stim
-            text_stim.draw()
+        response = {'key': None, 'rt': None}
+
+        def handle_key(k):
+            if k.name == 'escape':
+                core.quit()
+            elif k.name == RESPONSE_KEY and response['key'] is None:
+                response['key'] = k.name
+                response['rt'] = k.rt
+
+        # Show Stimulus (images were preloaded on the instruction screen, so this is just a texture swap)
+        swap_start = time.perf_counter()
+        stim_obj = prepare_stimulus(stim_type, current_stim)
+        telemetry.mark('setup')
+        if FRAME_LOCKED:
+            stim_swap_ms = (time.perf_counter() - swap_start) * 1000
+            timing = presenter.run_trial(stim_obj.draw, presenter.frames(STIM_DURATION), presenter.frames(TRIAL_DURATION),
+                                         [RESPONSE_KEY, 'escape'], handle_key)
+            stim_swap_ms += timing.pop('first_draw_ms') or 0
         else:
-            image_stim.image = current_stim
-            image_stim.draw()
-        win.flip()
-        
-        # Wait for response for the duration of the trial
-        resp_key = None
-        resp_rt = None
-        
-        trial_clock = core.Clock()
-        stim_on = True
-        while trial_clock.getTime() < TRIAL_DURATION:
-            # Handle stimulus disappearance at 1.5s (fixed duration)
-            if stim_on and trial_clock.getTime() >= STIM_DURATION:
-                win.flip() # Blank screen
-                stim_on = False
-                
-            keys = kb.getKeys(keyList=[RESPONSE_KEY, 'escape'], waitRelease=False)
-            for k in keys:
-                time = k.rt
-                key = k.name
-                if key == 'escape':
-                    core.quit()
-                elif key == RESPONSE_KEY and resp_key is None:
-                    resp_key = key
-                    resp_rt = time
-            
-            # Short sleep to prevent CPU hogging
-            core.wait(0.001)
+            stim_obj.draw()
+            stim_swap_ms = (time.perf_counter() - swap_start) * 1000
+            responses.on_flip(win) # RTs are timed from the onset flip
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+            timing = {}
+
+            # Wait for response for the duration of the trial
+            trial_clock = core.Clock()
+            stim_on = True
+            while trial_clock.getTime() < TRIAL_DURATION:
+                # Handle stimulus disappearance at 1.5s (fixed duration)
+                if stim_on and trial_clock.getTime() >= STIM_DURATION:
+                    win.flip() # Blank screen
+                    telemetry.flip()
+                    stim_on = False
+
+                for k in responses.poll([RESPONSE_KEY, 'escape']):
+                    handle_key(k)
+                telemetry.mark('keys')
+
+                # Short sleep to prevent CPU hogging
+                core.wait(0.001)
+                telemetry.mark('wait')
 
         # Save trial data
+        resp_key, resp_rt = response['key'], response['rt']
         correct = (is_target and resp_key == RESPONSE_KEY) or (not is_target and resp_key is None)
-        results.append({
+        logger.log({
             'subject_name': subject_name,
             'run': run_idx + 1,
             'block': block_idx + 1,
@@ -121,48 +161,83 @@ def run_block(run_idx, block_idx, n, stim_type, results):
             'is_target': int(is_target),
             'resp_key': resp_key if resp_key else '',
             'resp_rt': resp_rt if resp_rt else '',
-            'correct': int(correct)
+            'correct': int(correct),
+            'stim_swap_ms': stim_swap_ms,
+            **timing
         })
+        telemetry.mark('log')
  
 
-# Main Experiment Loop
-results = []
-global_clock.reset()
+# Trial schedule: every block is generated (and saved) before the first trial
+def build_schedule(seed=None):
+    """All blocks' trials (no PsychoPy needed)."""
+    schedule_blocks = [{'run': 1, 'block': block_idx + 1, 'n': n, 'stim_type': stim_type}
+                       for block_idx, (n, stim_type) in enumerate(zip(N_BY_BLOCK, STIMTYPE_BY_BLOCK))]
+    return build_session(seed, schedule_blocks, stimuli, N_TRIALS_PER_BLOCK, N_TARGETS_PER_BLOCK)
 
-for block_idx, (n, stim_type) in enumerate(zip(N_BY_BLOCK, STIMTYPE_BY_BLOCK)):
 
-    # Instruction screen - Wait for space to begin
-    instr_text.text = (f"Block {block_idx + 1}/{len(N_BY_BLOCK)}\n\n"
-                      f"Task: {n}-BACK\n"
-                      f"Stimuli: {stim_type.capitalize()}\n\n"
-                      f"Press the '{RESPONSE_KEY.upper()}' key when the stimulus matches the one {n} trials ago.\n\n"
-                      f"Press {RESPONSE_KEY.upper()} to start.")
+# Main Experiment Loop
+def main():
+    global visual, core, schedule, schedule_by_block
+    from psychopy import visual, core
+    startup.mark('psychopy import')
+    ask_subject()
+    schedule = build_schedule(SEED)
+    save_schedule(schedule, SCHEDULE_FILE)
+    schedule_by_block = group_by_block(schedule)
+    setup()
+    if TELEMETRY:
+        telemetry.enable(presenter.frame_rate if FRAME_LOCKED else None) # late frames only mean something when every frame flips
+
+    # Rows are appended as they happen; a crash keeps everything logged up to that point.
+    # The file is <session>.csv.part until the session ends, so compaction never takes it for finished
+    logger = TrialLogger(DATA_FILE, FIELDNAMES, atomic=True)
+    global_clock.reset()
+
+    for block_idx, (n, stim_type) in enumerate(zip(N_BY_BLOCK, STIMTYPE_BY_BLOCK)):
+
+        # Instruction screen - Wait for space to begin
+        instr_text.text = (f"Block {block_idx + 1}/{len(N_BY_BLOCK)}\n\n"
+                          f"Task: {n}-BACK\n"
+                          f"Stimuli: {stim_type.capitalize()}\n\n"
+                          f"Press the '{RESPONSE_KEY.upper()}' key when the stimulus matches the one {n} trials ago.\n\n"
+                          f"Press {RESPONSE_KEY.upper()} to start.")
     
-    kb.clearEvents()
-    while True:
-        instr_text.draw()
-        win.flip()
-        keys = kb.getKeys(keyList=[RESPONSE_KEY, 'escape'], waitRelease=False)
-        if 'escape' in [k.name for k in keys]:
-            core.quit()
-        if RESPONSE_KEY in [k.name for k in keys]:
-            break
-        core.wait(0.01)
-
-    # run the task
-    run_block(0, block_idx, n, stim_type, results)
-
-# Save data
-with open(DATA_FILE, 'w', newline='') as f:
-    fieldnames = ['subject_name', 'run', 'block', 'trial', 'event_type', 'timestamp', 'n', 'stim_type', 'stimulus', 'is_target', 'resp_key', 'resp_rt', 'correct']
-    writer = csv.DictWriter(f, fieldnames=fieldnames)
-    writer.writeheader()
-    writer.writerows(results)
-
-# Final Screen
-instr_text.text = "Experiment Complete!\n\nThank you."
-instr_text.draw()
-win.flip()
-core.wait(5)
-win.close()
-core.quit()
\ No newline at end of file
+        trials = schedule_by_block[(1, block_idx + 1)]
+        if stim_type != 'letters':
+            image_cache.queue(t['stimulus'] for t in trials)
+
+        responses.clear()
+        while True:
+            instr_text.draw()
+            image_cache.service()
+            win.flip()
+            startup.report('nback_beh first screen') # launch -> first screen, printed once
+            keys = responses.poll([RESPONSE_KEY, 'escape'])
+            if 'escape' in [k.name for k in keys]:
+                core.quit()
+            if RESPONSE_KEY in [k.name for k in keys]:
+                break
+            core.wait(0.01)
+
+        # run the task
+        image_cache.fill()
+        run_block(0, block_idx, n, stim_type, trials, logger)
+        logger.flush() # fsync at the block boundary, never inside the trial loop
+
+    logger.close()
+    telemetry.finish(DATA_FILE)
+
+    print('Stimulus cache:', image_cache.stats())
+
+    # Final Screen
+    instr_text.text = "Experiment Complete!\n\nThank you."
+    instr_text.draw()
+    win.flip()
+    core.wait(5)
+    win.close()
+    core.quit()
+
+
+if __name__ == '__main__':
+    main()
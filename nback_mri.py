@@ -1,6 +1,13 @@
-from psychopy import visual, core, event, gui
-from psychopy.hardware import keyboard
-import random, csv, os
+import os, time
+from tasklib import startup, telemetry
+from tasklib.stim_cache import TextureCache
+from tasklib.texture_store import TextureStore
+from tasklib.frame_timing import FramePresenter
+from tasklib.responses import ResponseBox
+from tasklib.schedule import build_session, save_schedule, group_by_block
+from tasklib.shards import session_path
+from tasklib.trial_logger import TrialLogger
+from tasklib.trigger_qa import TriggerMonitor
 """
 EXPERIMENT TIMELINE
 6 runs of 7 mins each = 42 mins
@@ -39,96 +46,159 @@ N_TRIALS_PER_BLOCK = 41 # 82 seconds
 N_TARGETS_PER_BLOCK = 14 # about 1/3 of stimuli are targets
 RESPONSE_KEY = 'space'
 SCANNER_TRIGGER = 't' 
-DATA_FILE = 'nback_data_mri.csv'
+TR = 2.0 # scanner repetition time (s); used for live trigger QA
+FRAME_LOCKED = False # count onset/offset in screen refreshes (timestamps from the flip) instead of polling a clock
+TELEMETRY = False # record per-frame timings by phase, GC pauses and flip intervals; saved next to DATA_FILE (tasklib.telemetry)
+DATA_FILE = '_data/nback_mri.csv' # each session writes its own file in ./_data/nback_mri/ (merge: python -m tasklib.shards compact _data/nback_mri)
+SCHEDULE_FILE = None # set per session: <session>_schedule.csv next to its data file
+SEED = None # set to regenerate a previous session's schedule (seed is saved in SCHEDULE_FILE)
 STIMULI_DIR = '_stimuli'
+STIM_CACHE_MB = 256 # decoded image textures kept in memory before LRU eviction
+TEXTURE_STORE = os.path.join(STIMULI_DIR, '_store') # pre-resized images (python -m tasklib.texture_store build _stimuli); JPEGs are decoded if it isn't built
+
+# Output schema
+FIELDNAMES = ['subject_id', 'run', 'block', 'trial', 'event_type', 'timestamp', 'n', 'stim_type', 'stimulus', 'is_target',
+              'resp_key', 'resp_rt', 'correct', 'stim_swap_ms',
+              'intended_onset', 'actual_onset', 'intended_offset', 'actual_offset', 'dropped_frames', 'cpu_ms']
 
 # Define stimuli
 stimuli = {
     'letters': ['B', 'C', 'D', 'F', 'G', 'H', 'J', 'K', 'L', 'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'X', 'Y', 'Z'],
-    'faces': [os.path.join(STIMULI_DIR, f'face{i}.jpg') for i in range(60)],
-    'scenes': [os.path.join(STIMULI_DIR, f'scene{i}.jpg') for i in range(60)]
+    'faces': [os.path.join(STIMULI_DIR, f'faces/{i}.jpg') for i in range(60)],
+    'scenes': [os.path.join(STIMULI_DIR, f'scenes/{i}.jpg') for i in range(60)]
 }
 
-# Setup psychopy stuff
-win = visual.Window([1024, 768], color='black', fullscr=True, units='height')
-win.mouseVisible = False
-fixation = visual.TextStim(win, text='+', color='white', height=0.1)
-text_stim = visual.TextStim(win, text='', color='white', height=0.2)
-image_stim = visual.ImageStim(win, size=(0.5, 0.5))
-instr_text = visual.TextStim(win, text='', color='white', height=0.05, wrapWidth=0.8)
-global_clock = core.Clock()
-rest_clock = core.Clock()
-kb = keyboard.Keyboard()
-
-def execute_block(run_idx, block_idx, n, stim_type, results):
-    """Executes a single 82-second block of N-back."""
-
-    # Generate sequence of targets (target cannot be in first 'n' trials)
-    is_targets = [True] * N_TARGETS_PER_BLOCK + [False] * (N_TRIALS_PER_BLOCK - N_TARGETS_PER_BLOCK - n)
-    random.shuffle(is_targets)
-    is_targets = [False] * n + is_targets
-    
-    block_stimuli = []
-    for i in range(N_TRIALS_PER_BLOCK):
-        is_target = is_targets[i]
-        if is_target:
-            current_stim = block_stimuli[i - n]
-        else:
-            if i >= n:
-                # Pick a stim that isn't the n-back match
-                available = [s for s in stimuli[stim_type] if s != block_stimuli[i-n]]
-                current_stim = random.choice(available)
-            else:
-                current_stim = random.choice(stimuli[stim_type])
-        block_stimuli.append(current_stim)
-        
+
+def ask_subject():
+    """Startup dialog; points DATA_FILE and SCHEDULE_FILE at this session's own files."""
+    global subject_id, DATA_FILE, SCHEDULE_FILE
+    from psychopy import core, gui
+    dlg = gui.Dlg(title="N-back Task (MRI)")
+    dlg.addField('Subject ID:')
+    dlg.show()
+    if not dlg.OK:
+        core.quit()
+    subject_id = dlg.data[0]
+
+    # a new file per session, so sessions (and re-run attempts) never mix
+    DATA_FILE = session_path(DATA_FILE, subject_id)
+    SCHEDULE_FILE = os.path.splitext(DATA_FILE)[0] + '_schedule.csv'
+    startup.mark('dialog')
+
+
+def setup():
+    """Import PsychoPy and create the window and stimuli (nothing above needs them)."""
+    global visual, core, win, fixation, text_stim, image_cache, instr_text, global_clock, rest_clock, responses, presenter
+    from psychopy import visual, core
+    startup.mark('psychopy import')
+
+    win = visual.Window([1024, 768], color='black', fullscr=True, units='height')
+    win.mouseVisible = False
+    startup.mark('window')
+    fixation = visual.TextStim(win, text='+', color='white', height=0.1)
+    text_stim = visual.TextStim(win, text='', color='white', height=0.2)
+    image_cache = TextureCache(win, size=(0.5, 0.5), max_mb=STIM_CACHE_MB, store=TextureStore.open(TEXTURE_STORE))
+    instr_text = visual.TextStim(win, text='', color='white', height=0.05, wrapWidth=0.8)
+    global_clock = core.Clock()
+    rest_clock = core.Clock()
+    responses = ResponseBox() # hardware-timestamped keys (and scanner triggers) where available
+    presenter = FramePresenter(win, responses.kb, global_clock) if FRAME_LOCKED else None
+    startup.mark('stimuli')
+
+
+def log_trigger(run_idx, block_idx=None, key=None):
+    """Log a scanner trigger and check it against the TR grid (warnings go to the console).
+
+    With the trigger's key event, it is timed from when the key went down, not
+    from when we got round to polling it.
+    """
+    t = global_clock.getTime() - (responses.since(key) if key is not None else 0)
+    logger.log({'subject_id': subject_id, 'run': run_idx+1, 'block': block_idx+1 if block_idx is not None else '', 'event_type': 'trigger', 'timestamp': t})
+    for issue in trigger_monitor.add(t):
+        print(f'[trigger QA] run {run_idx+1}: {issue}')
+
+
+def prepare_stimulus(stim_type, stim):
+    """Swap a trial's stimulus in and return the object to draw (images are already uploaded)."""
+    if stim_type == 'letters':
+        text_stim.text = stim
+        return text_stim
+    return image_cache.get(stim)
+
+
+def execute_block(run_idx, block_idx, n, stim_type, trials, logger):
+    """Executes a single 82-second block of N-back from its precomputed trials."""
+    if FRAME_LOCKED:
+        presenter.start_block()
+    telemetry.block(f'run{run_idx + 1}-block{block_idx + 1}')
+    for i, trial in enumerate(trials):
+        telemetry.trial(i + 1)
+        is_target = bool(trial['is_target'])
+        current_stim = trial['stimulus']
+
         trial_start_time = global_clock.getTime()
-        
-        # Draw Stimulus
-        if stim_type == 'letters':
-            text_stim.text = current_stim
-            text_stim.draw()
+        response = {'key': None, 'rt': None}
+
+        def handle_key(k):
+            if k.name == 'escape': core.quit()
+            elif k.name == SCANNER_TRIGGER:
+                log_trigger(run_idx, block_idx, k)
+            elif k.name == RESPONSE_KEY and response['key'] is None:
+                response['key'] = k.name
+                response['rt'] = k.rt
+
+        swap_start = time.perf_counter()
+        stim_obj = prepare_stimulus(stim_type, current_stim)
+        telemetry.mark('setup')
+        if FRAME_LOCKED:
+            # Onset/offset/end are counted in frames from the block's first flip
+            stim_swap_ms = (time.perf_counter() - swap_start) * 1000
+            timing = presenter.run_trial(stim_obj.draw, presenter.frames(STIM_DURATION), presenter.frames(TRIAL_DURATION),
+                                         [RESPONSE_KEY, SCANNER_TRIGGER, 'escape'], handle_key)
+            stim_swap_ms += timing.pop('first_draw_ms') or 0
         else:
-            image_stim.image = current_stim
-            image_stim.draw()
-        win.flip()
-        
-        resp_key = None
-        resp_rt = None
-        trial_clock = core.Clock()
-        stim_on = True
-        
-        # Trial Loop (Fixed 2.0s)
-        while trial_clock.getTime() < TRIAL_DURATION:
-            if stim_on and trial_clock.getTime() >= STIM_DURATION:
-                win.flip() # Offset stimulus at 1.5s
-                stim_on = False
-                
-            keys = kb.getKeys(keyList=[RESPONSE_KEY, SCANNER_TRIGGER, 'escape'], waitRelease=False)
-            for k in keys:
-                if k.name == 'escape': core.quit()
-                elif k.name == SCANNER_TRIGGER:
-                    results.append({'run': run_idx+1, 'block': block_idx+1, 'event_type': 'trigger', 'timestamp': global_clock.getTime()})
-                elif k.name == RESPONSE_KEY and resp_key is None:
-                    resp_key = k.name
-                    resp_rt = k.rt
-            core.wait(0.001)
+            stim_obj.draw()
+            stim_swap_ms = (time.perf_counter() - swap_start) * 1000
+            responses.on_flip(win) # RTs are timed from the onset flip
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+            timing = {}
+
+            trial_clock = core.Clock()
+            stim_on = True
+
+            # Trial Loop (Fixed 2.0s)
+            while trial_clock.getTime() < TRIAL_DURATION:
+                if stim_on and trial_clock.getTime() >= STIM_DURATION:
+                    win.flip() # Offset stimulus at 1.5s
+                    telemetry.flip()
+                    stim_on = False
+
+                for k in responses.poll([RESPONSE_KEY, SCANNER_TRIGGER, 'escape']):
+                    handle_key(k)
+                telemetry.mark('keys')
+                core.wait(0.001)
+                telemetry.mark('wait')
 
         # Log Data
+        resp_key, resp_rt = response['key'], response['rt']
         correct = (is_target and resp_key == RESPONSE_KEY) or (not is_target and resp_key is None)
-        results.append({
-            'run': run_idx + 1, 'block': block_idx + 1, 'trial': i + 1,
+        logger.log({
+            'subject_id': subject_id, 'run': run_idx + 1, 'block': block_idx + 1, 'trial': i + 1,
             'event_type': 'trial', 'timestamp': trial_start_time,
             'n': n, 'stim_type': stim_type, 'stimulus': current_stim,
             'is_target': int(is_target), 'resp_key': resp_key if resp_key else '',
-            'resp_rt': resp_rt if resp_rt else '', 'correct': int(correct)
+            'resp_rt': resp_rt if resp_rt else '', 'correct': int(correct),
+            'stim_swap_ms': stim_swap_ms, **timing
         })
+        telemetry.mark('log')
 
 
-def execute_run(run_idx, stim_type, run_n_order, results):
+def execute_run(run_idx, stim_type, run_n_order, run_blocks, logger):
     """Handles the full task/run cycle."""
-    rests = list(INTER_BLOCK_RESTS)
-    random.shuffle(rests)
+    if stim_type != 'letters':
+        image_cache.queue(t['stimulus'] for trials in run_blocks for t in trials)
 
     # 1. Initial Instructions (10s, skippable by button press)
     first_n = run_n_order[0]
@@ -136,19 +206,28 @@ def execute_run(run_idx, stim_type, run_n_order, results):
     while rest_clock.getTime() < INSTRUCTIONS_DURATION:
         instr_text.text = f"RUN {run_idx+1}: {stim_type.upper()}\n\nNext: {first_n}-back\n\nStarting in {int(INSTRUCTIONS_DURATION - rest_clock.getTime())} seconds...\n\n(Press button to start immediately)"
         instr_text.draw()
+        image_cache.service()
         win.flip()
-        keys = kb.getKeys(keyList=[RESPONSE_KEY, 'escape'], waitRelease=False)
+        keys = responses.poll([RESPONSE_KEY, SCANNER_TRIGGER, 'escape'])
+        for k in keys:
+            if k.name == SCANNER_TRIGGER: log_trigger(run_idx, key=k)
         if 'escape' in [k.name for k in keys]: core.quit()
         if RESPONSE_KEY in [k.name for k in keys]: break
 
     # 2. task-rest-task-rest cycle
     for block_idx, n in enumerate(run_n_order):
         # Task (82s)
-        execute_block(run_idx, block_idx, n, stim_type, results)
+        image_cache.fill() # anything the (skippable) instructions didn't get to
+        execute_block(run_idx, block_idx, n, stim_type, run_blocks[block_idx], logger)
+        logger.flush() # fsync at the block boundary, never inside the trial loop
 
         # Rest (20s)
-        rest_duration = rests[block_idx]
+        rest_duration = run_blocks[block_idx][0]['rest']
         rest_clock.reset()
+        # Preload the next run's images during the final rest
+        if block_idx == len(run_n_order) - 1 and run_idx + 1 < len(STIMTYPE_BY_RUN):
+            if STIMTYPE_BY_RUN[run_idx + 1] != 'letters':
+                image_cache.queue(t['stimulus'] for t in schedule if t['run'] == run_idx + 2)
         while rest_clock.getTime() < rest_duration:
             # Show n-back for the NEXT block during rest, unless it's the final wrap-up
             if block_idx < len(run_n_order) - 1:
@@ -158,37 +237,68 @@ def execute_run(run_idx, stim_type, run_n_order, results):
                 instr_text.text = f"REST\n\nRun complete.\n({int(rest_duration - rest_clock.getTime())}s)"
             
             instr_text.draw()
+            image_cache.service()
             win.flip()
-            if 'escape' in [k.name for k in kb.getKeys(keyList=['escape'])]: core.quit()
+            for k in responses.poll([SCANNER_TRIGGER, 'escape']):
+                if k.name == 'escape': core.quit()
+                log_trigger(run_idx, block_idx, k)
+
+
+# ===== TRIAL SCHEDULE =====
+def build_schedule(seed=None):
+    """Every run and block, generated before the first scanner trigger (no PsychoPy needed)."""
+    schedule_blocks = [{'run': run_idx + 1, 'block': block_idx + 1, 'n': n, 'stim_type': stim_type}
+                       for run_idx, stim_type in enumerate(STIMTYPE_BY_RUN)
+                       for block_idx, n in enumerate(RUN_N_ORDERS[run_idx % 2])]
+    return build_session(seed, schedule_blocks, stimuli, N_TRIALS_PER_BLOCK, N_TARGETS_PER_BLOCK, rests=INTER_BLOCK_RESTS)
 
 
 # ===== MAIN EXPERIMENT LOOP =====
-results = []
-for run_idx, stim_type in enumerate(STIMTYPE_BY_RUN):
-    # Wait for Trigger
-    instr_text.text = f"RUN {run_idx+1}/6: {stim_type.upper()}\n\nWaiting for scanner..."
-    instr_text.draw()
-    win.flip()
-    
-    kb.clearEvents()
-    keys = kb.waitKeys(keyList=[SCANNER_TRIGGER, 'escape'])
-    if 'escape' in [k.name for k in keys]: core.quit()
+def main():
+    global schedule, schedule_by_block, logger, trigger_monitor
+    ask_subject()
+    schedule = build_schedule(SEED)
+    save_schedule(schedule, SCHEDULE_FILE)
+    schedule_by_block = group_by_block(schedule)
+    setup()
+    if TELEMETRY:
+        telemetry.enable(presenter.frame_rate if FRAME_LOCKED else None) # late frames only mean something when every frame flips
+
+    # Rows are appended as they happen; a crash keeps everything logged up to that point.
+    # The file is <session>.csv.part until the session ends, so compaction never takes it for finished
+    logger = TrialLogger(DATA_FILE, FIELDNAMES, atomic=True)
+    for run_idx, stim_type in enumerate(STIMTYPE_BY_RUN):
+        # Wait for Trigger
+        instr_text.text = f"RUN {run_idx+1}/6: {stim_type.upper()}\n\nWaiting for scanner..."
+        instr_text.draw()
+        win.flip()
+        startup.report('nback_mri first screen') # launch -> first screen, printed once
     
-    results.append({'run': run_idx + 1, 'event_type': 'run_start', 'timestamp': global_clock.getTime(), 'stim_type': stim_type})
-    this_run_n_order = RUN_N_ORDERS[run_idx % 2] # (1-2-1-2 or 2-1-2-1)
-    execute_run(run_idx, stim_type, this_run_n_order, results)
+        responses.clear()
+        key = responses.wait([SCANNER_TRIGGER, 'escape'])
+        if key.name == 'escape': core.quit()
     
-    # Save data after every run
-    with open(DATA_FILE, 'w', newline='') as f:
-        fieldnames = ['run', 'block', 'trial', 'event_type', 'timestamp', 'n', 'stim_type', 'stimulus', 'is_target', 'resp_key', 'resp_rt', 'correct']
-        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-        writer.writeheader()
-        writer.writerows(results)
-
-# Final Screen
-instr_text.text = "Experiment Complete!\n\nThank you."
-instr_text.draw()
-win.flip()
-core.wait(5)
-win.close()
-core.quit()
\ No newline at end of file
+        run_start = global_clock.getTime() - responses.since(key)
+        logger.log({'subject_id': subject_id, 'run': run_idx + 1, 'event_type': 'run_start', 'timestamp': run_start, 'stim_type': stim_type})
+        trigger_monitor = TriggerMonitor(TR) # the run_start trigger is volume 0
+        trigger_monitor.add(run_start)
+        this_run_n_order = RUN_N_ORDERS[run_idx % 2] # (1-2-1-2 or 2-1-2-1)
+        run_blocks = [schedule_by_block[(run_idx + 1, block_idx + 1)] for block_idx in range(len(this_run_n_order))]
+        execute_run(run_idx, stim_type, this_run_n_order, run_blocks, logger)
+        print(f'[trigger QA] run {run_idx+1}:', trigger_monitor.summary())
+
+    logger.close()
+    telemetry.finish(DATA_FILE)
+    print('Stimulus cache:', image_cache.stats())
+
+    # Final Screen
+    instr_text.text = "Experiment Complete!\n\nThank you."
+    instr_text.draw()
+    win.flip()
+    core.wait(5)
+    win.close()
+    core.quit()
+
+
+if __name__ == '__main__':
+    main()
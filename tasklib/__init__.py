@@ -0,0 +1 @@
+"""Shared runtime helpers for the PsychoPy task scripts."""
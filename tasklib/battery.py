@@ -0,0 +1,99 @@
+"""Run several tasks back to back in one process: one PsychoPy import, one window,
+one subject dialog and one data file for the whole session.
+
+While the participant reads a task's end screen, the next task's stimuli are
+built, so the only gap between tasks is the participant's own key press.
+"""
+import time
+from tasklib import startup, telemetry
+from tasklib.shards import session_path
+from tasklib.tasks.base import Session
+from tasklib.trial_logger import TrialLogger
+
+
+class TaskLog:
+    """A task's view of the shared session logger: tags each row with the task name."""
+
+    def __init__(self, logger, task):
+        self.logger = logger
+        self.task = task
+        self.rows = [] # kept for scoring at the end of the session
+
+    def log(self, row):
+        row = dict(row, task=self.task)
+        self.rows.append(row)
+        self.logger.log(row)
+
+    def flush(self):
+        self.logger.flush()
+
+
+def battery_fieldnames(tasks):
+    """'task' followed by every task's columns, in order, without duplicates."""
+    fields = ['task']
+    for task in tasks:
+        fields += [f for f in task.FIELDNAMES if f not in fields]
+    return fields
+
+
+def ask_battery(session, tasks, title='Task Battery'):
+    """One dialog for the whole battery: subject ID plus each task's extra fields."""
+    extra = [f for task in tasks for f in task.dialog_fields[1:]]
+    answers = session.ask_subject(title, ('Subject ID:',) + tuple(extra))[1:]
+    for task in tasks:
+        k = len(task.dialog_fields) - 1
+        task.configure(answers[:k])
+        answers = answers[k:]
+
+
+def transition_screen(session, task, next_task):
+    """Show the end-of-task screen and build next_task behind it; returns the build time (s)."""
+    end_text = task.text(session, f'{task.title} complete!\n\nNext: {next_task.title}\n\nPress SPACE to continue',
+                         height=0.08)
+    end_text.draw()
+    session.responses.clear()
+    session.win.flip()
+    start = time.perf_counter()
+    next_task.build(session)
+    build_s = time.perf_counter() - start
+    # keys pressed while we were building still count
+    session.responses.wait(['space'])
+    return build_s
+
+
+def run_battery(tasks, data_file, session=None, record_frames=False):
+    """Run tasks in order on one Session; returns {task name: score dict}.
+
+    record_frames saves per-frame timings of all tasks (tasklib.telemetry) next to the session's file.
+    """
+    session = session or Session()
+    ask_battery(session, tasks)
+    path = session_path(data_file, session.subject_id)
+    logger = TrialLogger(path, battery_fieldnames(tasks), atomic=True)
+    tasks[0].build(session)
+    startup.mark('stimuli')
+    if record_frames:
+        telemetry.enable()
+
+    scores = {}
+    for i, task in enumerate(tasks):
+        task_log = TaskLog(logger, task.name)
+        session.win.color = task.background or session.win_kwargs['color']
+        start = time.perf_counter()
+        task.run(session, task_log)
+        logger.flush() # each finished task is safely on disk
+        run_s = time.perf_counter() - start
+        scores[task.name] = task.score(task_log.rows)
+        if i + 1 < len(tasks):
+            build_s = transition_screen(session, task, tasks[i + 1])
+            print(f'[battery] {task.name}: {run_s:.1f}s, {tasks[i + 1].name} built in {build_s * 1000:.0f} ms behind the end screen')
+        else:
+            print(f'[battery] {task.name}: {run_s:.1f}s')
+    logger.close()
+    telemetry.finish(path)
+
+    for name, score in scores.items():
+        print(f'[battery] {name} score:', score)
+    tasks[-1].end_screen(session)
+    session.close()
+    return scores
@@ -0,0 +1,96 @@
+"""Frame-counted stimulus presentation."""
+import time
+from tasklib import telemetry
+
+
+class FramePresenter:
+    """Presents trials on a grid of screen refreshes instead of polling a wall clock.
+
+    Onset, offset and trial end are frame counts from the block's first flip, so a
+    late or dropped frame delays only that frame and never shifts later trials.
+    Onset/offset timestamps are taken from the flip itself (callOnFlip), the
+    keyboard clock is reset on the onset flip so key.rt is relative to it, and the
+    keyboard is polled once per frame.
+    """
+
+    def __init__(self, win, kb, clock, frame_rate=None):
+        self.win = win
+        self.kb = kb
+        self.clock = clock
+        if frame_rate is None:
+            frame_rate = win.getActualFrameRate(nIdentical=20, nMaxFrames=240) or 60.0
+        self.frame_rate = frame_rate
+        self.frame_dur = 1.0 / frame_rate
+        self.start_block()
+
+    def frames(self, seconds):
+        """Number of refreshes closest to a duration in seconds."""
+        return max(1, int(round(seconds / self.frame_dur)))
+
+    def start_block(self):
+        """Reset the frame grid; the next flip becomes frame 0."""
+        self._anchor = None
+        self._cursor = 0 # frame index the next flip should land on
+        self._next_onset = 0
+
+    def _stamp(self, times, name):
+        times[name] = self.clock.getTime()
+
+    def _flip(self):
+        self.win.flip()
+        telemetry.flip()
+        t = self.clock.getTime()
+        if self._anchor is None:
+            self._anchor = t - self._cursor * self.frame_dur
+        return int(round((t - self._anchor) / self.frame_dur))
+
+    def run_trial(self, draw_stim, stim_frames, trial_frames, key_list, on_key):
+        """Show one trial; on_key(k) is called for every key as soon as it is polled.
+
+        Returns intended/actual onset and offset (on self.clock), dropped frames,
+        CPU time and how long the onset frame's draw took.
+        """
+        onset_frame = self._next_onset
+        offset_frame = onset_frame + stim_frames
+        end_frame = onset_frame + trial_frames
+        times = {}
+        dropped = 0
+        first_draw_ms = None
+        offset_requested = False
+        cpu_start = time.process_time()
+
+        frame = max(self._cursor, onset_frame)
+        while frame < end_frame:
+            if frame < offset_frame:
+                if first_draw_ms is None:
+                    draw_start = time.perf_counter()
+                    draw_stim()
+                    first_draw_ms = (time.perf_counter() - draw_start) * 1000
+                    self.win.callOnFlip(self._stamp, times, 'onset')
+                    self.win.callOnFlip(self.kb.clock.reset)
+                else:
+                    draw_stim()
+            elif not offset_requested:
+                offset_requested = True
+                self.win.callOnFlip(self._stamp, times, 'offset')
+            telemetry.mark('draw')
+
+            landed = self._flip()
+            dropped += max(0, landed - frame)
+            frame = max(landed, frame) + 1
+
+            for k in self.kb.getKeys(keyList=key_list, waitRelease=False):
+                on_key(k)
+            telemetry.mark('keys')
+
+        self._cursor = frame
+        self._next_onset = end_frame
+        return {
+            'intended_onset': self._anchor + onset_frame * self.frame_dur,
+            'actual_onset': times.get('onset', ''),
+            'intended_offset': self._anchor + offset_frame * self.frame_dur,
+            'actual_offset': times.get('offset', ''),
+            'dropped_frames': dropped,
+            'cpu_ms': (time.process_time() - cpu_start) * 1000,
+            'first_draw_ms': first_draw_ms,
+        }
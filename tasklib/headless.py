@@ -0,0 +1,633 @@
+"""Headless simulated-participant harness for the task scripts.
+
+Runs a task script unchanged against stub PsychoPy modules: a window that records
+what is drawn, a keyboard fed by a simulated participant, and a virtual clock that
+jumps ahead instead of waiting. A 42-minute scanner session finishes in well under a
+minute on a box with no display or GPU, and the report shows per-frame and per-trial
+loop overhead, schedule-generation and logging cost, and whether the data file
+matches the schedule and the participant's responses.
+
+    python -m tasklib.headless nback_mri.py --accuracy 0.85 --set FRAME_LOCKED=True
+    python -m tasklib.headless tasks-python/flanker.py --rt-mu 0.45 --json report.json
+"""
+import argparse, ast, builtins, csv, json, math, os, random, re, sys, tempfile, time, types
+from bisect import insort
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_sim = None # the Simulation currently driving the stub modules
+
+
+# ===== VIRTUAL CLOCK AND KEY EVENTS =====
+class Simulation:
+    """Virtual time, the pending key events, and the measurements taken along the way."""
+
+    def __init__(self, participant, frame_rate=60.0, tr=None, tr_drift_ppm=0.0, trigger_key='t', dialog=()):
+        self.participant = participant
+        self.frame_rate = frame_rate
+        self.frame_dur = 1.0 / frame_rate
+        self.now = 0.0
+        self.tr = tr
+        self.tr_actual = tr * (1 + tr_drift_ppm * 1e-6) if tr else None
+        self.trigger_key = trigger_key
+        self.dialog = list(dialog)
+        self._next_trigger = self.tr_actual
+        self._events = [] # sorted (time, seq, key)
+        self._seq = 0
+        self.n_flips = 0
+        self.frame_real = [] # real seconds between consecutive flips
+        self.trial_real = [] # real seconds between consecutive stimulus onsets
+        self._last_flip_real = None
+        self._last_onset_real = None
+
+    def press(self, t, key):
+        self._seq += 1
+        insort(self._events, (t, self._seq, key))
+
+    def _triggers_until(self, t):
+        while self._next_trigger is not None and self._next_trigger <= t:
+            self.press(self._next_trigger, self.trigger_key)
+            self._next_trigger += self.tr_actual
+
+    def take(self, key_list, until):
+        """Remove and return (time, key) events up to `until`, optionally limited to key_list."""
+        self._triggers_until(until)
+        taken, kept = [], []
+        for ev in self._events:
+            if ev[0] <= until and (not key_list or ev[2] in key_list):
+                taken.append((ev[0], ev[2]))
+            else:
+                kept.append(ev)
+        self._events = kept
+        return taken
+
+    def next_time(self, key_list):
+        """Time of the next event in key_list at or after now (None if nothing is coming)."""
+        times = [ev[0] for ev in self._events if not key_list or ev[2] in key_list]
+        if self._next_trigger is not None and (not key_list or self.trigger_key in key_list):
+            times.append(self._next_trigger)
+        return max(self.now, min(times)) if times else None
+
+    def clear(self):
+        self._triggers_until(self.now)
+        self._events = [ev for ev in self._events if ev[0] > self.now]
+
+    def advance(self, t):
+        self.now = max(self.now, t)
+
+    def flip(self, win):
+        real = time.perf_counter()
+        if self._last_flip_real is not None:
+            self.frame_real.append(real - self._last_flip_real)
+        self._last_flip_real = real
+        self.n_flips += 1
+        self.advance((math.floor(self.now / self.frame_dur + 1e-6) + 1) * self.frame_dur)
+        calls, win._to_call = win._to_call, []
+        for func, args, kwargs in calls:
+            func(*args, **kwargs)
+        display, win._drawn = win._drawn, []
+        for delay, key in self.participant.on_flip(display):
+            self.press(self.now + delay, key)
+        if self.participant.onset:
+            if self._last_onset_real is not None:
+                self.trial_real.append(real - self._last_onset_real)
+            self._last_onset_real = real
+        return self.now
+
+
+# ===== STUB PSYCHOPY MODULES =====
+class Clock:
+    def __init__(self):
+        self._t0 = _sim.now
+
+    def getTime(self):
+        return _sim.now - self._t0
+
+    def reset(self, newT=0.0):
+        self._t0 = _sim.now + newT
+
+    def getLastResetTime(self):
+        return self._t0
+
+
+class _Stim:
+    defaults = {}
+
+    def __init__(self, win, **kwargs):
+        self.win = win
+        self.__dict__.update(self.defaults)
+        self.__dict__.update(kwargs)
+
+    def snapshot(self):
+        return {'type': type(self).__name__}
+
+    def draw(self, win=None):
+        (win or self.win)._drawn.append(self.snapshot())
+
+
+class TextStim(_Stim):
+    defaults = {'text': '', 'pos': (0, 0), 'height': None, 'color': 'white'}
+
+    def snapshot(self):
+        return {'type': 'TextStim', 'text': str(self.text), 'pos': tuple(self.pos), 'height': self.height}
+
+
+class ImageStim(_Stim):
+    defaults = {'image': None, 'pos': (0, 0), 'size': None}
+
+    def snapshot(self):
+        image = self.image if isinstance(self.image, str) else getattr(self, 'name', None) or id(self.image)
+        return {'type': 'ImageStim', 'image': image, 'pos': tuple(self.pos)}
+
+
+class Rect(_Stim):
+    defaults = {'pos': (0, 0), 'fillColor': None, 'width': 0.5, 'height': 0.5}
+
+    def snapshot(self):
+        return {'type': 'Rect', 'pos': tuple(self.pos), 'fillColor': self.fillColor}
+
+
+class Window:
+    def __init__(self, size=(800, 600), color=None, fullscr=False, units=None, **kwargs):
+        self.size = list(size)
+        self.units = units
+        self.mouseVisible = True
+        self._drawn = []
+        self._to_call = []
+
+    def flip(self, clearBuffer=True):
+        return _sim.flip(self)
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._to_call.append((function, args, kwargs))
+
+    def timeOnFlip(self, obj, attrib):
+        self.callOnFlip(lambda: obj.__setitem__(attrib, _sim.now) if isinstance(obj, dict) else setattr(obj, attrib, _sim.now))
+
+    def getActualFrameRate(self, **kwargs):
+        return _sim.frame_rate
+
+    @property
+    def monitorFramePeriod(self):
+        return _sim.frame_dur
+
+    def close(self):
+        pass
+
+
+class KeyPress:
+    def __init__(self, name, t_down, rt):
+        self.name = self.value = name
+        self.tDown = t_down
+        self.rt = rt
+        self.duration = None
+
+
+class Keyboard:
+    def __init__(self, *args, **kwargs):
+        self.clock = Clock()
+
+    def getKeys(self, keyList=None, waitRelease=True, clear=True):
+        return [KeyPress(key, t, t - self.clock._t0) for t, key in _sim.take(keyList, _sim.now)]
+
+    def waitKeys(self, maxWait=float('inf'), keyList=None, waitRelease=True, clear=True):
+        t = _sim.next_time(keyList)
+        if t is None and math.isinf(maxWait):
+            raise RuntimeError(f'simulation stalled waiting for {keyList}')
+        if t is None or t > _sim.now + maxWait:
+            _sim.advance(_sim.now + maxWait)
+            return []
+        _sim.advance(t)
+        return self.getKeys(keyList)
+
+    def clearEvents(self, eventType=None):
+        _sim.clear()
+
+
+def wait_keys(maxWait=float('inf'), keyList=None, modifiers=False, timeStamped=False, clearEvents=True):
+    if clearEvents:
+        _sim.clear()
+    t = _sim.next_time(keyList)
+    if t is None and math.isinf(maxWait):
+        raise RuntimeError(f'simulation stalled waiting for {keyList}')
+    if t is None or t > _sim.now + maxWait:
+        _sim.advance(_sim.now + maxWait)
+        return None
+    _sim.advance(t)
+    keys = _sim.take(keyList, t)[:1]
+    if timeStamped is True:
+        return [(key, when) for when, key in keys]
+    if timeStamped:
+        return [(key, timeStamped.getTime()) for when, key in keys]
+    return [key for when, key in keys]
+
+
+def get_keys(keyList=None, modifiers=False, timeStamped=False):
+    keys = _sim.take(keyList, _sim.now)
+    if timeStamped:
+        return [(key, when) for when, key in keys]
+    return [key for when, key in keys]
+
+
+class Dlg:
+    def __init__(self, title='', **kwargs):
+        self.fields = []
+        self.OK = False
+        self.data = []
+
+    def addField(self, label, initial='', **kwargs):
+        self.fields.append(initial)
+
+    def show(self):
+        answers = _sim.dialog + [str(v) for v in self.fields[len(_sim.dialog):]]
+        self.data = answers[:len(self.fields)]
+        self.OK = True
+        return self.data
+
+
+def _quit():
+    raise SystemExit(0)
+
+
+def make_psychopy():
+    """Build the stub psychopy package as a {module name: module} dict."""
+    mods = {name: types.ModuleType(name) for name in
+            ['psychopy', 'psychopy.visual', 'psychopy.core', 'psychopy.event', 'psychopy.gui',
+             'psychopy.hardware', 'psychopy.hardware.keyboard']}
+    mods['psychopy.visual'].__dict__.update(Window=Window, TextStim=TextStim, ImageStim=ImageStim, Rect=Rect)
+    mods['psychopy.core'].__dict__.update(Clock=Clock, MonotonicClock=Clock, quit=_quit,
+                                          wait=lambda secs, hogCPUperiod=0: _sim.advance(_sim.now + secs),
+                                          getTime=lambda: _sim.now)
+    mods['psychopy.event'].__dict__.update(waitKeys=wait_keys, getKeys=get_keys, clearEvents=lambda eventType=None: _sim.clear())
+    mods['psychopy.gui'].Dlg = Dlg
+    mods['psychopy.hardware.keyboard'].__dict__.update(Keyboard=Keyboard, KeyPress=KeyPress)
+    mods['psychopy.hardware'].keyboard = mods['psychopy.hardware.keyboard']
+    for name in ['visual', 'core', 'event', 'gui', 'hardware']:
+        setattr(mods['psychopy'], name, mods[f'psychopy.{name}'])
+    return mods
+
+
+# ===== SIMULATED PARTICIPANTS =====
+class Participant:
+    """Responds to what was drawn on each flip with configurable accuracy and ex-Gaussian RTs.
+
+    Instruction screens asking for SPACE (or a button) are answered after
+    instruction_rt; subclasses handle the task screens in react().
+    """
+
+    def __init__(self, seed=None, accuracy=0.9, rt_mu=0.45, rt_sigma=0.08, rt_tau=0.1, instruction_rt=1.0):
+        self.rng = random.Random(seed)
+        self.accuracy = accuracy
+        self.rt_mu, self.rt_sigma, self.rt_tau = rt_mu, rt_sigma, rt_tau
+        self.instruction_rt = instruction_rt
+        self.n_decisions = 0
+        self.n_correct = 0
+        self.onset = False
+        self._last = None
+
+    def sample_rt(self):
+        return max(0.1, self.rng.gauss(self.rt_mu, self.rt_sigma) + self.rng.expovariate(1 / self.rt_tau))
+
+    def decide(self, correct, alternatives):
+        """Pick the correct action with probability `accuracy`, otherwise one of the alternatives."""
+        self.n_decisions += 1
+        if self.rng.random() < self.accuracy or not alternatives:
+            self.n_correct += 1
+            return correct
+        return self.rng.choice(alternatives)
+
+    def on_flip(self, display):
+        self.onset = False
+        signature = repr(display)
+        if signature == self._last:
+            return []
+        self._last = signature
+        text = '\n'.join(d['text'] for d in display if d['type'] == 'TextStim')
+        presses = self.react(display, text)
+        if presses is None and re.search(r'press (the )?(space|button)', text, re.I):
+            presses = [(self.instruction_rt, 'space')]
+        return presses or []
+
+    def react(self, display, text):
+        return None
+
+
+class NBackParticipant(Participant):
+    def __init__(self, n=None, **kwargs):
+        super().__init__(**kwargs)
+        self.n = n
+        self.history = []
+
+    def react(self, display, text):
+        m = re.search(r'(\d+)[- ](back|position)', text, re.I)
+        if m:
+            self.n = int(m.group(1))
+            self.history = []
+            return None
+        stims = [d['image'] for d in display if d['type'] == 'ImageStim']
+        stims += [d['text'] for d in display if d['type'] == 'TextStim' and len(d['text']) == 1 and d['text'].isalpha()]
+        if len(stims) != 1 or self.n is None:
+            return None
+        self.onset = True
+        self.history.append(stims[0])
+        is_target = len(self.history) > self.n and self.history[-1] == self.history[-1 - self.n]
+        respond = self.decide(is_target, [not is_target])
+        return [(self.sample_rt(), 'space')] if respond else []
+
+
+class FlankerParticipant(Participant):
+    def react(self, display, text):
+        if not re.fullmatch(r'[<>]{5}', text):
+            return None
+        self.onset = True
+        correct = 'left' if text[2] == '<' else 'right'
+        return [(self.sample_rt(), self.decide(correct, [k for k in ('left', 'right') if k != correct]))]
+
+
+class SRTTParticipant(Participant):
+    KEYS = ['f', 'g', 'h', 'j']
+
+    def react(self, display, text):
+        targets = [d for d in display if d['type'] == 'Rect' and d['fillColor'] == 'blue']
+        if not targets:
+            return None
+        self.onset = True
+        correct = self.KEYS[int(round((targets[0]['pos'][0] + 0.3) / 0.2))]
+        return [(self.sample_rt(), self.decide(correct, [k for k in self.KEYS if k != correct]))]
+
+
+class PairedAssociateParticipant(Participant):
+    def __init__(self, key_interval=0.12, **kwargs):
+        super().__init__(**kwargs)
+        self.key_interval = key_interval
+        self.memory = {}
+        self._typing = None
+
+    def react(self, display, text):
+        images = [d['image'] for d in display if d['type'] == 'ImageStim']
+        if not images:
+            self._typing = None
+            return None
+        self.onset = True
+        words = [d['text'] for d in display if d['type'] == 'TextStim' and re.fullmatch(r'[a-z][a-z \-]*', d['text'])]
+        if words: # study trial
+            self.memory[images[0]] = words[0]
+            return []
+        if 'Your answer:' not in text or self._typing == images[0]:
+            self.onset = False
+            return []
+        self._typing = images[0]
+        word = self.decide(self.memory.get(images[0], 'zzz'), ['zzz'])
+        t, presses = self.sample_rt(), []
+        for ch in word:
+            presses.append((t, 'space' if ch == ' ' else ch))
+            t += self.key_interval
+        presses.append((t, 'return'))
+        return presses
+
+
+class BatteryParticipant(Participant):
+    """Hands each screen to the participant for whichever task's instructions were shown last."""
+    TITLES = [('Flanker', FlankerParticipant), ('N-back', NBackParticipant),
+              ('Serial Reaction Time', SRTTParticipant), ('Paired Associate', PairedAssociateParticipant)]
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.participants = {title: cls(**kwargs) for title, cls in self.TITLES}
+        self.current = None
+
+    def react(self, display, text):
+        for title, _ in self.TITLES:
+            if text.lstrip().startswith(title):
+                self.current = self.participants[title]
+        if self.current is None:
+            return None
+        presses = self.current.react(display, text)
+        self.onset, self.current.onset = self.current.onset, False
+        self.n_decisions = sum(p.n_decisions for p in self.participants.values())
+        self.n_correct = sum(p.n_correct for p in self.participants.values())
+        return presses
+
+
+def participant_for(script, **kwargs):
+    name = os.path.basename(script)
+    if 'battery' in name:
+        return BatteryParticipant(**kwargs)
+    if 'flanker' in name:
+        return FlankerParticipant(**kwargs)
+    if 'srtt' in name:
+        return SRTTParticipant(**kwargs)
+    if 'paired' in name:
+        return PairedAssociateParticipant(**kwargs)
+    if 'nback' in name:
+        return NBackParticipant(**kwargs)
+    raise ValueError(f'no simulated participant for {name}')
+
+
+# ===== OUTPUT CHECKS =====
+def _read_csv(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def check_output(script, g):
+    """Compare the data file with the schedule (if any) and with each row's own correctness rule."""
+    problems = []
+    data_file = g.get('DATA_FILE')
+    if data_file and not os.path.isfile(data_file): # launchers write one shard per session next to DATA_FILE
+        from tasklib.shards import latest_shard
+        data_file = latest_shard(data_file) or data_file
+    if not data_file or not os.path.isfile(data_file):
+        return {'data_file': data_file, 'problems': ['no data file written']}
+    rows = _read_csv(data_file)
+    trials = [r for r in rows if (r.get('event_type') or 'trial') == 'trial' and (r.get('phase') or 'test') == 'test']
+    name = os.path.basename(script)
+
+    schedule_file = g.get('SCHEDULE_FILE')
+    if schedule_file and os.path.isfile(schedule_file):
+        schedule = _read_csv(schedule_file)
+        if len(schedule) != len(trials):
+            problems.append(f'{len(trials)} trial rows for {len(schedule)} scheduled trials')
+        for k, (row, planned) in enumerate(zip(trials, schedule)):
+            for col in ('run', 'block', 'trial', 'n', 'stim_type', 'stimulus', 'is_target'):
+                if str(row[col]) != str(planned[col]):
+                    problems.append(f'row {k}: {col}={row[col]!r}, schedule has {planned[col]!r}')
+
+    for k, row in enumerate(trials):
+        if row.get('task'): # battery file: one task per row
+            name = row['task']
+        if 'nback' in name:
+            responded = (row.get('resp_key') or row.get('rt') or '') != ''
+            expected = int(row['is_target']) == int(responded)
+        elif 'flanker' in name:
+            expected = row['response'] == ('left' if row['stimulus'][2] == '<' else 'right')
+        elif 'srtt' in name:
+            expected = row['response_position'] == row['target_position']
+        elif 'paired' in name:
+            expected = row['response'].strip().upper() == row['target'].upper()
+        else:
+            continue
+        if int(row['correct']) != int(expected):
+            problems.append(f'row {k}: correct={row["correct"]} but response implies {int(expected)}')
+    accuracy = sum(int(r['correct']) for r in trials) / len(trials) if trials else None
+    return {'data_file': data_file, 'n_rows': len(rows), 'n_trials': len(trials), 'accuracy': accuracy,
+            'schedule_file': schedule_file, 'problems': problems}
+
+
+# ===== RUNNER =====
+def _summary(values, scale=1000.0):
+    if not values:
+        return {}
+    v = sorted(x * scale for x in values)
+    pick = lambda q: v[min(len(v) - 1, int(q * len(v)))]
+    return {'n': len(v), 'mean': sum(v) / len(v), 'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99), 'max': v[-1]}
+
+
+def _apply_overrides(tree, overrides):
+    """Replace top-level `NAME = ...` assignments with the given values."""
+    missing = set(overrides)
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in overrides:
+                node.value = ast.parse(repr(overrides[name]), mode='eval').body
+                missing.discard(name)
+    if missing:
+        raise ValueError(f'no top-level assignment to {sorted(missing)}')
+    return ast.fix_missing_locations(tree)
+
+
+class _Timed:
+    """Temporarily wrap obj.attr to record how long each call takes."""
+
+    def __init__(self, obj, attr):
+        self.obj, self.attr, self.times = obj, attr, []
+        self.orig = getattr(obj, attr)
+
+    def __enter__(self):
+        orig, times = self.orig, self.times
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return orig(*args, **kwargs)
+            finally:
+                times.append(time.perf_counter() - start)
+        setattr(self.obj, self.attr, timed)
+        return self
+
+    def __exit__(self, *exc):
+        setattr(self.obj, self.attr, self.orig)
+
+
+def run_script(script, participant, overrides=None, dialog=('sim01', '2'), frame_rate=60.0, tr=None,
+               tr_drift_ppm=0.0, workdir=None, seed=None):
+    """Run a task script headless and return the measurement/check report."""
+    global _sim
+    from tasklib import schedule, trial_logger
+
+    script = os.path.abspath(script)
+    with open(script) as f:
+        tree = _apply_overrides(ast.parse(f.read(), script), overrides or {})
+    code = compile(tree, script, 'exec')
+
+    workdir = workdir or tempfile.mkdtemp(prefix='headless_')
+    os.makedirs(workdir, exist_ok=True)
+    stim_link = os.path.join(workdir, '_stimuli')
+    if not os.path.exists(stim_link):
+        os.symlink(os.path.join(REPO_ROOT, '_stimuli'), stim_link)
+
+    _sim = Simulation(participant, frame_rate=frame_rate, tr=tr, tr_drift_ppm=tr_drift_ppm, dialog=dialog)
+    saved_modules = {name: sys.modules.get(name) for name in make_psychopy()}
+    sys.modules.update(make_psychopy())
+    saved_cwd, saved_path = os.getcwd(), list(sys.path)
+    sys.path[:0] = [os.path.dirname(script), REPO_ROOT]
+    random.seed(seed)
+    g = {'__name__': '__main__', '__file__': script, '__builtins__': builtins}
+    error = None
+    os.chdir(workdir)
+    start = time.perf_counter()
+    try:
+        with _Timed(schedule, 'build_session') as sched_t, \
+                _Timed(trial_logger.TrialLogger, 'log') as log_t, \
+                _Timed(trial_logger.TrialLogger, 'flush') as flush_t:
+            try:
+                exec(code, g)
+            except SystemExit:
+                pass
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+        wall = time.perf_counter() - start
+        for value in list(g.values()):
+            if isinstance(value, trial_logger.TrialLogger):
+                value.close()
+        check = check_output(script, g)
+    finally:
+        os.chdir(saved_cwd)
+        sys.path[:] = saved_path
+        for name, mod in saved_modules.items():
+            if mod is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = mod
+        sim, _sim = _sim, None
+
+    return {
+        'script': os.path.relpath(script, REPO_ROOT),
+        'workdir': workdir,
+        'error': error,
+        'virtual_s': sim.now,
+        'wall_s': wall,
+        'speedup': sim.now / wall if wall else None,
+        'n_flips': sim.n_flips,
+        'frame_overhead_ms': _summary(sim.frame_real),
+        'trial_overhead_ms': _summary(sim.trial_real),
+        'schedule_ms': _summary(sched_t.times),
+        'log_row_us': _summary(log_t.times, 1e6),
+        'flush_ms': _summary(flush_t.times),
+        'participant': {'decisions': participant.n_decisions,
+                        'accuracy': participant.n_correct / participant.n_decisions if participant.n_decisions else None},
+        'check': check,
+    }
+
+
+def _literal(value):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a task script headless with a simulated participant.')
+    parser.add_argument('script')
+    parser.add_argument('--accuracy', type=float, default=0.9)
+    parser.add_argument('--rt-mu', type=float, default=0.45, help='ex-Gaussian mu (s)')
+    parser.add_argument('--rt-sigma', type=float, default=0.08, help='ex-Gaussian sigma (s)')
+    parser.add_argument('--rt-tau', type=float, default=0.1, help='ex-Gaussian tau (s)')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--frame-rate', type=float, default=60.0)
+    parser.add_argument('--tr', type=float, default=None, help='emit scanner triggers every TR (default 2.0 for *_mri.py)')
+    parser.add_argument('--tr-drift-ppm', type=float, default=0.0)
+    parser.add_argument('--dialog', nargs='*', default=['sim01', '2'], help='answers for the startup dialog fields')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a top-level parameter, e.g. --set N_TRIALS_PER_BLOCK=10')
+    parser.add_argument('--workdir', default=None)
+    parser.add_argument('--json', default=None, help='also write the report here')
+    args = parser.parse_args()
+
+    overrides = dict((k, _literal(v)) for k, v in (s.split('=', 1) for s in args.set))
+    tr = args.tr if args.tr is not None else (2.0 if 'mri' in os.path.basename(args.script) else None)
+    participant = participant_for(args.script, seed=args.seed, accuracy=args.accuracy,
+                                  rt_mu=args.rt_mu, rt_sigma=args.rt_sigma, rt_tau=args.rt_tau)
+    report = run_script(args.script, participant, overrides, dialog=args.dialog, frame_rate=args.frame_rate,
+                        tr=tr, tr_drift_ppm=args.tr_drift_ppm, workdir=args.workdir, seed=args.seed)
+    print(json.dumps(report, indent=2, default=str))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    raise SystemExit(1 if report['error'] or report['check']['problems'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+"""Receiver for trial data uploaded by the web demos while a session runs.
+
+The pages (tasks-webdemo/webdemo.js, uploader()) send batches of jsPsych rows
+as gzipped JSON; each browser session becomes one shard in the same layout the
+PsychoPy tasks write, _data/web/<task>/<time>_<subject>_<host>_<pid>_<session>.csv.part,
+renamed to .csv when the page sends its last batch. The web pages' columns differ
+from the PsychoPy tasks', so they get a folder of their own. Sessions whose tab
+was closed stay .part and can still be merged:
+
+    python -m tasklib.receiver serve --port 8001 --data-dir _data/web
+    # open e.g. http://localhost:8000/nback.html?upload=http://<this machine>:8001
+    python -m tasklib.shards compact _data/web/nback --include-partial
+
+    python -m tasklib.receiver loadtest --clients 60 --data-dir _data/web   # against a running serve
+
+A batch is acknowledged only after its rows are fsynced, and the client keeps
+it (in localStorage) until then, retrying with backoff. A retried batch may
+already be on disk, so rows are deduplicated by jsPsych's trial_index; the
+indices written are read back from the shard after a restart. Plain
+asyncio HTTP/1.1 with keep-alive; file writes run in worker threads, one at a
+time per session, so a slow disk never stalls other connections.
+"""
+import argparse, asyncio, csv, gzip, json, os, random, re, socket, statistics, time, zlib
+
+from tasklib.shards import PART, _rewrite_header, session_path
+from tasklib.trial_logger import recover
+
+TASKS = ('flanker', 'nback', 'paired_associate', 'srtt')
+MAX_BODY = 1 << 20 # bytes on the wire per batch
+MAX_DECODED = 16 << 20 # bytes of JSON after decompression
+IDLE_TIMEOUT_S = 60 # close keep-alive connections idle this long
+SESSION_IDLE_S = 3600 # forget (but keep on disk) sessions idle this long
+_SESSION = re.compile(r'^[A-Za-z0-9-]{8,64}$')
+
+
+class UploadError(Exception):
+    """A batch the client should not retry; status is the HTTP status to answer with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _cell(value):
+    """A jsPsych value as jsPsych's own csv() writes it."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(',', ':'))
+    return value
+
+
+# ===== SHARD FILES =====
+class SessionStore:
+    """One shard per upload session under data_dir/<task>/, appended to batch by batch."""
+
+    def __init__(self, data_dir, tasks=TASKS):
+        self.data_dir = data_dir
+        self.tasks = set(tasks)
+        self.sessions = {} # (task, session) -> {'path', 'fieldnames', 'indices', 'rows', 'seen'}
+        self.locks = {}
+
+    def _find(self, task, session):
+        """An existing shard of this session (after a receiver restart), or None."""
+        directory = os.path.join(self.data_dir, task)
+        suffix = f'_{session}.csv'
+        for name in os.listdir(directory) if os.path.isdir(directory) else []:
+            if name.endswith((suffix, suffix + PART)):
+                return os.path.join(directory, name)
+        return None
+
+    def _open(self, task, session, subject):
+        path = self._find(task, session)
+        state = {'path': path, 'fieldnames': [], 'indices': set(), 'rows': 0}
+        if path is None:
+            state['path'] = session_path(os.path.join(self.data_dir, task + '.csv'), subject, token=session) + PART
+            os.makedirs(os.path.dirname(state['path']), exist_ok=True)
+        else:
+            recover(path)
+            with open(path, newline='') as f:
+                reader = csv.DictReader(f)
+                for row in reader:
+                    state['rows'] += 1
+                    if row.get('trial_index', '').isdigit():
+                        state['indices'].add(int(row['trial_index']))
+                state['fieldnames'] = reader.fieldnames or []
+        return state
+
+    def append(self, task, session, subject, rows, final):
+        """Write the new rows of a batch (and finish the shard if final); returns (n_written, n_duplicate).
+
+        Blocking; called from a worker thread, one call at a time per session.
+        """
+        key = (task, session)
+        state = self.sessions.get(key) or self._open(task, session, subject)
+        self.sessions[key] = state
+        state['seen'] = time.monotonic()
+        new = [r for r in rows if not isinstance(r.get('trial_index'), int) or r['trial_index'] not in state['indices']]
+        if not state['path'].endswith(PART):
+            if new:
+                raise UploadError(409, f'session {session} is already finished')
+            return 0, len(rows)
+
+        if new:
+            added = [k for r in new for k in r if k not in state['fieldnames']]
+            added = list(dict.fromkeys(added))
+            if added:
+                state['fieldnames'] += added
+                if state['rows']:
+                    _rewrite_header(state['path'], state['fieldnames']) # rare: a trial type with new columns
+            with open(state['path'], 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=state['fieldnames'], restval='')
+                if f.tell() == 0:
+                    writer.writeheader()
+                writer.writerows({k: _cell(v) for k, v in r.items()} for r in new)
+                f.flush()
+                os.fsync(f.fileno())
+            state['rows'] += len(new)
+            state['indices'].update(r['trial_index'] for r in new if isinstance(r.get('trial_index'), int))
+        if final:
+            if not state['rows']: # nothing was ever logged: leave no empty shard behind
+                if os.path.isfile(state['path']):
+                    os.remove(state['path'])
+            else:
+                finished = state['path'][:-len(PART)]
+                os.replace(state['path'], finished)
+                state['path'] = finished
+        return len(new), len(rows) - len(new)
+
+    def lock(self, task, session):
+        return self.locks.setdefault((task, session), asyncio.Lock())
+
+    def forget_idle(self, idle_s=SESSION_IDLE_S):
+        now = time.monotonic()
+        for key in [k for k, s in self.sessions.items() if now - s['seen'] > idle_s]:
+            if not self.locks[key].locked():
+                del self.sessions[key], self.locks[key]
+
+
+def parse_batch(body, encoding, tasks):
+    """(task, session, subject, rows, final) from a request body, or UploadError."""
+    if encoding == 'gzip':
+        d = zlib.decompressobj(wbits=31)
+        try:
+            body = d.decompress(body, MAX_DECODED)
+        except zlib.error as e:
+            raise UploadError(400, f'bad gzip body: {e}')
+        if d.unconsumed_tail:
+            raise UploadError(413, f'batch over {MAX_DECODED} bytes decompressed')
+    elif encoding not in ('', 'identity'):
+        raise UploadError(415, f'unsupported Content-Encoding {encoding}')
+    try:
+        batch = json.loads(body)
+    except ValueError as e:
+        raise UploadError(400, f'bad JSON: {e}')
+    if not isinstance(batch, dict):
+        raise UploadError(400, 'batch must be a JSON object')
+    task, session, rows = batch.get('task'), batch.get('session'), batch.get('rows', [])
+    if task not in tasks:
+        raise UploadError(400, f'unknown task {task!r} (expected one of {", ".join(sorted(tasks))})')
+    if not isinstance(session, str) or not _SESSION.match(session):
+        raise UploadError(400, 'session must be 8-64 letters, digits or dashes')
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+        raise UploadError(400, 'rows must be a list of objects')
+    return task, session, str(batch.get('subject') or 'anon'), rows, bool(batch.get('final'))
+
+
+# ===== HTTP =====
+_REASONS = {200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict',
+            411: 'Length Required', 413: 'Payload Too Large', 415: 'Unsupported Media Type',
+            500: 'Internal Server Error'}
+_CORS = ('Access-Control-Allow-Origin: *\r\n'
+         'Access-Control-Allow-Methods: POST, GET, OPTIONS\r\n'
+         'Access-Control-Allow-Headers: Content-Type, Content-Encoding\r\n'
+         'Access-Control-Allow-Private-Network: true\r\n' # pages served from the internet posting to a lab machine
+         'Access-Control-Max-Age: 86400\r\n')
+
+
+def _response(status, payload=None, keep_alive=True):
+    body = json.dumps(payload).encode() if payload is not None else b''
+    head = (f'HTTP/1.1 {status} {_REASONS.get(status, "")}\r\n{_CORS}'
+            f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n')
+    return head.encode() + body
+
+
+async def _read_request(reader):
+    """(method, path, headers, body), or None when the client closed the connection."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), IDLE_TIMEOUT_S)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, asyncio.LimitOverrunError, ConnectionError):
+        return None
+    lines = head.decode('latin-1').split('\r\n')
+    method, target = (lines[0].split(' ') + ['', ''])[:2]
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise UploadError(411, 'send a Content-Length')
+    length = int(headers.get('content-length') or 0)
+    if length > MAX_BODY:
+        raise UploadError(413, f'batch over {MAX_BODY} bytes')
+    body = await asyncio.wait_for(reader.readexactly(length), IDLE_TIMEOUT_S) if length else b''
+    return method, target.split('?')[0], headers, body
+
+
+class Receiver:
+    def __init__(self, store):
+        self.store = store
+        self.n_batches = self.n_rows = self.n_duplicate = 0
+
+    async def upload(self, headers, body):
+        task, session, subject, rows, final = parse_batch(body, headers.get('content-encoding', ''), self.store.tasks)
+        async with self.store.lock(task, session):
+            written, duplicate = await asyncio.to_thread(self.store.append, task, session, subject, rows, final)
+        self.n_batches += 1
+        self.n_rows += written
+        self.n_duplicate += duplicate
+        return {'written': written, 'duplicate': duplicate}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                keep_alive = True
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    method, path, headers, body = request
+                    keep_alive = headers.get('connection', '').lower() != 'close'
+                    if method == 'OPTIONS':
+                        status, payload = 204, None
+                    elif method == 'POST' and path == '/upload':
+                        status, payload = 200, await self.upload(headers, body)
+                    elif method == 'GET' and path == '/status':
+                        status, payload = 200, {'sessions': len(self.store.sessions), 'batches': self.n_batches,
+                                                'rows': self.n_rows, 'duplicate_rows': self.n_duplicate}
+                    else:
+                        status, payload = 404, {'error': f'no {method} {path}'}
+                except UploadError as e:
+                    status, payload = e.status, {'error': str(e)}
+                    keep_alive = keep_alive and e.status not in (411, 413) # the unread body is still on the socket
+                except (OSError, ValueError) as e: # disk full, unwritable data dir, bad Content-Length: retryable
+                    print(f'[receiver] {type(e).__name__}: {e}')
+                    status, payload, keep_alive = 500, {'error': str(e)}, False
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def forget_idle(self):
+        while True:
+            await asyncio.sleep(60)
+            self.store.forget_idle()
+
+
+async def serve(host, port, data_dir, tasks=TASKS):
+    receiver = Receiver(SessionStore(data_dir, tasks))
+    server = await asyncio.start_server(receiver.handle, host, port, backlog=512)
+    print(f'[receiver] http://{socket.gethostname()}:{port}/upload -> {os.path.abspath(data_dir)}/<task>/ '
+          f'(tasks: {", ".join(sorted(tasks))})')
+    asyncio.get_running_loop().create_task(receiver.forget_idle())
+    async with server:
+        await server.serve_forever()
+
+
+# ===== LOAD TEST =====
+async def _post(reader, writer, host, batch):
+    body = gzip.compress(json.dumps(batch).encode())
+    writer.write((f'POST /upload HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+                  f'Content-Encoding: gzip\r\nContent-Length: {len(body)}\r\n\r\n').encode() + body)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    length = int(re.search(rb'Content-Length: (\d+)', head).group(1))
+    return int(head.split(b' ', 2)[1]), json.loads(await reader.readexactly(length) or b'null')
+
+
+async def _participant(host, port, task, n_rows, batch_rows, interval, duplicate_p, latencies, rng):
+    """One simulated page: n_rows jsPsych-like rows in batches, some sent twice as a lost-ack retry would be."""
+    session = os.urandom(8).hex()
+    reader, writer = await asyncio.open_connection(host, port)
+    await asyncio.sleep(rng.uniform(0, interval)) # participants don't start in lockstep
+    try:
+        for b0 in range(0, n_rows, batch_rows):
+            rows = [{'trial_index': i, 'trial_type': 'html-keyboard-response', 'rt': round(rng.uniform(250, 900), 1),
+                     'stimulus': '<p>X</p>', 'response': rng.choice([None, ' ']), 'correct': rng.random() < 0.8,
+                     'subject_id': session[:10], 'time_elapsed': i * 1500} for i in range(b0, min(b0 + batch_rows, n_rows))]
+            batch = {'task': task, 'session': session, 'subject': session[:10], 'rows': rows,
+                     'final': b0 + batch_rows >= n_rows}
+            for _ in range(2 if rng.random() < duplicate_p else 1):
+                start = time.perf_counter()
+                status, reply = await _post(reader, writer, host, batch)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    raise RuntimeError(f'{status}: {reply}')
+            await asyncio.sleep(interval)
+    finally:
+        writer.close()
+    return session
+
+
+def _check_shards(data_dir, task, sessions, n_rows):
+    """Problems found in the finished shards of the load test's sessions."""
+    problems = []
+    directory = os.path.join(data_dir, task)
+    names = {n.rsplit('_', 1)[1][:-len('.csv')]: n for n in os.listdir(directory) if n.endswith('.csv')}
+    for session in sessions:
+        if session not in names:
+            problems.append(f'{session}: no finished shard')
+            continue
+        with open(os.path.join(directory, names[session]), newline='') as f:
+            indices = [int(r['trial_index']) for r in csv.DictReader(f)]
+        if indices != list(range(n_rows)):
+            problems.append(f'{session}: {len(indices)} rows, expected trial_index 0..{n_rows - 1} once each')
+    return problems
+
+
+async def loadtest(host, port, clients, n_rows, batch_rows, interval, duplicate_p, task='nback', data_dir=None,
+                   seed=0):
+    rng = random.Random(seed)
+    latencies = []
+    start = time.perf_counter()
+    sessions = await asyncio.gather(*[_participant(host, port, task, n_rows, batch_rows, interval, duplicate_p,
+                                                   latencies, random.Random(rng.random())) for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+    q = statistics.quantiles(latencies, n=100)
+    print(f'[loadtest] {clients} participants x {n_rows} rows in batches of {batch_rows} every {interval}s: '
+          f'{len(latencies)} requests in {elapsed:.1f}s; latency median {q[49] * 1000:.1f} ms, '
+          f'p95 {q[94] * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms')
+    if data_dir:
+        problems = _check_shards(data_dir, task, sessions, n_rows)
+        print(f'[loadtest] shards: {len(sessions) - len(problems)}/{len(sessions)} complete, no duplicate rows'
+              if not problems else '[loadtest] ' + '\n[loadtest] '.join(problems))
+        return not problems
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Receive trial data uploaded by the web demos.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    srv = sub.add_parser('serve')
+    srv.add_argument('--host', default='0.0.0.0')
+    srv.add_argument('--port', type=int, default=8001)
+    srv.add_argument('--data-dir', default=os.path.join('_data', 'web'), help='shards go to DATA_DIR/<task>/')
+    srv.add_argument('--tasks', nargs='+', default=list(TASKS), help='task names pages may upload')
+    lt = sub.add_parser('loadtest', help='simulate a classroom of participants against a running serve')
+    lt.add_argument('--host', default='localhost')
+    lt.add_argument('--port', type=int, default=8001)
+    lt.add_argument('--clients', type=int, default=60)
+    lt.add_argument('--rows', type=int, default=300, help='rows per participant')
+    lt.add_argument('--batch-rows', type=int, default=20)
+    lt.add_argument('--interval', type=float, default=0.5, help='seconds between batches (real pages: about 5-30)')
+    lt.add_argument('--duplicate', type=float, default=0.05, help='fraction of batches sent twice')
+    lt.add_argument('--task', default='nback')
+    lt.add_argument('--data-dir', default=None, help="the server's --data-dir, to check the shards it wrote")
+    args = parser.parse_args()
+
+    if args.cmd == 'serve':
+        asyncio.run(serve(args.host, args.port, args.data_dir, args.tasks))
+    else:
+        ok = asyncio.run(loadtest(args.host, args.port, args.clients, args.rows, args.batch_rows, args.interval,
+                                  args.duplicate, args.task, args.data_dir))
+        raise SystemExit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+"""Keyboard responses for every task, timed from the stimulus flip.
+
+All tasks read keys through one ResponseBox per session, built on
+psychopy.hardware.keyboard. With the Psychtoolbox backend, key presses are
+timestamped by a separate input thread when they happen, not when the task
+gets round to polling, so the RT does not depend on how often we poll or on
+the frame rate. The keyboard clock is reset by the flip that shows the
+stimulus, so RTs are measured from stimulus onset, not from some line of code
+after it.
+
+The latency self-test replays presses with known times through a simulated
+device and compares the timestamped path with the old poll-per-frame one:
+
+    python -m tasklib.responses selftest --trials 100 --frame-rate 60
+"""
+import argparse, random, time
+import numpy as np
+
+
+class ResponseBox:
+    """One keyboard for the session: non-blocking poll(), blocking wait(), RT from the onset flip."""
+
+    def __init__(self, kb=None):
+        if kb is None:
+            from psychopy.hardware import keyboard
+            kb = keyboard.Keyboard()
+        self.kb = kb
+
+    @property
+    def backend(self):
+        """'ptb' (hardware timestamps), 'iohub' or 'event' (timestamped when polled)."""
+        return getattr(self.kb, 'backend', None) or type(self.kb).__name__
+
+    def reset_clock(self):
+        self.kb.clock.reset()
+
+    def on_flip(self, win):
+        """Time RTs from the next flip (call just before the flip that shows the stimulus)."""
+        win.callOnFlip(self.reset_clock)
+
+    def since(self, key):
+        """Seconds since key went down; puts its timestamp on any other clock."""
+        return self.kb.clock.getTime() - key.rt
+
+    def clear(self):
+        self.kb.clearEvents()
+
+    def poll(self, key_list=None):
+        """Keys pressed since the last poll, without waiting; each has .name and .rt."""
+        return self.kb.getKeys(keyList=key_list, waitRelease=False)
+
+    def wait(self, key_list=None, max_wait=float('inf')):
+        """First key in key_list (including any pressed since the last clear()), or None after max_wait seconds."""
+        # clear=True would throw away presses made before the call, e.g. during the flip
+        keys = self.kb.waitKeys(maxWait=max_wait, keyList=key_list, waitRelease=False, clear=False)
+        if keys:
+            self.kb.clearEvents() # with clear=False the returned keys stay buffered
+        return keys[0] if keys else None
+
+
+# ===== LATENCY SELF-TEST =====
+class PerfClock:
+    """Minimal psychopy-style clock on time.perf_counter."""
+
+    def __init__(self):
+        self._t0 = time.perf_counter()
+
+    def reset(self, newT=0.0):
+        self._t0 = time.perf_counter() + newT
+
+    def getTime(self):
+        return time.perf_counter() - self._t0
+
+    def getLastResetTime(self):
+        return self._t0
+
+
+class SimKey:
+    def __init__(self, name, t_down, rt):
+        self.name = self.value = name
+        self.tDown = t_down
+        self.rt = rt
+        self.duration = None
+
+
+class SimulatedKeyboard:
+    """A keyboard whose presses are scripted: press(name, t) at perf_counter time t.
+
+    Like the Psychtoolbox backend, each key is stamped when it happens (plus the
+    device's own latency), however late getKeys() is called.
+    """
+    backend = 'simulated'
+
+    def __init__(self, latency_ms=1.0, jitter_ms=0.3, seed=None):
+        self.clock = PerfClock()
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.rng = random.Random(seed)
+        self._pending = [] # (time, name)
+
+    def press(self, name, t):
+        self._pending.append((t, name))
+        self._pending.sort()
+
+    def getKeys(self, keyList=None, waitRelease=True, clear=True):
+        now = time.perf_counter()
+        keys, kept = [], []
+        for t, name in self._pending:
+            if t <= now and (not keyList or name in keyList):
+                t_down = t + max(0.0, self.rng.gauss(self.latency, self.jitter))
+                keys.append(SimKey(name, t_down, t_down - self.clock.getLastResetTime()))
+            else:
+                kept.append((t, name))
+        self._pending = kept
+        return keys
+
+    def waitKeys(self, maxWait=float('inf'), keyList=None, waitRelease=True, clear=True):
+        deadline = time.perf_counter() + maxWait
+        while time.perf_counter() < deadline:
+            keys = self.getKeys(keyList)
+            if keys:
+                return keys
+            time.sleep(0.0005)
+        return []
+
+    def clearEvents(self, eventType=None):
+        now = time.perf_counter()
+        self._pending = [(t, name) for t, name in self._pending if t > now]
+
+
+def _sleep_until(t):
+    while True:
+        left = t - time.perf_counter()
+        if left <= 0:
+            return
+        time.sleep(min(left, 0.001) if left > 0.002 else 0) # spin for the last 2 ms
+
+
+def selftest(n_trials=100, frame_rate=60.0, latency_ms=1.0, jitter_ms=0.3, rt_range=(0.03, 0.12), seed=None):
+    """Measure known RTs through the ResponseBox and through poll-once-per-frame.
+
+    Returns {method: error stats in ms}. 'timestamped' is what the tasks use now;
+    'frame_polled' is the old event.waitKeys path, which only sees a key at the
+    next refresh.
+    """
+    rng = np.random.default_rng(seed)
+    box = ResponseBox(SimulatedKeyboard(latency_ms, jitter_ms, seed))
+    frame = 1.0 / frame_rate
+    errors = {'timestamped': [], 'frame_polled': []}
+    for true_rt in rng.uniform(*rt_range, n_trials):
+        box.clear()
+        onset = time.perf_counter() + frame * rng.random() # flip lands somewhere in the frame
+        _sleep_until(onset)
+        box.reset_clock()
+        box.kb.press('space', onset + true_rt)
+
+        # poll once per refresh, like the old frame-bound loop
+        seen = []
+        next_frame = onset
+        while not seen:
+            next_frame += frame
+            _sleep_until(next_frame)
+            seen = box.poll(['space'])
+        polled_rt = next_frame - onset
+        errors['timestamped'].append((seen[0].rt - true_rt) * 1000)
+        errors['frame_polled'].append((polled_rt - true_rt) * 1000)
+
+    return {method: {'bias_ms': float(np.mean(e)), 'sd_ms': float(np.std(e)),
+                     'p95_abs_ms': float(np.percentile(np.abs(e), 95)), 'max_abs_ms': float(np.max(np.abs(e)))}
+            for method, e in errors.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Response-timing self-test against a simulated keyboard.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    test = sub.add_parser('selftest')
+    test.add_argument('--trials', type=int, default=100)
+    test.add_argument('--frame-rate', type=float, default=60.0)
+    test.add_argument('--latency-ms', type=float, default=1.0, help='simulated device latency')
+    test.add_argument('--jitter-ms', type=float, default=0.3, help='simulated device latency sd')
+    test.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    results = selftest(args.trials, args.frame_rate, args.latency_ms, args.jitter_ms, seed=args.seed)
+    for method, r in results.items():
+        print(f"{method:>13}: bias {r['bias_ms']:+.2f} ms, sd {r['sd_ms']:.2f} ms, "
+              f"p95 |error| {r['p95_abs_ms']:.2f} ms, max {r['max_abs_ms']:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Seeded, precomputed N-back trial schedules.
+
+Everything here is plain numpy + csv, so a session's schedule can be generated,
+checked and audited without PsychoPy:
+
+    python -m tasklib.schedule audit _data/nback/sub01_schedule.csv
+    python -m tasklib.schedule bench --n-blocks 10000
+"""
+import argparse, csv, os, time
+from collections import OrderedDict
+import numpy as np
+
+FIELDNAMES = ['seed', 'run', 'block', 'trial', 'n', 'stim_type', 'stimulus', 'is_target', 'rest']
+
+
+def lure_lags(n):
+    """Lags (other than n) at which a repeat counts as a lure."""
+    return [lag for lag in (n - 1, n + 1) if lag >= 1]
+
+
+def sample_blocks(rng, n_blocks, n_trials, n_targets, n, n_items, avoid_lures=True):
+    """Draw n_blocks N-back sequences at once.
+
+    Returns (is_target, items), both shaped (n_blocks, n_trials); items are indices
+    into the stimulus list. Every block has exactly n_targets targets, none in the
+    first n trials, and non-targets never repeat the item n back (nor, with
+    avoid_lures, the items at lags n-1/n+1). Work is vectorized across blocks, so
+    drawing thousands of blocks costs about as much as drawing one.
+    """
+    if n_targets > n_trials - n:
+        raise ValueError(f'{n_targets} targets do not fit in {n_trials} trials at n={n}')
+    lags = ([n] + lure_lags(n)) if avoid_lures else [n]
+    if n_items <= len(lags):
+        raise ValueError(f'need more than {len(lags)} stimuli to avoid lures, got {n_items}')
+
+    rows = np.arange(n_blocks)[:, None]
+    is_target = np.zeros((n_blocks, n_trials), dtype=bool)
+    # exact target count: the first n_targets of a random permutation of trials n..end
+    positions = rng.random((n_blocks, n_trials - n)).argsort(axis=1)[:, :n_targets] + n
+    is_target[rows, positions] = True
+
+    items = np.empty((n_blocks, n_trials), dtype=np.int64)
+    for i in range(n_trials):
+        if i >= n:
+            items[is_target[:, i], i] = items[is_target[:, i], i - n]
+        prev = [items[:, i - lag] for lag in lags if lag <= i]
+        todo = np.flatnonzero(~is_target[:, i])
+        # rejection sampling on just the blocks that still need an item
+        while todo.size:
+            cand = rng.integers(0, n_items, todo.size)
+            ok = np.ones(todo.size, dtype=bool)
+            for p in prev:
+                ok &= cand != p[todo]
+            items[todo[ok], i] = cand[ok]
+            todo = todo[~ok]
+    return is_target, items
+
+
+def check_blocks(is_target, items, n, n_targets, avoid_lures=True):
+    """Return {constraint: bool array of violating blocks} for sampled blocks."""
+    nontarget = ~is_target
+    problems = {
+        'target_count': is_target.sum(axis=1) != n_targets,
+        'early_target': is_target[:, :n].any(axis=1),
+        'target_mismatch': (is_target[:, n:] & (items[:, n:] != items[:, :-n])).any(axis=1),
+        'accidental_target': (nontarget[:, n:] & (items[:, n:] == items[:, :-n])).any(axis=1),
+    }
+    if avoid_lures:
+        lure = np.zeros(len(items), dtype=bool)
+        for lag in lure_lags(n):
+            lure |= (nontarget[:, lag:] & (items[:, lag:] == items[:, :-lag])).any(axis=1)
+        problems['lure'] = lure
+    return problems
+
+
+def validate_blocks(is_target, items, n, n_targets, avoid_lures=True):
+    bad = {k: int(v.sum()) for k, v in check_blocks(is_target, items, n, n_targets, avoid_lures).items() if v.any()}
+    if bad:
+        raise ValueError(f'schedule violates constraints: {bad}')
+
+
+def new_seed():
+    return int(np.random.SeedSequence().entropy % 2**32)
+
+
+def build_session(seed, blocks, stimuli, n_trials, n_targets, rests=None, avoid_lures=True):
+    """Generate every trial of a session up front.
+
+    blocks: list of dicts with 'run', 'block', 'n', 'stim_type', in presentation order.
+    stimuli: dict of stim_type -> list of stimuli.
+    rests: optional rest durations, shuffled independently for each run and assigned
+        to that run's blocks in order.
+    Returns a list of trial dicts with FIELDNAMES keys. The same seed and arguments
+    always give the same schedule.
+    """
+    if seed is None:
+        seed = new_seed()
+    rng = np.random.default_rng(seed)
+
+    rest_by_block = {}
+    if rests is not None:
+        runs = OrderedDict()
+        for b in blocks:
+            runs.setdefault(b['run'], []).append(b['block'])
+        for run, run_blocks in runs.items():
+            shuffled = rng.permutation(rests)
+            for k, block in enumerate(run_blocks):
+                rest_by_block[(run, block)] = shuffled[k % len(shuffled)].item()
+
+    # one batched draw per (n, stim_type) condition
+    groups = OrderedDict()
+    for b in blocks:
+        groups.setdefault((b['n'], b['stim_type']), []).append(b)
+
+    rows = []
+    for (n, stim_type), group in groups.items():
+        pool = stimuli[stim_type]
+        is_target, items = sample_blocks(rng, len(group), n_trials, n_targets, n, len(pool), avoid_lures)
+        validate_blocks(is_target, items, n, n_targets, avoid_lures)
+        for b, block_targets, block_items in zip(group, is_target, items):
+            for t in range(n_trials):
+                rows.append({
+                    'seed': seed, 'run': b['run'], 'block': b['block'], 'trial': t + 1,
+                    'n': n, 'stim_type': stim_type, 'stimulus': pool[block_items[t]],
+                    'is_target': int(block_targets[t]),
+                    'rest': rest_by_block.get((b['run'], b['block']), ''),
+                })
+    order = {(b['run'], b['block']): k for k, b in enumerate(blocks)}
+    rows.sort(key=lambda r: (order[(r['run'], r['block'])], r['trial']))
+    return rows
+
+
+def group_by_block(rows):
+    """Return an ordered {(run, block): [trial rows]} view of a schedule."""
+    blocks = OrderedDict()
+    for r in rows:
+        blocks.setdefault((r['run'], r['block']), []).append(r)
+    return blocks
+
+
+def save_schedule(rows, path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def load_schedule(path):
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    for r in rows:
+        for k in ('seed', 'run', 'block', 'trial', 'n', 'is_target'):
+            r[k] = int(r[k])
+        r['rest'] = float(r['rest']) if r['rest'] != '' else ''
+    return rows
+
+
+def audit_schedule(rows, n_targets=None, avoid_lures=True):
+    """Re-check a saved schedule; returns {(run, block): [violated constraints]}."""
+    failures = {}
+    for key, trials in group_by_block(rows).items():
+        n = trials[0]['n']
+        codes = {s: k for k, s in enumerate(dict.fromkeys(t['stimulus'] for t in trials))}
+        is_target = np.array([[t['is_target'] for t in trials]], dtype=bool)
+        items = np.array([[codes[t['stimulus']] for t in trials]])
+        expected = int(is_target.sum()) if n_targets is None else n_targets
+        bad = [k for k, v in check_blocks(is_target, items, n, expected, avoid_lures).items() if v[0]]
+        if bad:
+            failures[key] = bad
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit or benchmark N-back schedules.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    audit = sub.add_parser('audit', help='re-check a saved schedule CSV')
+    audit.add_argument('path')
+    audit.add_argument('--n-targets', type=int, default=None)
+    bench = sub.add_parser('bench', help='time and check a large batch of blocks')
+    bench.add_argument('--n-blocks', type=int, default=10000)
+    bench.add_argument('--n-trials', type=int, default=41)
+    bench.add_argument('--n-targets', type=int, default=14)
+    bench.add_argument('--n', type=int, nargs='+', default=[1, 2])
+    bench.add_argument('--n-items', type=int, default=60)
+    bench.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.cmd == 'audit':
+        failures = audit_schedule(load_schedule(args.path), args.n_targets)
+        for (run, block), bad in failures.items():
+            print(f'run {run} block {block}: {", ".join(bad)}')
+        print('OK' if not failures else f'{len(failures)} block(s) failed')
+        raise SystemExit(1 if failures else 0)
+
+    rng = np.random.default_rng(args.seed)
+    for n in args.n:
+        start = time.perf_counter()
+        is_target, items = sample_blocks(rng, args.n_blocks, args.n_trials, args.n_targets, n, args.n_items)
+        elapsed = time.perf_counter() - start
+        bad = {k: int(v.sum()) for k, v in check_blocks(is_target, items, n, args.n_targets).items()}
+        counts = np.bincount(items.ravel(), minlength=args.n_items)
+        print(f'{n}-back: {args.n_blocks} blocks in {elapsed:.3f}s '
+              f'({elapsed / args.n_blocks * 1e6:.1f} us/block); violations {bad}; '
+              f'item frequency min/max {counts.min()}/{counts.max()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+"""One data file per session, merged into a consolidated CSV afterwards.
+
+Stations never share an output file: each session writes
+_data/flanker/<time>_<subject>_<host>_<pid>_<random>.csv.part and renames it
+to .csv when the session ends, so a shared drive only ever sees whole, finished
+files appear. Merging is a separate, incremental step:
+
+    python -m tasklib.shards compact _data/flanker            # -> _data/flanker.csv
+
+Already-merged shards are skipped; only new ones are read and appended. With
+--include-partial, a .part shard is merged up to its last complete row, and the
+rows it gains later (while the session runs, and when it finishes) are appended
+on the next compaction.
+"""
+import argparse, csv, io, json, os, re, socket, time
+
+PART = '.part'
+_SHARD = re.compile(r'^\d{8}-\d{6}(_[A-Za-z0-9-]+){3}_[A-Za-z0-9-]+\.csv$') # session_path's names only
+
+
+def shard_dir(data_file):
+    """Where sessions of data_file are written: _data/flanker.csv -> _data/flanker/."""
+    return os.path.splitext(data_file)[0]
+
+
+def session_path(data_file, subject_id, token=None):
+    """A new, collision-free shard name for one session (the time first, so names sort chronologically).
+
+    token replaces the random suffix, for callers that must find the shard again by name.
+    """
+    safe = lambda s: re.sub(r'[^A-Za-z0-9-]+', '-', str(s)).strip('-') or 'x'
+    name = '_'.join([time.strftime('%Y%m%d-%H%M%S'), safe(subject_id), safe(socket.gethostname()),
+                     str(os.getpid()), safe(token) if token else os.urandom(4).hex()])
+    return os.path.join(shard_dir(data_file), name + '.csv')
+
+
+def list_shards(directory, include_partial=False):
+    """Finished shard files in directory, sorted by name (= start time).
+
+    Only names session_path() makes count, so other CSVs kept in the folder (older
+    per-subject files, schedules) are never merged in with the sessions.
+    """
+    if not os.path.isdir(directory):
+        return []
+    strip = lambda f: f[:-len(PART)] if include_partial and f.endswith(PART) else f
+    return sorted(f for f in os.listdir(directory) if _SHARD.match(strip(f)))
+
+
+def latest_shard(data_file):
+    shards = list_shards(shard_dir(data_file), include_partial=True)
+    return os.path.join(shard_dir(data_file), shards[-1]) if shards else None
+
+
+class _Lock:
+    """Exclusive lock file, so two compactions of the same dataset never run at once."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        try:
+            self.fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise RuntimeError(f'{self.path} exists: another compaction is running (delete it if not)')
+        os.write(self.fd, f'{socket.gethostname()} {os.getpid()}\n'.encode())
+        return self
+
+    def __exit__(self, *exc):
+        os.close(self.fd)
+        os.remove(self.path)
+
+
+def _read_state(path):
+    if os.path.isfile(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'fieldnames': [], 'size': 0, 'merged': {}}
+
+
+def _write_state(path, state):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _rewrite_header(out, fieldnames):
+    """Rewrite the consolidated file with a wider header (only when a shard brings new columns)."""
+    with open(out, newline='') as f:
+        rows = list(csv.DictReader(f))
+    tmp = out + '.tmp'
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, out)
+
+
+def compact(directory, out=None, include_partial=False):
+    """Append every shard's not-yet-merged rows in directory to out; returns (n_shards_read, n_new_rows).
+
+    The state file next to out records how far each shard is merged (in bytes, and
+    whether it was finished) and how long out was afterwards, so an interrupted
+    compaction is rolled back and redone cleanly.
+    """
+    directory = directory.rstrip('/\\')
+    out = out or directory + '.csv'
+    state_path = out + '.merged.json'
+    with _Lock(out + '.lock'):
+        state = _read_state(state_path)
+        if os.path.isfile(out) and os.path.getsize(out) > state['size']:
+            with open(out, 'r+b') as f: # drop rows from a compaction that died before saving its state
+                f.truncate(state['size'])
+
+        # a .part shard is recorded under its finished name; once renamed, only the rows after its offset are new
+        key = lambda s: s[:-len(PART)] if s.endswith(PART) else s
+        done = lambda s: s in state['merged'] and state['merged'][s].get('finished', True)
+        new = [s for s in list_shards(directory, include_partial) if not done(key(s))]
+        n_read = n_rows = 0
+        for shard in new:
+            merged = state['merged'].get(key(shard), {'rows': 0, 'bytes': 0})
+            try:
+                with open(os.path.join(directory, shard), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError: # a .part renamed since the listing; read next time
+                continue
+            end = data.rfind(b'\n') + 1 # drops a torn last line in a .part file
+            header_end = data.find(b'\n') + 1
+            if end <= merged['bytes'] and shard.endswith(PART):
+                continue # a live session with no new rows yet
+            fields = next(csv.reader(io.StringIO(data[:header_end].decode())), []) if header_end else []
+            body = data[max(merged['bytes'], header_end):end].decode()
+            rows = list(csv.DictReader(io.StringIO(body), fieldnames=fields)) if fields else []
+            added = [k for k in fields if k not in state['fieldnames']]
+            if added:
+                state['fieldnames'] += added
+                if state['size']:
+                    _rewrite_header(out, state['fieldnames'])
+                    state['size'] = os.path.getsize(out)
+                    _write_state(state_path, state)
+            with open(out, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=state['fieldnames'], restval='')
+                if f.tell() == 0:
+                    writer.writeheader()
+                writer.writerows(rows)
+                f.flush()
+                os.fsync(f.fileno())
+            state['size'] = os.path.getsize(out)
+            state['merged'][key(shard)] = {'rows': merged['rows'] + len(rows), 'bytes': max(end, header_end),
+                                           'finished': not shard.endswith(PART)}
+            _write_state(state_path, state)
+            n_read += 1
+            n_rows += len(rows)
+    return n_read, n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge per-session shard files into one CSV, incrementally.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    comp = sub.add_parser('compact')
+    comp.add_argument('directory', help='shard directory, e.g. _data/flanker')
+    comp.add_argument('--out', default=None, help='consolidated CSV (default: DIRECTORY.csv)')
+    comp.add_argument('--include-partial', action='store_true',
+                      help='also merge the rows so far of .csv.part files (sessions still running or never finished)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    n_shards, n_rows = compact(args.directory, args.out, args.include_partial)
+    print(f'read {n_shards} shard(s), merged {n_rows} new rows in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
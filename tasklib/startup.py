@@ -0,0 +1,48 @@
+"""Cold-start timing: how long it takes from launch to the first instruction screen."""
+import os, time
+
+_T0 = time.perf_counter() # importing this module is as close to launch as we get portably
+_marks = []
+_reported = False
+
+
+def _process_age():
+    """Seconds since the interpreter started (Linux only; None elsewhere)."""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+_LAUNCH_OFFSET = _process_age() # interpreter start -> this import
+
+
+def mark(phase):
+    """Record that a startup phase (e.g. 'psychopy import', 'window') just finished."""
+    _marks.append((phase, time.perf_counter()))
+
+
+def elapsed():
+    return time.perf_counter() - _T0
+
+
+def report(label='first screen'):
+    """Print (once) the time to the first instruction screen, broken down by phase."""
+    global _reported
+    if _reported:
+        return None
+    _reported = True
+    now = time.perf_counter()
+    phases, last = [], _T0
+    for phase, t in _marks:
+        phases.append(f'{phase} {t - last:.3f}s')
+        last = t
+    total = now - _T0
+    since_launch = f', {total + _LAUNCH_OFFSET:.2f}s since launch' if _LAUNCH_OFFSET is not None else ''
+    print(f'[startup] {label} after {total:.3f}s{since_launch} ({", ".join(phases) or "no phases marked"})')
+    return {'total_s': total, 'since_launch_s': None if _LAUNCH_OFFSET is None else total + _LAUNCH_OFFSET,
+            'phases': {phase: t - _T0 for phase, t in _marks}}
@@ -0,0 +1,107 @@
+"""Preloaded, size-capped texture cache for image stimuli."""
+import time
+from collections import OrderedDict, deque
+
+
+class TextureCache:
+    """Decodes images into ready-to-draw ImageStims before the trials that need them.
+
+    Queue the next block's images with queue() during instruction/rest screens and
+    call service() once per frame there, so loading is spread over frames that don't
+    matter. fill() finishes anything left before the block starts. Trials then only
+    get() and draw an already-uploaded texture. Least-recently-used entries are evicted once the
+    decoded pixels exceed max_mb.
+
+    With a TextureStore, images it holds are taken from its memory-mapped,
+    already-resized arrays instead of being decoded from JPEG.
+    """
+
+    def __init__(self, win, size=(0.5, 0.5), max_mb=256, store=None, **stim_kwargs):
+        self.win = win
+        self.size = size
+        self.store = store
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.stim_kwargs = stim_kwargs
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stims = OrderedDict() # path -> (ImageStim, nbytes)
+        self._pending = deque()
+
+    def _max_px(self):
+        # no point keeping more pixels than the stimulus covers on screen; in 'height' units
+        # a size is a fraction of the window's height, not of its (wider) width
+        size = self.size if isinstance(self.size, (tuple, list)) else (self.size, self.size)
+        return max(1, int(max(size) * self.win.size[1]))
+
+    def _load(self, path):
+        from PIL import Image
+        from psychopy import visual
+
+        if self.store is not None and path in self.store:
+            img = self.store.image(path)
+        else:
+            img = Image.open(path).convert('RGB')
+            px = self._max_px()
+            img.thumbnail((px, px), Image.LANCZOS)
+        stim = visual.ImageStim(self.win, image=img, size=self.size, name=path, **self.stim_kwargs)
+        nbytes = img.width * img.height * 4 # RGBA texture estimate (the GPU copy, whatever the source)
+        self._stims[path] = (stim, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self._stims) > 1:
+            _, (_, old_bytes) = self._stims.popitem(last=False)
+            self.nbytes -= old_bytes
+            self.evictions += 1
+        return stim
+
+    def queue(self, paths):
+        """Schedule images to be loaded by service()/fill() (already-loaded ones are kept over older entries)."""
+        for path in paths:
+            if path in self._stims:
+                self._stims.move_to_end(path)
+            elif path not in self._pending:
+                self._pending.append(path)
+
+    def service(self, max_seconds=0.004):
+        """Load queued images until max_seconds is used up (always at least one)."""
+        start = time.perf_counter()
+        while self._pending:
+            path = self._pending.popleft()
+            if path not in self._stims:
+                self._load(path)
+            if time.perf_counter() - start >= max_seconds:
+                break
+        return len(self._pending)
+
+    def fill(self):
+        """Load everything still queued."""
+        while self._pending:
+            self.service(max_seconds=float('inf'))
+
+    def get(self, path):
+        """Return the prepared ImageStim for path, loading it now on a cache miss."""
+        if path in self._stims:
+            self.hits += 1
+            self._stims.move_to_end(path)
+            return self._stims[path][0]
+        self.misses += 1
+        return self._load(path)
+
+    def release(self, path):
+        """Mark path as shown: it is evicted before anything still waiting to be drawn."""
+        if path in self._stims:
+            self._stims.move_to_end(path, last=False)
+
+    def capacity(self):
+        """How many images are sure to fit in max_mb (each at most _max_px square)."""
+        return max(1, self.max_bytes // (self._max_px() ** 2 * 4))
+
+    def stats(self):
+        return {
+            'n_cached': len(self._stims),
+            'cached_mb': round(self.nbytes / 1024 / 1024, 1),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,12 @@
+"""Importable task classes.
+
+Importing these does not import PsychoPy; a window is only created when a
+Session is first asked for one.
+"""
+from tasklib.tasks.base import Session, Task
+from tasklib.tasks.flanker import FlankerTask
+from tasklib.tasks.nback import NBackTask
+from tasklib.tasks.paired_associate import PairedAssociateTask
+from tasklib.tasks.srtt import SRTTTask
+
+TASKS = {cls.name: cls for cls in (FlankerTask, NBackTask, SRTTTask, PairedAssociateTask)}
@@ -0,0 +1,161 @@
+"""Task base class and a lazily initialized PsychoPy session."""
+import random
+from tasklib import startup, telemetry
+
+
+class Session:
+    """Owns the window, keyboard and subject info for one sitting.
+
+    Nothing from PsychoPy is imported until a window, clock or dialog is first
+    needed, so tasks can be imported, their trial lists built and their data scored
+    without a graphics stack. One Session can run several tasks back to back.
+    """
+
+    def __init__(self, size=(800, 600), color='white', fullscr=False, subject_id=None):
+        # no window units: like the original scripts, each stimulus uses its task's
+        # units or PsychoPy's preferred default
+        self.win_kwargs = {'size': list(size), 'color': color, 'fullscr': fullscr}
+        self.subject_id = subject_id
+        self._psychopy = None
+        self._win = None
+        self._responses = None
+
+    @property
+    def psychopy(self):
+        """The psychopy visual/core/event/gui modules, imported on first use."""
+        if self._psychopy is None:
+            from psychopy import visual, core, event, gui
+            self._psychopy = {'visual': visual, 'core': core, 'event': event, 'gui': gui}
+            startup.mark('psychopy import')
+        return self._psychopy
+
+    visual = property(lambda self: self.psychopy['visual'])
+    core = property(lambda self: self.psychopy['core'])
+    event = property(lambda self: self.psychopy['event'])
+
+    @property
+    def win(self):
+        if self._win is None:
+            kwargs = dict(self.win_kwargs)
+            self._win = self.visual.Window(kwargs.pop('size'), **kwargs)
+            startup.mark('window')
+        return self._win
+
+    @property
+    def responses(self):
+        """The session's ResponseBox (one keyboard backend for every task)."""
+        if self._responses is None:
+            from tasklib.responses import ResponseBox
+            self.psychopy # psychopy.hardware needs psychopy imported first
+            self._responses = ResponseBox()
+            startup.mark('keyboard')
+        return self._responses
+
+    def ask_subject(self, title, fields=('Subject ID:',)):
+        """Show the startup dialog; returns its answers (subject ID first) or quits on cancel."""
+        dlg = self.psychopy['gui'].Dlg(title=title)
+        for field in fields:
+            dlg.addField(field)
+        dlg.show()
+        if not dlg.OK:
+            self.core.quit()
+        self.subject_id = dlg.data[0]
+        startup.mark('dialog')
+        return list(dlg.data)
+
+    def close(self):
+        if self._win is not None:
+            self._win.close()
+            self._win = None
+
+
+class Task:
+    """One experiment: parameters, trial generation, scoring and presentation.
+
+    make_trials() and score() are pure Python; build() and run() need a Session.
+    Subclasses set name, title, FIELDNAMES and, if their positions and sizes are
+    written in particular units, units.
+    """
+    name = None
+    title = None
+    FIELDNAMES = []
+    units = None
+    background = None # window colour while this task runs; None keeps the session's
+    dialog_fields = ('Subject ID:',)
+
+    def make_trials(self, rng=random):
+        raise NotImplementedError
+
+    def score(self, rows):
+        raise NotImplementedError
+
+    def build(self, session):
+        """Create this task's stimuli on the session window."""
+        raise NotImplementedError
+
+    def run(self, session, logger):
+        """Show instructions and all trials, logging one row per trial."""
+        raise NotImplementedError
+
+    def configure(self, answers):
+        """Apply extra dialog answers (beyond the subject ID)."""
+
+    def stim_kwargs(self, **kwargs):
+        if self.units:
+            kwargs.setdefault('units', self.units)
+        return kwargs
+
+    def text(self, session, text, **kwargs):
+        kwargs.setdefault('color', 'black')
+        return session.visual.TextStim(session.win, text=text, **self.stim_kwargs(**kwargs))
+
+    def show_and_wait(self, session, stim, keys=('space',)):
+        """Show stim until one of keys is pressed; returns the key."""
+        stim.draw()
+        session.responses.clear()
+        session.win.flip()
+        startup.report(f'{self.name} first screen') # only the first screen of the process is reported
+        return session.responses.wait(list(keys))
+
+    def show_and_preload(self, session, stim, cache, keys=('space',)):
+        """Like show_and_wait, but loads cache's queued images a few ms per frame while the screen is read."""
+        session.responses.clear()
+        pressed = []
+        while not pressed:
+            stim.draw()
+            cache.service()
+            session.win.flip()
+            startup.report(f'{self.name} first screen')
+            pressed = session.responses.poll(list(keys))
+        cache.fill() # whatever the participant didn't wait for
+        return pressed[0]
+
+    def end_screen(self, session):
+        end_text = self.text(session, 'Task complete!\n\nPress SPACE to exit', height=0.08)
+        self.show_and_wait(session, end_text)
+
+    def main(self, data_file, record_frames=False, **session_kwargs):
+        """Run this task on its own: dialog, window, trials, end screen, quit.
+
+        record_frames saves per-frame timings (tasklib.telemetry) next to the session's file.
+        """
+        from tasklib.shards import session_path
+        from tasklib.trial_logger import TrialLogger
+
+        if self.background:
+            session_kwargs.setdefault('color', self.background)
+        session = Session(**session_kwargs)
+        self.configure(session.ask_subject(self.title, self.dialog_fields)[1:])
+        # this session's own file under data_file's shard folder (merge with tasklib.shards compact)
+        path = session_path(data_file, session.subject_id)
+        logger = TrialLogger(path, self.FIELDNAMES, atomic=True)
+        self.build(session)
+        startup.mark('stimuli')
+        if record_frames:
+            telemetry.enable()
+        self.run(session, logger)
+        logger.close()
+        telemetry.finish(path)
+        self.end_screen(session)
+        session.close()
+        session.core.quit()
@@ -0,0 +1,109 @@
+"""Flanker task."""
+import random
+from tasklib import telemetry
+from tasklib.tasks.base import Task
+
+
+class FlankerTask(Task):
+    name = 'flanker'
+    title = 'Flanker Task'
+    FIELDNAMES = ['subject_id', 'trial', 'type', 'stimulus', 'response', 'correct', 'rt']
+    units = 'height'
+
+    # each stimulus has the display text, correct key, and trial type
+    STIMULI = [
+        {'text': '<<<<<', 'correct_key': 'left', 'type': 'congruent'},
+        {'text': '>>>>>', 'correct_key': 'right', 'type': 'congruent'},
+        {'text': '<<><<', 'correct_key': 'right', 'type': 'incongruent'},
+        {'text': '>><>>', 'correct_key': 'left', 'type': 'incongruent'}
+    ]
+    INSTRUCTIONS = """
+    Flanker Task\n\n
+    Use the LEFT and RIGHT arrow keys\n
+    to indicate the direction of the CENTER arrow.\n\n
+    Press ESC at any time to quit\n
+    Press SPACE to begin"""
+
+    def __init__(self, n_trials=30, fixation_duration=0.5, feedback_duration=0.3):
+        self.n_trials = n_trials
+        self.fixation_duration = fixation_duration
+        self.feedback_duration = feedback_duration
+
+    def make_trials(self, rng=random):
+        return [rng.choice(self.STIMULI) for _ in range(self.n_trials)]
+
+    def score(self, rows):
+        """Accuracy and correct-trial mean RT per trial type, plus the flanker effect (s)."""
+        out = {}
+        for trial_type in ('congruent', 'incongruent'):
+            typed = [r for r in rows if r['type'] == trial_type]
+            rts = [float(r['rt']) for r in typed if int(r['correct'])]
+            out[trial_type] = {'n': len(typed),
+                               'accuracy': sum(int(r['correct']) for r in typed) / len(typed) if typed else None,
+                               'mean_rt': sum(rts) / len(rts) if rts else None}
+        if out['congruent']['mean_rt'] is not None and out['incongruent']['mean_rt'] is not None:
+            out['flanker_effect'] = out['incongruent']['mean_rt'] - out['congruent']['mean_rt']
+        return out
+
+    def build(self, session):
+        self.fixation = self.text(session, '+', height=0.1)
+        self.stim = self.text(session, '', height=0.15)
+        self.feedback_stim = self.text(session, '', height=0.08)
+        self.instructions = self.text(session, self.INSTRUCTIONS, height=0.05, wrapWidth=1.5)
+
+    def run(self, session, logger):
+        win, core, responses = session.win, session.core, session.responses
+        trials = self.make_trials()
+        self.show_and_wait(session, self.instructions)
+
+        telemetry.block(self.name)
+        for trial, trial_info in enumerate(trials):
+            telemetry.trial(trial)
+            # Show fixation
+            self.fixation.draw()
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+            core.wait(self.fixation_duration)
+            telemetry.mark('wait')
+
+            self.stim.text = trial_info['text']
+            telemetry.mark('setup')
+            self.stim.draw()
+            responses.clear()
+            responses.on_flip(win) # RT is timed from this flip
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+
+            # Get response
+            key = responses.wait(['left', 'right', 'escape'])
+            telemetry.mark('keys')
+            if key.name == 'escape':
+                break
+
+            response_key = key.name
+            rt = key.rt
+            correct = response_key == trial_info['correct_key']
+
+            # Show feedback
+            self.feedback_stim.text = 'Correct!' if correct else 'Wrong'
+            self.feedback_stim.color = 'green' if correct else 'red'
+            telemetry.mark('setup')
+            self.feedback_stim.draw()
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+            core.wait(self.feedback_duration)
+            telemetry.mark('wait')
+
+            logger.log({
+                'subject_id': session.subject_id,
+                'trial': trial,
+                'type': trial_info['type'],
+                'stimulus': trial_info['text'],
+                'response': response_key,
+                'correct': int(correct),
+                'rt': rt
+            })
+            telemetry.mark('log')
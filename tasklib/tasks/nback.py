@@ -0,0 +1,128 @@
+"""Letter N-back task (the simple, single-block classroom version)."""
+import random
+from tasklib import telemetry
+from tasklib.tasks.base import Task
+
+
+class NBackTask(Task):
+    name = 'nback'
+    title = 'N-back Task'
+    FIELDNAMES = ['subject_id', 'n', 'trial', 'stimulus', 'is_target', 'correct', 'rt']
+    dialog_fields = ('Subject ID:', 'N (1, 2, or 3):')
+    LETTERS = ['B', 'C', 'D', 'F', 'G', 'H', 'J', 'K']
+
+    def __init__(self, n=2, n_trials=30, fixation_duration=0.5, stim_duration=1, iti_duration=0.5,
+                 target_proportion=0.3, letters=None, background=None):
+        self.n = n
+        self.n_trials = n_trials
+        self.fixation_duration = fixation_duration
+        self.stim_duration = stim_duration
+        self.iti_duration = iti_duration
+        self.target_proportion = target_proportion
+        self.letters = list(letters or self.LETTERS)
+        self.background = background
+
+    def configure(self, answers):
+        if answers:
+            self.n = int(answers[0])
+
+    def make_trials(self, rng=random):
+        """List of (letter, is_target); about target_proportion of trials after the first n are targets."""
+        sequence_of_letters, trials = [], []
+        for trial in range(self.n_trials):
+            if trial >= self.n and rng.random() < self.target_proportion:
+                # target trial: show the letter from n trials ago
+                is_target = True
+                current_letter = sequence_of_letters[trial - self.n]
+            else:
+                # show a different letter than the one n trials ago
+                is_target = False
+                if trial >= self.n:
+                    current_letter = rng.choice([l for l in self.letters if l != sequence_of_letters[trial - self.n]])
+                else:
+                    current_letter = rng.choice(self.letters)
+            sequence_of_letters.append(current_letter)
+            trials.append((current_letter, is_target))
+        return trials
+
+    def score(self, rows):
+        """Accuracy, hit rate and false-alarm rate."""
+        targets = [r for r in rows if int(r['is_target'])]
+        lures = [r for r in rows if not int(r['is_target'])]
+        responded = lambda r: r['rt'] not in (None, '')
+        return {'n': len(rows),
+                'accuracy': sum(int(r['correct']) for r in rows) / len(rows) if rows else None,
+                'hit_rate': sum(map(responded, targets)) / len(targets) if targets else None,
+                'false_alarm_rate': sum(map(responded, lures)) / len(lures) if lures else None}
+
+    def instruction_text(self):
+        return """
+    N-back Task\n\n
+    Press SPACE when the current letter matches\n
+    the letter from """ + str(self.n) + """ position(s) back\n\n
+    Press ESC at any time to quit\n
+    Press SPACE to begin"""
+
+    def build(self, session):
+        self.fixation = self.text(session, '+', height=0.1)
+        self.stim = self.text(session, '', height=0.2)
+        self.instructions = self.text(session, self.instruction_text(), height=0.05, wrapWidth=1.5)
+
+    def run(self, session, logger):
+        win, core, responses = session.win, session.core, session.responses
+        # "trials" holds the letter to show on each trial and whether it is a target
+        trials = self.make_trials()
+        self.instructions.text = self.instruction_text()
+        self.show_and_wait(session, self.instructions)
+
+        telemetry.block(self.name)
+        for trial, (current_letter, is_target) in enumerate(trials):
+            telemetry.trial(trial)
+            # Display the fixation cross at the start of the trial
+            self.fixation.draw()
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+            core.wait(self.fixation_duration)
+            telemetry.mark('wait')
+
+            # Display the chosen letter
+            self.stim.text = current_letter
+            telemetry.mark('setup')
+            self.stim.draw()
+            responses.clear()
+            responses.on_flip(win) # RT is timed from this flip
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+
+            # Get participant's response (None if no key within stim_duration)
+            key = responses.wait(['space', 'escape'], max_wait=self.stim_duration)
+            telemetry.mark('keys')
+            # if they click Escape, exit the experiment
+            if key is not None and key.name == 'escape':
+                break
+
+            # if a response is made, compute whether it is correct
+            if key is not None and key.name == 'space': # space bar was pressed,
+                correct = is_target # correct should be TRUE if is_target is TRUE and FALSE if is_target is FALSE
+                rt = key.rt # response time from the stimulus flip
+            else: # space bar not pressed, this is correct if trial is non-target trial
+                correct = not is_target # correct should be TRUE if is_target is FALSE and FALSE if is_target is TRUE
+                rt = None
+
+            # data to save from this trial
+            logger.log({
+                'subject_id': session.subject_id,
+                'n': self.n,
+                'trial': trial,
+                'stimulus': current_letter,
+                'is_target': int(is_target),
+                'correct': int(correct),
+                'rt': rt
+            })
+            telemetry.mark('log')
+
+            # Brief inter-trial interval
+            core.wait(self.iti_duration)
+            telemetry.mark('wait')
@@ -0,0 +1,215 @@
+"""Paired associate memory task."""
+import glob, os, random, time
+from tasklib import telemetry
+from tasklib.stim_cache import TextureCache
+from tasklib.tasks.base import Task
+from tasklib.texture_store import TextureStore
+
+
+class PairedAssociateTask(Task):
+    name = 'paired_associate'
+    title = 'Paired Associates Task'
+    FIELDNAMES = ['subject_id', 'phase', 'trial', 'cue', 'target', 'response', 'correct', 'rt', 'draw_ms']
+
+    STUDY_INSTRUCTIONS = """
+    Paired Associate Memory Task\n\n
+    STUDY PHASE\n\n
+    You will see an image paired with a word.\n
+    Try to remember which image and word go together.\n\n
+    Press ESC at any time to quit\n
+    Press SPACE to begin"""
+    TEST_INSTRUCTIONS = """
+    TEST PHASE\n\n
+    You will see the image from each pair.\n
+    Type the word it was paired with and press ENTER.\n\n
+    Press ESC at any time to quit\n
+    Press SPACE to begin"""
+
+    def __init__(self, n_pairs=10, study_trial_duration=3.0, fixation_duration=0.5, feedback_duration=1.5,
+                 stimuli_folder='_stimuli', stimuli_type='objects', words_file='words.txt', cache_mb=256,
+                 texture_store=None):
+        self.n_pairs = n_pairs
+        self.study_trial_duration = study_trial_duration
+        self.fixation_duration = fixation_duration
+        self.feedback_duration = feedback_duration
+        self.stimuli_folder = stimuli_folder
+        self.stimuli_type = stimuli_type # scenes | faces | objects
+        self.words_file = words_file
+        self.cache_mb = cache_mb # decoded cue images kept on the GPU; fits several hundred pairs
+        # pre-resized images from tasklib.texture_store (default: <stimuli_folder>/_store, if built)
+        self.texture_store = texture_store or os.path.join(stimuli_folder, '_store')
+
+    def make_trials(self, rng=random):
+        """Random (image_path, word) pairs: the study order and a reshuffled test order."""
+        image_paths = sorted(glob.glob(f'{self.stimuli_folder}/{self.stimuli_type}/*.jpg'))
+        rng.shuffle(image_paths)
+        with open(os.path.join(self.stimuli_folder, self.words_file), 'r') as f:
+            words = [line.strip().lower() for line in f if line.strip()]
+        rng.shuffle(words)
+        pairs = [(image_paths[i], words[i]) for i in range(self.n_pairs)]
+        test_pairs = pairs.copy()
+        rng.shuffle(test_pairs)
+        return {'study': pairs, 'test': test_pairs}
+
+    def score(self, rows):
+        """Test-phase accuracy and mean RT (s)."""
+        test = [r for r in rows if r['phase'] == 'test']
+        rts = [float(r['rt']) for r in test if r['rt'] not in (None, '')]
+        return {'n': len(test),
+                'accuracy': sum(int(r['correct']) for r in test) / len(test) if test else None,
+                'mean_rt': sum(rts) / len(rts) if rts else None}
+
+    def preload(self, cues):
+        """Queue as many of cues as the cache is sure to hold; returns how many that is.
+
+        The rest are loaded one per trial, during the fixation cross, in place of
+        cues that have already been shown, so memory stays flat for long lists.
+        """
+        ahead = min(len(cues), self.cues.capacity() - 1)
+        self.cues.queue(cues[:ahead])
+        return ahead
+
+    def show_fixation(self, session, upcoming=None):
+        """Fixation cross; upcoming's cue image is loaded while it is on screen."""
+        self.fixation.draw()
+        telemetry.mark('draw')
+        session.win.flip()
+        telemetry.flip()
+        clock = session.core.Clock()
+        if upcoming is not None:
+            self.cues.queue([upcoming])
+            self.cues.fill()
+            telemetry.mark('setup')
+        session.core.wait(max(0, self.fixation_duration - clock.getTime()))
+        telemetry.mark('wait')
+
+    def build(self, session):
+        # every stimulus is made once here and reused on every trial
+        self.stim = self.text(session, '', height=0.1)
+        self.fixation = self.text(session, '+', height=0.1)
+        self.instructions = self.text(session, self.STUDY_INSTRUCTIONS, height=0.05, wrapWidth=1.5)
+        self.break_text = self.text(session, 'End of study phase\n\nPress SPACE to continue to the test', height=0.06)
+        self.response_text = self.text(session, '', height=0.08, pos=(0, -0.2))
+        self.feedback = self.text(session, '', height=0.06)
+        self.cues = TextureCache(session.win, size=0.4, max_mb=self.cache_mb, store=TextureStore.open(self.texture_store),
+                                 **self.stim_kwargs(pos=(0, 0.2)))
+
+    def run(self, session, logger):
+        win, core, responses = session.win, session.core, session.responses
+        trials = self.make_trials()
+        # cue images are decoded and uploaded while the instructions are on screen
+        study_cues = [cue for cue, _ in trials['study']]
+        ahead = self.preload(study_cues)
+        self.instructions.text = self.STUDY_INSTRUCTIONS
+        self.show_and_preload(session, self.instructions, self.cues)
+
+        # STUDY BLOCK
+        telemetry.block('study')
+        for trial, (cue, target) in enumerate(trials['study']):
+            telemetry.trial(trial)
+            # Fixation
+            self.show_fixation(session, study_cues[trial + ahead] if trial + ahead < len(study_cues) else None)
+
+            # Show pair
+            draw_start = time.perf_counter()
+            self.cues.get(cue).draw()
+            self.stim.text = target
+            self.stim.pos = (0, -0.2)
+            self.stim.draw()
+            draw_ms = (time.perf_counter() - draw_start) * 1000
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+            self.cues.release(cue)
+            core.wait(self.study_trial_duration)
+            telemetry.mark('wait')
+
+            logger.log({
+                'subject_id': session.subject_id,
+                'phase': 'study',
+                'trial': trial,
+                'cue': os.path.basename(cue),
+                'target': target,
+                'draw_ms': draw_ms
+            })
+            telemetry.mark('log')
+        logger.flush() # study phase is safely on disk
+
+        # Break
+        self.show_and_wait(session, self.break_text)
+
+        # Instructions - Test (reloads anything the cache had to evict)
+        test_cues = [cue for cue, _ in trials['test']]
+        ahead = self.preload(test_cues)
+        self.instructions.text = self.TEST_INSTRUCTIONS
+        self.show_and_preload(session, self.instructions, self.cues)
+
+        # TEST BLOCK
+        telemetry.block('test')
+        for trial, (cue, correct_target) in enumerate(trials['test']):
+            telemetry.trial(trial)
+            # Fixation
+            self.show_fixation(session, test_cues[trial + ahead] if trial + ahead < len(test_cues) else None)
+
+            # Show cue with prompt
+            cue_stim = self.cues.get(cue)
+
+            # Get typed response
+            response = ''
+            draw_ms = None
+            responses.clear()
+            while True:
+                draw_start = time.perf_counter()
+                cue_stim.draw()
+                self.response_text.text = f'Your answer: {response}'
+                self.response_text.draw()
+                if draw_ms is None: # the cue's first frame; RT is timed from its flip
+                    draw_ms = (time.perf_counter() - draw_start) * 1000
+                    responses.on_flip(win)
+                telemetry.mark('draw')
+                win.flip()
+                telemetry.flip()
+
+                key = responses.wait()
+                telemetry.mark('keys')
+                if key.name == 'return':
+                    break
+                elif key.name == 'escape':
+                    win.close()
+                    core.quit()
+                elif key.name == 'backspace':
+                    response = response[:-1]
+                elif key.name == 'space':
+                    response += ' '
+                elif len(key.name) == 1:
+                    response += key.name
+
+            rt = key.rt # from cue onset to ENTER
+            self.cues.release(cue)
+            correct = response.strip().upper() == correct_target.upper()
+
+            # Feedback
+            self.feedback.text = f'Correct: {correct_target}\nYour answer: {response}'
+            self.feedback.color = 'green' if correct else 'red'
+            telemetry.mark('setup')
+            self.feedback.draw()
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+            core.wait(self.feedback_duration)
+            telemetry.mark('wait')
+
+            # (study rows leave response/correct/rt blank)
+            logger.log({
+                'subject_id': session.subject_id,
+                'phase': 'test',
+                'trial': trial,
+                'cue': os.path.basename(cue),
+                'target': correct_target,
+                'response': response.strip(),
+                'correct': int(correct),
+                'rt': rt,
+                'draw_ms': draw_ms
+            })
+            telemetry.mark('log')
+        print('Cue cache:', self.cues.stats())
@@ -0,0 +1,107 @@
+"""Serial reaction time task."""
+import random
+from tasklib import telemetry
+from tasklib.tasks.base import Task
+
+
+class SRTTTask(Task):
+    name = 'srtt'
+    title = 'Serial Reaction Time Task'
+    FIELDNAMES = ['subject_id', 'trial', 'target_position', 'response_position', 'correct', 'rt', 'trial_type']
+
+    BOX_POSITIONS = [(-0.3, 0), (-0.1, 0), (0.1, 0), (0.3, 0)]
+    KEYS = ['f', 'g', 'h', 'j'] # key to press for each box
+    INSTRUCTIONS = """
+    Serial Reaction Time Task\n\n
+    Place your fingers on the F, G, H, and J keys\n
+    Press the key where the blue box appears:\n
+    F = left, G = middle-left, H = middle-right, J = right\n\n
+    Press ESC at any time to quit\n
+    Press SPACE to begin"""
+
+    def __init__(self, repeated_pattern=(0, 2, 1, 3, 2, 0, 0, 3), n_pattern_reps=8, n_random_trials=16, iti_duration=0.2):
+        self.repeated_pattern = list(repeated_pattern)
+        self.n_pattern_reps = n_pattern_reps
+        self.n_random_trials = n_random_trials
+        self.iti_duration = iti_duration
+
+    def make_trials(self, rng=random):
+        """The pattern repeated n_pattern_reps times, then random positions.
+
+        Slowness on the random trials at the end shows that the pattern was learned.
+        """
+        trials = [(target, 'pattern') for target in self.repeated_pattern * self.n_pattern_reps]
+        trials += [(target, 'random') for target in rng.choices(range(0, 4), k=self.n_random_trials)]
+        return trials
+
+    def score(self, rows):
+        """Accuracy and correct-trial mean RT for pattern vs random trials, plus the learning effect (s)."""
+        out = {}
+        for trial_type in ('pattern', 'random'):
+            typed = [r for r in rows if r['trial_type'] == trial_type]
+            rts = [float(r['rt']) for r in typed if int(r['correct'])]
+            out[trial_type] = {'n': len(typed),
+                               'accuracy': sum(int(r['correct']) for r in typed) / len(typed) if typed else None,
+                               'mean_rt': sum(rts) / len(rts) if rts else None}
+        if out['pattern']['mean_rt'] is not None and out['random']['mean_rt'] is not None:
+            out['learning_effect'] = out['random']['mean_rt'] - out['pattern']['mean_rt']
+        return out
+
+    def build(self, session):
+        visual, win = session.visual, session.win
+        self.boxes = [visual.Rect(win, **self.stim_kwargs(width=0.15, height=0.15, pos=pos, lineColor='black', lineWidth=2))
+                      for pos in self.BOX_POSITIONS]
+        self.highlight = visual.Rect(win, **self.stim_kwargs(width=0.15, height=0.15, fillColor='blue', lineColor='black', lineWidth=2))
+        self.instructions = self.text(session, self.INSTRUCTIONS, height=0.05, wrapWidth=1.5)
+
+    def run(self, session, logger):
+        win, core, responses = session.win, session.core, session.responses
+        trials = self.make_trials()
+        self.show_and_wait(session, self.instructions)
+
+        telemetry.block(self.name)
+        for trial, (target_idx, trial_type) in enumerate(trials):
+            telemetry.trial(trial)
+            # Show boxes
+            for box in self.boxes:
+                box.draw()
+
+            # Highlight target
+            self.highlight.pos = self.BOX_POSITIONS[target_idx]
+            self.highlight.draw()
+            responses.clear()
+            responses.on_flip(win) # RT is timed from this flip
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+
+            # Get response
+            key = responses.wait(self.KEYS + ['escape'])
+            telemetry.mark('keys')
+            if key.name == 'escape':
+                break
+
+            response_key = key.name
+            rt = key.rt
+            response_idx = self.KEYS.index(response_key)
+            correct = response_idx == target_idx
+
+            logger.log({
+                'subject_id': session.subject_id,
+                'trial': trial,
+                'target_position': target_idx,
+                'response_position': response_idx,
+                'correct': int(correct),
+                'rt': rt,
+                'trial_type': trial_type
+            })
+            telemetry.mark('log')
+
+            # Brief ITI - clear highlight
+            for box in self.boxes:
+                box.draw()
+            telemetry.mark('draw')
+            win.flip()
+            telemetry.flip()
+            core.wait(self.iti_duration)
+            telemetry.mark('wait')
@@ -0,0 +1,242 @@
+"""Per-frame telemetry for the task loops: where each frame's time went, by phase.
+
+Off by default, when every hook is an empty function. Switched on (TELEMETRY = True
+in nback_mri.py / nback_beh.py, or in a tasks-python script), the loops' hooks
+record into a preallocated ring buffer, one row per flip:
+
+    telemetry.mark('draw')   # the time since the previous hook was spent drawing
+    win.flip()
+    telemetry.flip()         # ... this in flip; ends the frame's row
+
+A row holds the time spent in each of PHASES since the previous flip, the flip
+interval, garbage-collector pauses in that frame and the block and trial set by
+block() and trial(). block() also restarts the clock, so screens without hooks
+in between (rests, breaks) are not blamed on the next frame. At the end of the
+session the buffer is saved as one .npz, a compressed column per field, and a
+summary of the slowest frames and their causes is printed; it can be printed
+again later:
+
+    python -m tasklib.telemetry report _data/nback_mri/<session>_20260101-120000.frames.npz
+"""
+import argparse, gc, json, os, time
+import numpy as np
+
+PHASES = ('setup', 'draw', 'flip', 'keys', 'log', 'wait')
+BUSY = ('setup', 'draw', 'keys', 'log') # work done in the frame; flip and wait are waiting on purpose
+CAPACITY = 1 << 18 # frames kept (73 min at 60 Hz, about 12 MB); older frames are overwritten
+LATE = 1.5 # a flip interval over LATE refresh periods is a late frame
+N_SLOWEST = 10
+DTYPE = np.dtype([('t', 'f8'), ('interval_ms', 'f4')] + [(f'{p}_ms', 'f4') for p in PHASES] +
+                 [('gc_ms', 'f4'), ('gc_count', 'u1'), ('block', 'i2'), ('trial', 'i4')])
+
+
+def _off(*args):
+    pass
+
+
+# the hooks; enable() points them at a recorder
+mark = flip = block = trial = _off
+enabled = False
+_recorder = None
+
+
+class _Recorder:
+    def __init__(self, capacity, frame_rate):
+        self.rows = np.zeros(capacity, DTYPE)
+        self.n = 0 # frames recorded, including those since overwritten
+        self.frame_rate = frame_rate
+        self.index = {p: i for i, p in enumerate(PHASES)}
+        self.flip_index = self.index['flip']
+        self.acc = [0.0] * len(PHASES)
+        self.gc_ms = 0.0
+        self.gc_count = 0
+        self._gc_start = None
+        self.blocks = {}
+        self.block_id = -1
+        self.trial = -1
+        self.t0 = time.perf_counter()
+        self.block('')
+
+    def mark(self, phase):
+        """The time since the previous hook was spent in phase."""
+        now = time.perf_counter()
+        self.acc[self.index[phase]] += now - self.last
+        self.last = now
+
+    def flip(self):
+        """Call right after win.flip(): closes the frame's row."""
+        now = time.perf_counter()
+        acc = self.acc
+        acc[self.flip_index] += now - self.last
+        interval = (now - self.last_flip) * 1000 if self.last_flip is not None else np.nan
+        self.rows[self.n % len(self.rows)] = (now - self.t0, interval, *[a * 1000 for a in acc], self.gc_ms,
+                                              min(self.gc_count, 255), self.block_id, self.trial)
+        self.n += 1
+        self.acc = [0.0] * len(PHASES)
+        self.gc_ms, self.gc_count = 0.0, 0
+        self.last = self.last_flip = now
+
+    def block(self, label):
+        """Label the frames that follow, and start timing afresh."""
+        self.block_id = self.blocks.setdefault(str(label), len(self.blocks))
+        self.trial = -1
+        self.acc = [0.0] * len(PHASES)
+        self.gc_ms, self.gc_count = 0.0, 0
+        self.last = time.perf_counter()
+        self.last_flip = None
+
+    def set_trial(self, index):
+        self.trial = index
+
+    def gc_callback(self, phase, info):
+        if phase == 'start':
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            self.gc_ms += (time.perf_counter() - self._gc_start) * 1000
+            self.gc_count += 1
+            self._gc_start = None
+
+    def data(self):
+        """The frames kept, oldest first."""
+        cap = len(self.rows)
+        if self.n <= cap:
+            return self.rows[:self.n]
+        i = self.n % cap
+        return np.concatenate([self.rows[i:], self.rows[:i]])
+
+
+def enable(frame_rate=None, capacity=CAPACITY):
+    """Start recording. Pass the refresh rate when every frame is flipped (frame-locked loops) to get late frames."""
+    global mark, flip, block, trial, enabled, _recorder
+    if enabled:
+        disable()
+    _recorder = _Recorder(capacity, frame_rate)
+    gc.callbacks.append(_recorder.gc_callback)
+    mark, flip, block, trial = _recorder.mark, _recorder.flip, _recorder.block, _recorder.set_trial
+    enabled = True
+
+
+def disable():
+    global mark, flip, block, trial, enabled
+    if _recorder is not None and _recorder.gc_callback in gc.callbacks:
+        gc.callbacks.remove(_recorder.gc_callback)
+    mark = flip = block = trial = _off
+    enabled = False
+
+
+def frames_path(data_file):
+    """Where a session's frames go: <session>.csv -> <session>_<time>.frames.npz."""
+    return f'{os.path.splitext(data_file)[0]}_{time.strftime("%Y%m%d-%H%M%S")}.frames.npz'
+
+
+def save(path):
+    """Write the recorded frames as one compressed column per field, plus their metadata."""
+    rec = _recorder
+    rows = rec.data()
+    meta = {'phases': PHASES, 'blocks': sorted(rec.blocks, key=rec.blocks.get), 'frame_rate': rec.frame_rate,
+            'frames_recorded': rec.n, 'frames_kept': len(rows), 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+    np.savez_compressed(path, meta=np.array(json.dumps(meta)), **{name: rows[name] for name in DTYPE.names})
+    return path
+
+
+def load(path):
+    """(rows, meta) from a file written by save()."""
+    with np.load(path) as f:
+        meta = json.loads(str(f['meta']))
+        rows = np.zeros(len(f['t']), DTYPE)
+        for name in DTYPE.names:
+            rows[name] = f[name]
+    return rows, meta
+
+
+def _cause(row, period_ms=None):
+    """What made a frame slow: the GC, the busiest phase, or (a late frame with little work in it) the flip itself."""
+    busy = {p: float(row[f'{p}_ms']) for p in BUSY}
+    total = sum(busy.values())
+    if row['gc_ms'] >= 0.5 * total and row['gc_ms'] > 0:
+        return 'gc'
+    if period_ms is not None and total < 0.5 * period_ms:
+        return 'flip'
+    return max(busy, key=busy.get)
+
+
+def summarize(rows, meta, n_slowest=N_SLOWEST):
+    """Per-phase timing, flip intervals, GC pauses, late frames and the n_slowest busiest frames."""
+    busy = sum(rows[f'{p}_ms'].astype(np.float64) for p in BUSY)
+    intervals = rows['interval_ms'][np.isfinite(rows['interval_ms'])]
+    pct = lambda x, q: round(float(np.percentile(x, q)), 3) if len(x) else None
+    out = {'frames': len(rows), 'frames_recorded': meta['frames_recorded'],
+           'phases_ms': {p: {'median': pct(rows[f'{p}_ms'], 50), 'p99': pct(rows[f'{p}_ms'], 99),
+                             'max': pct(rows[f'{p}_ms'], 100), 'total': round(float(rows[f'{p}_ms'].sum()), 1)}
+                         for p in PHASES},
+           'interval_ms': {'median': pct(intervals, 50), 'p99': pct(intervals, 99), 'max': pct(intervals, 100)},
+           'gc': {'pauses': int(rows['gc_count'].sum()), 'total_ms': round(float(rows['gc_ms'].sum()), 2),
+                  'max_ms': pct(rows['gc_ms'], 100)}}
+    blocks = meta['blocks']
+    describe = lambda i, cause: {'frame': int(i), 't': round(float(rows['t'][i]), 3),
+                                 'block': blocks[rows['block'][i]] if rows['block'][i] >= 0 else '',
+                                 'trial': int(rows['trial'][i]), 'interval_ms': round(float(rows['interval_ms'][i]), 2),
+                                 'busy_ms': round(float(busy[i]), 2), 'gc_ms': round(float(rows['gc_ms'][i]), 2),
+                                 **{f'{p}_ms': round(float(rows[f'{p}_ms'][i]), 2) for p in BUSY}, 'cause': cause}
+    period = 1000 / meta['frame_rate'] if meta.get('frame_rate') else None
+    if period is not None:
+        late = np.flatnonzero(rows['interval_ms'] > LATE * period)
+        causes = [_cause(rows[i], period) for i in late]
+        out['late'] = {'period_ms': round(period, 3), 'frames': len(late),
+                       'by_cause': {c: causes.count(c) for c in sorted(set(causes))}}
+    slowest = np.argsort(busy)[::-1][:n_slowest]
+    out['slowest'] = [describe(i, _cause(rows[i])) for i in slowest]
+    return out
+
+
+def report(summary):
+    """Print a summary from summarize()."""
+    print(f'[telemetry] {summary["frames"]} frames ({summary["frames_recorded"]} recorded); '
+          f'flip interval median {summary["interval_ms"]["median"]} ms, p99 {summary["interval_ms"]["p99"]} ms, '
+          f'max {summary["interval_ms"]["max"]} ms')
+    for phase, s in summary['phases_ms'].items():
+        print(f'[telemetry]   {phase:<6} median {s["median"]} ms, p99 {s["p99"]} ms, max {s["max"]} ms, '
+              f'total {s["total"]} ms')
+    g = summary['gc']
+    print(f'[telemetry] GC: {g["pauses"]} pauses, {g["total_ms"]} ms in all, longest {g["max_ms"]} ms')
+    if 'late' in summary:
+        late = summary['late']
+        print(f'[telemetry] late frames (> {LATE} x {late["period_ms"]} ms): {late["frames"]}'
+              + (f' ({", ".join(f"{c} {n}" for c, n in late["by_cause"].items())})' if late['frames'] else ''))
+    print('[telemetry] slowest frames (work done before the flip):')
+    for f in summary['slowest']:
+        print(f'[telemetry]   frame {f["frame"]} at {f["t"]}s, {f["block"] or "-"} trial {f["trial"]}: '
+              f'{f["busy_ms"]} ms busy (' + ', '.join(f'{p} {f[f"{p}_ms"]}' for p in BUSY) +
+              f', gc {f["gc_ms"]}); interval {f["interval_ms"]} ms -> {f["cause"]}')
+
+
+def finish(data_file):
+    """Save this session's frames next to data_file, print the summary and stop recording; returns the path."""
+    if not enabled:
+        return None
+    path = save(frames_path(data_file))
+    rows, meta = load(path)
+    report(summarize(rows, meta))
+    print(f'[telemetry] frames saved to {path}')
+    disable()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the per-frame telemetry of a session.')
+    parser.add_argument('command', choices=['report'])
+    parser.add_argument('path', help='a .frames.npz file')
+    parser.add_argument('--slowest', type=int, default=N_SLOWEST)
+    parser.add_argument('--json', default=None, help='also write the summary here')
+    args = parser.parse_args()
+
+    rows, meta = load(args.path)
+    summary = summarize(rows, meta, args.slowest)
+    report(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
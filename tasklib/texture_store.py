@@ -0,0 +1,192 @@
+"""Pre-decoded, display-sized stimulus images in memory-mapped arrays.
+
+Build once (and again whenever stimuli change; unchanged images are not
+re-decoded):
+
+    python -m tasklib.texture_store build _stimuli --out _stimuli/_store --px 540
+
+Each image folder (faces, scenes, objects) becomes one uint8 array of shape
+(n_images, px, px, channels) plus an entry in manifest.json with every image's
+row and content hash. Images are resized to px x px, which is what PsychoPy
+does anyway with the square size=(0.5, 0.5) / size=0.4 stimuli; pick px as the
+stimulus height in screen pixels (e.g. 0.5 * 1080). Tasks open the store with
+TextureStore and get PIL images that point straight into the mapped file, so
+there is no JPEG decoding at runtime and the pages are shared between
+processes.
+"""
+import argparse, hashlib, json, os, time
+import numpy as np
+
+MANIFEST = 'manifest.json'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+CHANNELS = {'L': 1, 'RGB': 3, 'RGBA': 4}
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _decode(path, px, mode):
+    from PIL import Image
+
+    img = Image.open(path).convert(mode)
+    img = img.resize((px, px), Image.LANCZOS)
+    return np.asarray(img, dtype=np.uint8).reshape(px, px, CHANNELS[mode])
+
+
+def _load_manifest(out_dir):
+    path = os.path.join(out_dir, MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+def build_set(src_dir, out_dir, name, px, mode, old=None):
+    """Build or update one image folder's array; returns (manifest entry, n_decoded)."""
+    files = sorted(f for f in os.listdir(src_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+    hashes = {f: file_hash(os.path.join(src_dir, f)) for f in files}
+    shape = (len(files), px, px, CHANNELS[mode])
+    data_file = f'{name}.u8'
+    path = os.path.join(out_dir, data_file)
+
+    reusable = old is not None and old['shape'][1:] == list(shape[1:]) and os.path.isfile(path)
+    old_items = old['items'] if reusable else {}
+    in_place = reusable and list(old_items) == files
+    if in_place: # same images in the same rows: rewrite only the changed rows
+        arr = np.memmap(path, dtype=np.uint8, mode='r+', shape=shape)
+        src = arr
+    else:
+        src = np.memmap(path, dtype=np.uint8, mode='r', shape=tuple(old['shape'])) if reusable else None
+        arr = np.memmap(path + '.tmp', dtype=np.uint8, mode='w+', shape=shape)
+
+    n_decoded = 0
+    items = {}
+    for row, f in enumerate(files):
+        prev = old_items.get(f)
+        if prev is not None and prev['sha1'] == hashes[f]:
+            if not in_place:
+                arr[row] = src[prev['row']]
+        else:
+            arr[row] = _decode(os.path.join(src_dir, f), px, mode)
+            n_decoded += 1
+        items[f] = {'row': row, 'sha1': hashes[f]}
+    arr.flush()
+    del arr, src
+    if not in_place:
+        os.replace(path + '.tmp', path)
+    return {'file': data_file, 'shape': list(shape), 'items': items}, n_decoded
+
+
+def build_store(src_root, out_dir, px=512, mode='RGB', sets=None):
+    """Build/update the store for every image folder under src_root; returns {set: n_decoded}."""
+    if mode not in CHANNELS:
+        raise ValueError(f'mode must be one of {sorted(CHANNELS)}')
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = _load_manifest(out_dir) or {}
+    if manifest.get('px') != px or manifest.get('mode') != mode:
+        manifest = {'px': px, 'mode': mode, 'sets': {}}
+    if sets is None:
+        sets = sorted(d for d in os.listdir(src_root)
+                      if os.path.isdir(os.path.join(src_root, d)) and os.path.abspath(os.path.join(src_root, d)) != os.path.abspath(out_dir))
+    decoded = {}
+    for name in sets:
+        if not any(f.lower().endswith(IMAGE_EXTENSIONS) for f in os.listdir(os.path.join(src_root, name))):
+            continue
+        entry, decoded[name] = build_set(os.path.join(src_root, name), out_dir, name, px, mode, manifest['sets'].get(name))
+        manifest['sets'][name] = entry
+        _write_json(os.path.join(out_dir, MANIFEST), manifest) # after each set, so an interrupted build keeps its progress
+    return decoded
+
+
+class TextureStore:
+    """Read-only view of a built store; look images up by their original path (e.g. '_stimuli/faces/3.jpg')."""
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.manifest = _load_manifest(store_dir)
+        if self.manifest is None:
+            raise FileNotFoundError(f'no texture store in {store_dir} (run: python -m tasklib.texture_store build)')
+        self.px = self.manifest['px']
+        self.mode = self.manifest['mode']
+        self._arrays = {}
+
+    @classmethod
+    def open(cls, store_dir):
+        """The store in store_dir, or None if it hasn't been built (tasks then decode JPEGs as before)."""
+        if store_dir and os.path.isfile(os.path.join(store_dir, MANIFEST)):
+            return cls(store_dir)
+        return None
+
+    def _array(self, name):
+        if name not in self._arrays:
+            entry = self.manifest['sets'][name]
+            self._arrays[name] = np.memmap(os.path.join(self.store_dir, entry['file']), dtype=np.uint8,
+                                           mode='r', shape=tuple(entry['shape']))
+        return self._arrays[name]
+
+    def _locate(self, path):
+        folder, filename = os.path.split(os.path.normpath(path))
+        name = os.path.basename(folder)
+        entry = self.manifest['sets'].get(name)
+        if entry is None or filename not in entry['items']:
+            return None
+        return name, entry['items'][filename]['row']
+
+    def __contains__(self, path):
+        return self._locate(path) is not None
+
+    def array(self, path):
+        """(px, px, channels) uint8 view into the mapped file (no copy)."""
+        name, row = self._locate(path)
+        return self._array(name)[row]
+
+    def image(self, path):
+        """PIL image sharing the mapped memory (no decode, no copy)."""
+        from PIL import Image
+
+        arr = self.array(path)
+        return Image.frombuffer(self.mode, (self.px, self.px), arr, 'raw', self.mode, 0, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or inspect the memory-mapped stimulus texture store.')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    build = sub.add_parser('build', help='decode and resize every image folder under SRC (only changed images)')
+    build.add_argument('src', help='stimulus root, e.g. _stimuli')
+    build.add_argument('--out', default=None, help='store directory (default: SRC/_store)')
+    build.add_argument('--px', type=int, default=512, help='side of the square texture in pixels')
+    build.add_argument('--mode', default='RGB', choices=sorted(CHANNELS))
+    build.add_argument('--sets', nargs='*', default=None, help='folders to include (default: all)')
+    info = sub.add_parser('info', help='summarize a built store')
+    info.add_argument('store')
+    args = parser.parse_args()
+
+    if args.cmd == 'build':
+        out = args.out or os.path.join(args.src, '_store')
+        start = time.perf_counter()
+        decoded = build_store(args.src, out, args.px, args.mode, args.sets)
+        store = TextureStore(out)
+        for name, n in decoded.items():
+            print(f"{name}: {len(store.manifest['sets'][name]['items'])} images, {n} decoded")
+        print(f'{out}: built in {time.perf_counter() - start:.2f}s')
+    else:
+        store = TextureStore(args.store)
+        for name, entry in store.manifest['sets'].items():
+            size = os.path.getsize(os.path.join(args.store, entry['file'])) / 1024 / 1024
+            print(f"{name}: {entry['shape'][0]} x {store.px}px {store.mode}, {size:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
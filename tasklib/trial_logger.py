@@ -0,0 +1,151 @@
+"""Streaming, crash-safe CSV trial logger.
+
+Rows are appended by a background thread as soon as they are logged, so a crash
+loses at most the rows still in the queue, and nothing is ever rewritten.
+A file left with a torn last line by a crash can be repaired with
+
+    python -m tasklib.trial_logger recover _data/nback/sub01.csv
+"""
+import argparse, atexit, csv, os, queue, threading
+
+_FLUSH = object()
+_STOP = object()
+
+
+def recover(path):
+    """Trim a torn (unterminated) last line left by a crash; returns the number of complete data rows."""
+    if not os.path.isfile(path):
+        return 0
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    return max(0, data[:end].count(b'\n') - 1)
+
+
+def read_header(path):
+    """The column names in path's first line, or None if it is missing or empty."""
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, newline='') as f:
+        return next(csv.reader(f), None)
+
+
+class TrialLogger:
+    """Appends dict rows to a CSV file from a background thread.
+
+    log() never blocks: rows go on a bounded queue and, if the writer falls behind,
+    into a spill list that is handed over on the next call. Rows reach the OS as soon
+    as the writer drains the queue; flush() additionally fsyncs and should be called
+    at block boundaries, never inside the frame loop. An existing file is appended
+    to (after repairing a torn last line) and gets a header only if it is empty; one
+    whose header is not fieldnames is refused, rather than mixing two column layouts.
+
+    With atomic=True, rows go to path + '.part', which is renamed to path on
+    close(), so other readers only ever see a finished file. A session that ends
+    any other way (ESC, an exception) is only flushed at exit and keeps its .part.
+    """
+
+    def __init__(self, path, fieldnames, max_queue=10000, atomic=False):
+        self.final_path = path if atomic else None
+        if atomic:
+            path += '.part'
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.n_logged = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill = []
+        self._error = None
+        self._closed = False
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        recover(path)
+        header = read_header(path)
+        if header is not None and header != self.fieldnames:
+            raise ValueError(f'{path} has columns {header}, not {self.fieldnames}; write to a new file')
+        self._file = open(path, 'a', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=self.fieldnames, restval='', extrasaction='ignore')
+        if self._file.tell() == 0:
+            self._writer.writeheader()
+            self._file.flush()
+
+        self._thread = threading.Thread(target=self._run, name='TrialLogger', daemon=True)
+        self._thread.start()
+        atexit.register(self._at_exit)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                if isinstance(item, threading.Event):
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    item.set()
+                else:
+                    self._writer.writerow(item)
+                    if self._queue.empty():
+                        self._file.flush()
+            except Exception as e: # surfaced on the next flush()/close()
+                self._error = e
+                if isinstance(item, threading.Event):
+                    item.set()
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def log(self, row):
+        """Queue one row for writing; never blocks."""
+        if self._closed:
+            raise ValueError(f'logger for {self.path} is closed')
+        self.n_logged += 1
+        self._spill.append(dict(row))
+        while self._spill and self._put(self._spill[0]):
+            self._spill.pop(0)
+
+    def flush(self, timeout=None):
+        """Write everything logged so far and fsync it. Blocks; call between blocks."""
+        for row in self._spill:
+            self._queue.put(row)
+        self._spill = []
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+        if self._error is not None:
+            raise self._error
+
+    def close(self, finished=True):
+        """Write and fsync everything, then (if finished and atomic) rename the .part file to its final name."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._file.close()
+        if finished and self.final_path is not None:
+            os.replace(self.path, self.final_path)
+        atexit.unregister(self._at_exit)
+
+    def _at_exit(self):
+        self.close(finished=False) # never closed explicitly: the session did not finish
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Repair a CSV data file left partial by a crash.')
+    parser.add_argument('command', choices=['recover'])
+    parser.add_argument('path')
+    args = parser.parse_args()
+    print(f'{args.path}: {recover(args.path)} complete rows')
+
+
+if __name__ == '__main__':
+    main()
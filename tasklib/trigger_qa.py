@@ -0,0 +1,212 @@
+"""Scanner-trigger timing QA.
+
+Live: TriggerMonitor checks each trigger as it arrives and warns about missed or
+doubled triggers and clock drift while the run is still going.
+
+After the session:
+
+    python -m tasklib.trigger_qa _data/nback_mri/<session>.csv --tr 2.0 --out <session>_scanner.csv --events-dir events/
+
+fits each run's trigger train to a TR grid, reports drift/missed/doubled triggers
+and onset/RT distributions, and re-expresses every trial onset in scanner time
+(seconds from the run's first volume) for the GLM.
+"""
+import argparse, csv, os
+import numpy as np
+
+DOUBLED_FRACTION = 0.5 # triggers closer than this * TR count as doubled
+DRIFT_WARN_PPM = 200
+JITTER_WARN_MS = 5.0
+
+
+def fit_triggers(times, tr):
+    """Fit trigger times (stimulus clock, s) to a TR grid.
+
+    Returns a dict with the fitted grid (t = offset + volume * tr_est), clock drift
+    in ppm relative to the nominal TR, residual jitter, and the missed/doubled
+    triggers found along the way.
+    """
+    times = np.sort(np.asarray(times, dtype=float))
+    if times.size < 2:
+        raise ValueError('need at least two triggers to fit a TR grid')
+    doubled = np.diff(times) < DOUBLED_FRACTION * tr
+    t = times[np.r_[True, ~doubled]]
+    steps = np.maximum(1, np.round(np.diff(t) / tr)).astype(int)
+    volumes = np.r_[0, np.cumsum(steps)]
+    tr_est, offset = np.polyfit(volumes, t, 1)
+    resid = t - (offset + tr_est * volumes)
+    return {
+        'n_triggers': int(times.size),
+        'n_volumes': int(volumes[-1] + 1),
+        'n_doubled': int(doubled.sum()),
+        'doubled_at': times[1:][doubled].tolist(),
+        'n_missed': int((steps - 1).sum()),
+        'missed_volumes': [int(v) for s, v0 in zip(steps, volumes[:-1]) if s > 1 for v in range(v0 + 1, v0 + s)],
+        'tr_est': float(tr_est),
+        'offset': float(offset),
+        'drift_ppm': float((tr_est / tr - 1) * 1e6),
+        'jitter_ms': float(resid.std() * 1000),
+        'max_resid_ms': float(np.abs(resid).max() * 1000),
+    }
+
+
+def to_scanner_time(t, fit, tr):
+    """Stimulus-clock times -> seconds since the first volume, on the scanner's clock."""
+    return (np.asarray(t, dtype=float) - fit['offset']) / fit['tr_est'] * tr
+
+
+def describe(values, scale=1.0):
+    """n / mean / sd / median / p5 / p95 / max of the finite values (scaled)."""
+    v = np.asarray(values, dtype=float) * scale
+    v = v[np.isfinite(v)]
+    if v.size == 0:
+        return {'n': 0}
+    p5, p50, p95 = np.percentile(v, [5, 50, 95])
+    return {'n': int(v.size), 'mean': float(v.mean()), 'sd': float(v.std()), 'median': float(p50),
+            'p5': float(p5), 'p95': float(p95), 'max': float(v.max())}
+
+
+class TriggerMonitor:
+    """Incremental trigger checks for one run; add() returns any warnings for that trigger."""
+
+    def __init__(self, tr, min_fit=30):
+        self.tr = tr
+        self.min_fit = min_fit
+        self.times = []
+        self.volume = 0
+        self.n_missed = 0
+        self.n_doubled = 0
+        self._drift_warned = False
+        # running sums for the least-squares grid fit (t relative to the first trigger)
+        self._s = np.zeros(5) # n, sum k, sum t, sum k^2, sum k*t
+
+    def add(self, t):
+        issues = []
+        if self.times:
+            dt = t - self.times[-1]
+            if dt < DOUBLED_FRACTION * self.tr:
+                self.n_doubled += 1
+                return [f'doubled trigger {dt * 1000:.0f} ms after the previous one']
+            step = max(1, int(round(dt / self.tr)))
+            if step > 1:
+                self.n_missed += step - 1
+                issues.append(f'{step - 1} missed trigger(s) before volume {self.volume + step}')
+            self.volume += step
+        self.times.append(t)
+        k, rel = self.volume, t - self.times[0]
+        self._s += (1, k, rel, k * k, k * rel)
+
+        fit = self.fit()
+        if fit and not self._drift_warned and abs(fit['drift_ppm']) > DRIFT_WARN_PPM:
+            self._drift_warned = True
+            issues.append(f"clock drift {fit['drift_ppm']:+.0f} ppm (TR measured as {fit['tr_est'] * 1000:.2f} ms)")
+        return issues
+
+    def fit(self):
+        """Current grid estimate, or None before min_fit triggers."""
+        n, sk, st, skk, skt = self._s
+        if n < self.min_fit:
+            return None
+        tr_est = (n * skt - sk * st) / (n * skk - sk * sk)
+        return {'tr_est': tr_est, 'offset': self.times[0] + (st - tr_est * sk) / n,
+                'drift_ppm': (tr_est / self.tr - 1) * 1e6}
+
+    def summary(self):
+        if len(self.times) < 2:
+            return {'n_triggers': len(self.times)}
+        return fit_triggers(self.times, self.tr)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def split_runs(rows):
+    """Group logged rows into runs; each 'run_start' row begins a new one."""
+    runs = []
+    for row in rows:
+        if row.get('event_type') == 'run_start' or not runs:
+            runs.append([])
+        runs[-1].append(row)
+    return runs
+
+
+def analyze_run(rows, tr):
+    """Fit one run's triggers and add scanner-time onsets to its trial rows."""
+    trigger_times = [_float(r['timestamp']) for r in rows if r.get('event_type') in ('run_start', 'trigger')]
+    fit = fit_triggers(trigger_times, tr)
+    trials = [r for r in rows if r.get('event_type') == 'trial']
+    onsets = np.array([_float(r.get('actual_onset')) if r.get('actual_onset') not in (None, '') else _float(r['timestamp'])
+                       for r in trials])
+    scanner = to_scanner_time(onsets, fit, tr)
+    for r, s in zip(trials, scanner):
+        r['scanner_onset'] = round(float(s), 4)
+        r['scanner_volume'] = round(float(s / tr), 4)
+    onset_error = [_float(r.get('actual_onset')) - _float(r.get('intended_onset')) for r in trials]
+    # TR-locked trials should all land at the same phase of the volume
+    phase = (scanner / tr - np.round(scanner / tr)) * tr
+    return fit, {
+        'onset_error_ms': describe(onset_error, 1000),
+        'onset_phase_ms': describe(phase, 1000),
+        'dropped_frames': int(np.nansum([_float(r.get('dropped_frames')) for r in trials])),
+        'resp_rt_ms': describe([_float(r.get('resp_rt')) for r in trials], 1000),
+    }
+
+
+def write_events(trials, path, duration):
+    """BIDS-style events.tsv with scanner-time onsets."""
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['onset', 'duration', 'trial_type', 'is_target', 'resp_rt'])
+        for r in trials:
+            writer.writerow([r['scanner_onset'], duration, f"{r['n']}back_{r['stim_type']}", r['is_target'], r.get('resp_rt', '')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Trigger timing QA for nback_mri.py data files.')
+    parser.add_argument('data_file')
+    parser.add_argument('--tr', type=float, default=2.0)
+    parser.add_argument('--out', help='write the data file again with scanner_onset/scanner_volume columns')
+    parser.add_argument('--events-dir', help='write one events.tsv per run with scanner-time onsets')
+    parser.add_argument('--duration', type=float, default=1.5, help='event duration for --events-dir')
+    args = parser.parse_args()
+
+    with open(args.data_file, newline='') as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames + ['scanner_onset', 'scanner_volume']
+        rows = list(reader)
+
+    for i, run in enumerate(split_runs(rows)):
+        label = f"segment {i + 1} (run {run[0].get('run', '?')})"
+        try:
+            fit, stats = analyze_run(run, args.tr)
+        except ValueError as e:
+            print(f'{label}: {e}')
+            continue
+        print(f"{label}: {fit['n_triggers']} triggers / {fit['n_volumes']} volumes, "
+              f"TR {fit['tr_est'] * 1000:.3f} ms, drift {fit['drift_ppm']:+.1f} ppm, jitter {fit['jitter_ms']:.2f} ms, "
+              f"missed {fit['n_missed']} {fit['missed_volumes'] or ''}, doubled {fit['n_doubled']}")
+        if abs(fit['drift_ppm']) > DRIFT_WARN_PPM or fit['jitter_ms'] > JITTER_WARN_MS:
+            print('    WARNING: trigger timing outside tolerance')
+        for name, d in stats.items():
+            if isinstance(d, dict) and d.get('n'):
+                print(f"    {name}: n={d['n']} median {d['median']:.1f} (p5 {d['p5']:.1f}, p95 {d['p95']:.1f}, max {d['max']:.1f})")
+            elif not isinstance(d, dict):
+                print(f'    {name}: {d}')
+        if args.events_dir:
+            os.makedirs(args.events_dir, exist_ok=True)
+            trials = [r for r in run if r.get('event_type') == 'trial']
+            write_events(trials, os.path.join(args.events_dir, f"seg-{i + 1}_run-{run[0].get('run', 'x')}_events.tsv"), args.duration)
+
+    if args.out:
+        with open(args.out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, restval='')
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Generate the N-back Builder variants from nback.psyexp and compile experiments to scripts ahead of time.
+
+    python build_variants.py                      # generate, then compile whatever changed
+    python build_variants.py generate             # n_back_variations/*.psyexp only
+    python build_variants.py compile flanker.psyexp srtt.psyexp
+    python build_variants.py launch n_back_variations/nback_faces.psyexp    # compile if stale, then run
+    python build_variants.py launch nback.psyexp --no-cache                 # compile every time, as Runner does
+
+nback.psyexp is the one definition: edit the task there (or the shared
+timing in NBACK below) and regenerate. Each variant only swaps the stimulus
+list and the stimulus component, and drops the end screen.
+
+Compiled scripts are written next to their .psyexp (PsychoPy scripts chdir to
+their own folder, so relative stimulus paths keep working) and recorded in
+COMPILED_MANIFEST under a hash of the .psyexp bytes, the compile target and
+the PsychoPy version. A script is recompiled only when that key changes or
+the script on disk is no longer the one compiled. Compiling needs PsychoPy in
+--python (default: this interpreter).
+"""
+import argparse, hashlib, json, os, re, subprocess, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE = os.path.join(HERE, 'nback.psyexp')
+VARIANT_DIR = os.path.join(HERE, 'n_back_variations')
+COMPILED_MANIFEST = os.path.join(HERE, '.compiled.json')
+
+# shared by every variant (seconds from trial onset)
+NBACK = {
+    'n_reps': 20,
+    'stim_start': 0.1,
+    'stim_duration': 1.0,
+    'response_duration': 1.5,
+}
+
+
+def _image_set(folder, n=61):
+    return (f"# note that the N is set in the first routine\nimport random\nsequence = []\n\n# load image paths\n"
+            f"stim_dir = '../../_stimuli/{folder}'\n"
+            f"all_stimuli = [f'{{stim_dir}}/{{image_id}}.jpg' for image_id in range({n})]",
+            f'import * as random from \'random\';\nsequence = [];\nstim_dir = "../../_stimuli/{folder}";\n'
+            f'all_stimuli = function () {{\n    var _pj_a = [], _pj_b = util.range({n});\n'
+            f'    for (var _pj_c = 0, _pj_d = _pj_b.length; (_pj_c < _pj_d); _pj_c += 1) {{\n'
+            f'        var image_id = _pj_b[_pj_c];\n        _pj_a.push(`${{stim_dir}}/${{image_id}}.jpg`);\n    }}\n'
+            f'    return _pj_a;\n}}\n.call(this);\n')
+
+
+# variant name -> stimulus component kind and (Python, JS) Begin Experiment code of nback_logic
+VARIANTS = {
+    'colors': ('polygon', (
+        "# note that the N is set in the first routine\nimport random\nsequence = []\n"
+        "all_stimuli = ['red','orange','yellow','green','blue','purple']",
+        'import * as random from \'random\';\nsequence = [];\n'
+        'all_stimuli = ["red", "orange", "yellow", "green", "blue", "purple"];\n')),
+    'faces': ('image', _image_set('faces')),
+    'objects': ('image', _image_set('objects')),
+    'scenes': ('image', _image_set('scenes')),
+    'words': ('text', (
+        "# note that the N is set in the first routine\nimport random\nimport numpy as np\nsequence = []\n\n"
+        "# load words\nall_stimuli = np.loadtxt('../../_stimuli/words.txt', dtype=str).tolist()\n"
+        "# just get 60 random ones instead of the whole list\nall_stimuli = random.sample(all_stimuli, 60)",
+        'import * as random from \'random\';\nimport * as np from \'numpy\';\nsequence = [];\n'
+        'all_stimuli = np.loadtxt("../../_stimuli/words.txt", {"dtype": str}).tolist();\n'
+        'all_stimuli = Math.random.sample(all_stimuli, 60);\n')),
+}
+
+# Builder params of the `stim` component: (value, valType, updates); components write them sorted by name
+_STIM_COMMON = {
+    'colorSpace': ('rgb', 'str', 'constant'),
+    'contrast': ('1', 'num', 'constant'),
+    'disabled': ('False', 'bool', 'None'),
+    'draggable': ('False', 'code', 'constant'),
+    'durationEstim': ('', 'code', 'None'),
+    'name': ('stim', 'code', 'None'),
+    'opacity': ('', 'num', 'constant'),
+    'ori': ('0', 'num', 'constant'),
+    'pos': ('(0, 0)', 'list', 'constant'),
+    'saveStartStop': ('True', 'bool', 'None'),
+    'startEstim': ('', 'code', 'None'),
+    'startType': ('time (s)', 'str', 'None'),
+    'stopType': ('duration (s)', 'str', 'None'),
+    'syncScreenRefresh': ('True', 'bool', 'None'),
+    'units': ('from exp settings', 'str', 'None'),
+    'validator': ('', 'code', 'None'),
+}
+_STIM_KINDS = {
+    'text': ('TextComponent', {
+        'color': ('white', 'color', 'constant'),
+        'flip': ('None', 'str', 'constant'),
+        'font': ('Arial', 'str', 'constant'),
+        'languageStyle': ('LTR', 'str', 'None'),
+        'letterHeight': ('0.05', 'num', 'constant'),
+        'text': ('$curr_stim', 'str', 'set every repeat'),
+        'wrapWidth': ('', 'num', 'constant'),
+    }),
+    'image': ('ImageComponent', {
+        'anchor': ('center', 'str', 'constant'),
+        'color': ('$[1,1,1]', 'color', 'constant'),
+        'flipHoriz': ('False', 'bool', 'constant'),
+        'flipVert': ('False', 'bool', 'constant'),
+        'image': ('$curr_stim', 'file', 'set every repeat'),
+        'interpolate': ('linear', 'str', 'constant'),
+        'mask': ('', 'str', 'constant'),
+        'size': ('(0.5, 0.5)', 'list', 'constant'),
+        'texture resolution': ('128', 'num', 'constant'),
+    }),
+    'polygon': ('PolygonComponent', {
+        'anchor': ('center', 'str', 'constant'),
+        'fillColor': ('$curr_stim', 'color', 'set every repeat'),
+        'interpolate': ('linear', 'str', 'constant'),
+        'lineColor': ('$curr_stim', 'color', 'set every repeat'),
+        'lineWidth': ('1', 'num', 'constant'),
+        'nVertices': ('4', 'int', 'constant'),
+        'shape': ('rectangle', 'str', 'None'),
+        'size': ('(0.5, 0.5)', 'list', 'constant'),
+        'vertices': ('', 'list', 'constant'),
+    }),
+}
+
+
+def _attr(value):
+    """A value as Builder writes it in an attribute (newlines double-escaped, as PsychoPy does)."""
+    value = value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+    return value.replace('\n', '&amp;#10;')
+
+
+def _param(name, value, val_type, updates):
+    return f'        <Param val="{_attr(value)}" valType="{val_type}" updates="{updates}" name="{name}"/>\n'
+
+
+def stim_component(kind, params):
+    tag, extra = _STIM_KINDS[kind]
+    values = dict(_STIM_COMMON, **extra,
+                  startVal=(f'{params["stim_start"]}', 'code', 'None'),
+                  stopVal=(f'{params["stim_duration"]}', 'code', 'constant'))
+    body = ''.join(_param(name, *values[name]) for name in sorted(values))
+    return f'      <{tag} name="stim" plugin="None">\n{body}      </{tag}>\n'
+
+
+def _sub_once(pattern, repl, text, what):
+    text, n = re.subn(pattern, repl, text, count=1, flags=re.S)
+    if n != 1:
+        raise ValueError(f'{TEMPLATE}: could not find {what}; was nback.psyexp restructured?')
+    return text
+
+
+def _set_param(block, name, value):
+    """Set the val of Param `name` in a block of Builder XML (the first one, if several)."""
+    return re.sub(rf'<Param val="[^"]*"( [^>]*name="{re.escape(name)}"/>)',
+                  lambda m: f'<Param val="{_attr(value)}"{m[1]}', block, count=1)
+
+
+def _component(xml, tag, name):
+    block = re.search(rf'      <{tag} name="{name}" .*?</{tag}>\n', xml, re.S)
+    if block is None:
+        raise ValueError(f'{TEMPLATE}: no {tag} {name}; was nback.psyexp restructured?')
+    return block[0]
+
+
+def variant_xml(template, kind, code, params=NBACK):
+    """The .psyexp text of one variant: template with its stimuli, stim component and shared timing, no end screen."""
+    py, js = code
+    logic = _component(template, 'CodeComponent', 'nback_logic')
+    xml = template.replace(logic, _set_param(_set_param(logic, 'Begin Experiment', py), 'Begin JS Experiment', js))
+    xml = xml.replace(_component(xml, 'TextComponent', 'stim'), stim_component(kind, params))
+    resp = _component(xml, 'KeyboardComponent', 'key_resp')
+    timed = resp
+    for name, value in (('durationEstim', params['response_duration']), ('startVal', params['stim_start']),
+                        ('stopVal', params['response_duration'])):
+        timed = _set_param(timed, name, f'{value}')
+    xml = xml.replace(resp, timed)
+    xml = _sub_once(r'(<Param name="nReps" updates="None" val=")[^"]*"', rf'\g<1>{params["n_reps"]}"', xml,
+                    'the trials loop')
+    # variants end with the trials loop, and keep only the routines their flow runs
+    xml = _sub_once(r'    <Routine name="end"/>\n', '', xml, 'the end routine in the flow')
+    flow = set(re.findall(r'    <Routine name="([^"]+)"/>', xml))
+    return re.sub(r'    <Routine name="([^"]+)">\n.*?\n    </Routine>\n', lambda m: m[0] if m[1] in flow else '', xml,
+                  flags=re.S)
+
+
+def generate(params=NBACK):
+    """Write n_back_variations/nback_<name>.psyexp for every variant, leaving unchanged files alone; returns those written."""
+    with open(TEMPLATE, encoding='utf-8', newline='') as f:
+        template = f.read()
+    written = []
+    for name, (kind, code) in VARIANTS.items():
+        path = os.path.join(VARIANT_DIR, f'nback_{name}.psyexp')
+        xml = variant_xml(template, kind, code, params)
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8', newline='') as f:
+                if f.read() == xml:
+                    continue
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(xml)
+        written.append(path)
+    print(f'generate: {len(written)} of {len(VARIANTS)} variant(s) changed')
+    return written
+
+
+def experiments():
+    """Every .psyexp in this folder and below."""
+    found = []
+    for root, _, names in os.walk(HERE):
+        found += [os.path.join(root, n) for n in names if n.endswith('.psyexp')]
+    return sorted(found)
+
+
+def psychopy_version(python):
+    """The PsychoPy version `python` would compile with (part of the cache key)."""
+    if os.path.abspath(python) == os.path.abspath(sys.executable):
+        from importlib.metadata import PackageNotFoundError, version
+        try:
+            return version('psychopy')
+        except PackageNotFoundError:
+            pass
+    else:
+        out = subprocess.run([python, '-c', 'from importlib.metadata import version; print(version("psychopy"))'],
+                             capture_output=True, text=True)
+        if out.returncode == 0:
+            return out.stdout.strip()
+    raise RuntimeError(f'PsychoPy is not installed for {python}; pass --python with the PsychoPy interpreter')
+
+
+def cache_key(psyexp, version, target='python'):
+    h = hashlib.sha256()
+    with open(psyexp, 'rb') as f:
+        h.update(f.read())
+    h.update(json.dumps({'target': target, 'psychopy': version}, sort_keys=True).encode())
+    return h.hexdigest()[:16]
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def read_manifest():
+    if os.path.isfile(COMPILED_MANIFEST):
+        with open(COMPILED_MANIFEST) as f:
+            return json.load(f)
+    return {}
+
+
+def write_manifest(manifest):
+    tmp = COMPILED_MANIFEST + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, COMPILED_MANIFEST)
+
+
+def compile_cached(psyexp, python, version, manifest, force=False):
+    """Compile psyexp to <name>.py beside it unless the manifest has that script current.
+
+    Returns (script, seconds spent compiling, or None on a cache hit); updates manifest.
+    """
+    rel = os.path.relpath(psyexp, HERE).replace(os.sep, '/')
+    stem = os.path.splitext(psyexp)[0]
+    script = stem + '.py'
+    key = cache_key(psyexp, version)
+    entry = manifest.get(rel)
+    if not force and entry and entry['key'] == key and os.path.isfile(script) and entry['script'] == _stamp(script):
+        return script, None
+    start = time.perf_counter()
+    tmp = stem + '.compiling.py' # a failed or interrupted compile never replaces a working script
+    out = subprocess.run([python, '-m', 'psychopy.scripts.psyexpCompile', psyexp, '--outfile', tmp],
+                         capture_output=True, text=True)
+    if out.returncode != 0 or not os.path.isfile(tmp):
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+        raise RuntimeError(f'compiling {rel} failed:\n{out.stderr.strip()}')
+    os.replace(tmp, script)
+    seconds = time.perf_counter() - start
+    manifest[rel] = {'key': key, 'script': _stamp(script), 'compile_s': round(seconds, 3)}
+    return script, seconds
+
+
+def compile_all(paths, python, force=False):
+    """Compile every stale experiment in paths; returns {path: script}."""
+    start = time.perf_counter()
+    version = psychopy_version(python)
+    manifest = read_manifest()
+    scripts, compiled, compile_s = {}, 0, 0.0
+    for path in paths:
+        scripts[path], seconds = compile_cached(path, python, version, manifest, force)
+        if seconds is not None:
+            write_manifest(manifest) # after each compile, so an interrupted build keeps what it finished
+            compiled += 1
+            compile_s += seconds
+            print(f'compile: {os.path.relpath(path, HERE)} in {seconds:.2f}s')
+    print(f'compile: {compiled} compiled ({compile_s:.2f}s), {len(paths) - compiled} up to date '
+          f'(PsychoPy {version}; {time.perf_counter() - start:.2f}s in all)')
+    return scripts
+
+
+def launch(psyexp, python, use_cache=True):
+    """Run an experiment from its compiled script, compiling first only if it is stale; returns the exit code."""
+    start = time.perf_counter()
+    manifest = read_manifest()
+    script, seconds = compile_cached(psyexp, python, psychopy_version(python), manifest, force=not use_cache)
+    if seconds is not None:
+        write_manifest(manifest)
+    ready = time.perf_counter() - start
+    rel = os.path.relpath(psyexp, HERE).replace(os.sep, '/')
+    if seconds is None:
+        print(f'[launch] {rel}: script ready in {ready:.3f}s from cache (compiling it took {manifest[rel]["compile_s"]:.2f}s)')
+    else:
+        print(f'[launch] {rel}: script ready in {ready:.3f}s, compiled')
+    return subprocess.call([python, script], cwd=os.path.dirname(script))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate the N-back variants and compile Builder experiments.')
+    parser.add_argument('step', nargs='?', default='all', choices=['all', 'generate', 'compile', 'launch'])
+    parser.add_argument('experiments', nargs='*', help='.psyexp files (compile: default all; launch: exactly one)')
+    parser.add_argument('--python', default=sys.executable, help='interpreter with PsychoPy installed')
+    parser.add_argument('--no-cache', action='store_true', help='compile even if the cached script is current')
+    args = parser.parse_args()
+    paths = [os.path.abspath(p) for p in args.experiments]
+
+    if args.step == 'launch':
+        if len(paths) != 1:
+            parser.error('launch takes one .psyexp')
+        raise SystemExit(launch(paths[0], args.python, not args.no_cache))
+    if args.step in ('all', 'generate'):
+        generate()
+    if args.step in ('all', 'compile'):
+        compile_all(paths or experiments(), args.python, args.no_cache)
+
+
+if __name__ == '__main__':
+    main()
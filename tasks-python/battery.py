@@ -0,0 +1,22 @@
+"""Task Battery - runs several tasks back to back in one window"""
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # repo root, for tasklib
+from tasklib.battery import run_battery
+import flanker, nback, paired_associate, srtt # the single-task scripts next to this one
+
+# ===== PARAMETERS =====
+BATTERY = ['flanker', 'nback', 'srtt', 'paired_associate'] # run in this order
+DATA_FILE = './_data/battery.csv' # one file per session in ./_data/battery/; the 'task' column says which task each row is from
+TELEMETRY = False # record per-frame timings by phase, GC pauses and flip intervals next to the session's file (tasklib.telemetry)
+# ======================
+
+# each task is built from its own script's PARAMETERS block, so edits there apply here too
+BATTERY_TASKS = {
+    'flanker': flanker.make_task,
+    'nback': nback.make_task, # N is asked for in the startup dialog
+    'srtt': srtt.make_task,
+    'paired_associate': paired_associate.make_task,
+}
+
+if __name__ == '__main__':
+    run_battery([BATTERY_TASKS[name]() for name in BATTERY], DATA_FILE, record_frames=TELEMETRY)
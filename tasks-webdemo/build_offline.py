@@ -0,0 +1,170 @@
+"""Make the demo pages run from this folder alone: vendored jsPsych, resized stimuli, a service-worker cache.
+
+    python build_offline.py            # everything below (vendor needs network once)
+    python build_offline.py vendor     # download the unpkg scripts in webdemo.js into vendor/
+    python build_offline.py stimuli    # _stimuli/objects -> stimuli/objects, resized for the pages
+    python build_offline.py precache   # list pages, vendor/ and stimuli/ for sw.js
+    python build_offline.py serve --latency-ms 300 --kbps 2000   # localhost server imitating bad Wi-Fi
+    python build_offline.py compare ../_data/web/nback/*.csv     # time to first trial, local vs cdn
+
+vendor/ and stimuli/ are meant to be committed, so a classroom machine needs
+no network at all. Pages load each script from vendor/ if it is listed in
+vendor/vendor.js and from unpkg otherwise (or always, with ?cdn in the URL);
+the committed vendor.js lists nothing until `vendor` has been run once.
+Every page records asset_source, time_to_first_trial_ms (from navigation
+start) and, for image trials, media_latency_ms in its data, so sessions with
+and without ?cdn, cold and with a warm cache, can be compared in the saved
+CSVs with `compare`. Service workers need https or localhost; `serve`
+provides the latter.
+"""
+import argparse, csv, functools, hashlib, http.server, json, os, re, shutil, statistics, time, urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STIMULI_SRC = os.path.join(HERE, '..', '_stimuli')
+VENDOR_DIR = 'vendor'
+STIMULI_DIR = 'stimuli'
+STIM_PX = 600 # longest side; the pages show images in a 300 x 300 CSS px box, 2x for high-DPI screens
+JPEG_QUALITY = 85
+_ASSET = re.compile(r'^\s*"([^"]+)":\s*"(https://[^"]+)",?\s*$', re.M)
+
+
+def assets():
+    """{name: unpkg URL} from WEBDEMO_ASSETS in webdemo.js."""
+    with open(os.path.join(HERE, 'webdemo.js')) as f:
+        return dict(_ASSET.findall(f.read()))
+
+
+def vendor(timeout=30):
+    """Download every asset (following unpkg's redirects to a pinned file) and write vendor/vendor.js."""
+    local = {}
+    for name, url in assets().items():
+        with urllib.request.urlopen(url, timeout=timeout) as resp:
+            final = resp.geturl() # e.g. https://unpkg.com/jspsych@7.3.3/dist/index.browser.min.js
+            data = resp.read()
+        path = f'{VENDOR_DIR}/{urllib.request.urlparse(final).path.lstrip("/")}'
+        os.makedirs(os.path.join(HERE, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(HERE, path), 'wb') as f:
+            f.write(data)
+        local[name] = path
+        print(f'{name:<32}{final}  ({len(data) / 1024:.0f} KB)')
+    with open(os.path.join(HERE, VENDOR_DIR, 'vendor.js'), 'w') as f:
+        f.write('// Written by build_offline.py vendor: local copies of the unpkg assets in webdemo.js\n')
+        f.write(f'window.WEBDEMO_VENDOR = {json.dumps(local, indent=4)};\n')
+
+
+def stimuli():
+    """Resize the object images to STIM_PX and copy the word list; unchanged images are skipped."""
+    from PIL import Image
+
+    src, out = os.path.join(STIMULI_SRC, 'objects'), os.path.join(HERE, STIMULI_DIR, 'objects')
+    os.makedirs(out, exist_ok=True)
+    before = after = written = 0
+    for name in sorted(os.listdir(src)):
+        if not name.lower().endswith('.jpg'):
+            continue
+        path, dest = os.path.join(src, name), os.path.join(out, name)
+        before += os.path.getsize(path)
+        if not os.path.isfile(dest) or os.path.getmtime(dest) < os.path.getmtime(path):
+            img = Image.open(path).convert('RGB')
+            img.thumbnail((STIM_PX, STIM_PX), Image.LANCZOS) # never enlarges
+            img.save(dest, quality=JPEG_QUALITY, optimize=True, progressive=True)
+            written += 1
+        after += os.path.getsize(dest)
+    shutil.copyfile(os.path.join(STIMULI_SRC, 'words.txt'), os.path.join(HERE, STIMULI_DIR, 'words.txt'))
+    print(f'stimuli: {written} image(s) resized; {before / 1024:.0f} KB -> {after / 1024:.0f} KB')
+
+
+def precache():
+    """Write precache.js: every file sw.js caches on install, and a version that changes with their contents."""
+    files = ['./'] + sorted(f for f in os.listdir(HERE) if f.endswith('.html')) + ['webdemo.js']
+    for directory in (VENDOR_DIR, STIMULI_DIR):
+        for root, _, names in os.walk(os.path.join(HERE, directory)):
+            files += sorted(os.path.relpath(os.path.join(root, n), HERE).replace(os.sep, '/') for n in names)
+    h = hashlib.sha1()
+    for f in files[1:]:
+        with open(os.path.join(HERE, f), 'rb') as fh:
+            h.update(f.encode() + fh.read())
+    with open(os.path.join(HERE, 'precache.js'), 'w') as f:
+        f.write('// Written by build_offline.py precache: files sw.js caches on install\n')
+        f.write(f'self.WEBDEMO_PRECACHE = {json.dumps({"version": h.hexdigest()[:12], "files": files}, indent=4)};\n')
+    print(f'precache: {len(files)} files, version {h.hexdigest()[:12]}')
+
+
+def compare(paths):
+    """Median time to first trial and image latency by asset_source; each CSV is one session."""
+    first, media = {}, {}
+    for path in paths:
+        with open(path, newline='') as f:
+            rows = [r for r in csv.DictReader(f) if r.get('time_to_first_trial_ms')]
+        if not rows:
+            continue
+        source = rows[0].get('asset_source') or '?'
+        first.setdefault(source, []).append(float(rows[0]['time_to_first_trial_ms']))
+        media.setdefault(source, []).extend(float(r['media_latency_ms']) for r in rows if r.get('media_latency_ms'))
+    for source in sorted(first):
+        line = f'{source:<6} {len(first[source])} session(s): time to first trial median {statistics.median(first[source]):.0f} ms'
+        if media.get(source):
+            line += f', media latency median {statistics.median(media[source]):.1f} ms'
+        print(line)
+    if not first:
+        print('compare: no rows with time_to_first_trial_ms')
+
+
+class ThrottledHandler(http.server.SimpleHTTPRequestHandler):
+    """Static files with a fixed delay per request and a bandwidth cap, like a crowded classroom network."""
+    latency_s = 0.0
+    bytes_per_s = None
+
+    def end_headers(self):
+        self.send_header('Cache-Control', 'no-cache') # revalidate, so cold/warm differences come from sw.js
+        super().end_headers()
+
+    def copyfile(self, source, outputfile):
+        time.sleep(self.latency_s)
+        while True:
+            chunk = source.read(16 * 1024)
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            if self.bytes_per_s:
+                time.sleep(len(chunk) / self.bytes_per_s)
+
+
+def serve(port=8000, latency_ms=0, kbps=None):
+    ThrottledHandler.latency_s = latency_ms / 1000
+    ThrottledHandler.bytes_per_s = kbps * 1000 / 8 if kbps else None
+    handler = functools.partial(ThrottledHandler, directory=HERE)
+    print(f'http://localhost:{port}/ (latency {latency_ms} ms, {f"{kbps} kbit/s" if kbps else "unthrottled"})')
+    http.server.ThreadingHTTPServer(('localhost', port), handler).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the offline version of the web demos.')
+    parser.add_argument('step', nargs='?', default='all', choices=['all', 'vendor', 'stimuli', 'precache', 'serve', 'compare'])
+    parser.add_argument('files', nargs='*', help='compare: session CSVs saved by the pages')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency-ms', type=float, default=0, help='serve: delay before each response')
+    parser.add_argument('--kbps', type=float, default=None, help='serve: bandwidth cap per response')
+    args = parser.parse_args()
+
+    if args.step == 'serve':
+        serve(args.port, args.latency_ms, args.kbps)
+        return
+    if args.step == 'compare':
+        compare(args.files)
+        return
+    if args.step in ('all', 'vendor'):
+        try:
+            vendor()
+        except OSError as e:
+            if args.step == 'vendor':
+                raise
+            print(f'vendor: skipped ({e}); pages keep loading from unpkg')
+    if args.step in ('all', 'stimuli'):
+        stimuli()
+    if args.step in ('all', 'precache'):
+        precache()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+// Written by build_offline.py precache: files sw.js caches on install
+self.WEBDEMO_PRECACHE = {
+    "version": "0209a8267d45",
+    "files": [
+        "./",
+        "flanker.html",
+        "index.html",
+        "nback.html",
+        "paired_associate.html",
+        "srtt.html",
+        "webdemo.js",
+        "vendor/vendor.js",
+        "stimuli/words.txt",
+        "stimuli/objects/0.jpg",
+        "stimuli/objects/1.jpg",
+        "stimuli/objects/10.jpg",
+        "stimuli/objects/11.jpg",
+        "stimuli/objects/12.jpg",
+        "stimuli/objects/13.jpg",
+        "stimuli/objects/14.jpg",
+        "stimuli/objects/15.jpg",
+        "stimuli/objects/16.jpg",
+        "stimuli/objects/17.jpg",
+        "stimuli/objects/18.jpg",
+        "stimuli/objects/19.jpg",
+        "stimuli/objects/2.jpg",
+        "stimuli/objects/20.jpg",
+        "stimuli/objects/21.jpg",
+        "stimuli/objects/22.jpg",
+        "stimuli/objects/23.jpg",
+        "stimuli/objects/24.jpg",
+        "stimuli/objects/25.jpg",
+        "stimuli/objects/26.jpg",
+        "stimuli/objects/27.jpg",
+        "stimuli/objects/28.jpg",
+        "stimuli/objects/29.jpg",
+        "stimuli/objects/3.jpg",
+        "stimuli/objects/30.jpg",
+        "stimuli/objects/31.jpg",
+        "stimuli/objects/32.jpg",
+        "stimuli/objects/33.jpg",
+        "stimuli/objects/34.jpg",
+        "stimuli/objects/35.jpg",
+        "stimuli/objects/36.jpg",
+        "stimuli/objects/37.jpg",
+        "stimuli/objects/38.jpg",
+        "stimuli/objects/39.jpg",
+        "stimuli/objects/4.jpg",
+        "stimuli/objects/40.jpg",
+        "stimuli/objects/41.jpg",
+        "stimuli/objects/42.jpg",
+        "stimuli/objects/43.jpg",
+        "stimuli/objects/44.jpg",
+        "stimuli/objects/45.jpg",
+        "stimuli/objects/46.jpg",
+        "stimuli/objects/47.jpg",
+        "stimuli/objects/48.jpg",
+        "stimuli/objects/49.jpg",
+        "stimuli/objects/5.jpg",
+        "stimuli/objects/50.jpg",
+        "stimuli/objects/51.jpg",
+        "stimuli/objects/52.jpg",
+        "stimuli/objects/53.jpg",
+        "stimuli/objects/54.jpg",
+        "stimuli/objects/55.jpg",
+        "stimuli/objects/56.jpg",
+        "stimuli/objects/57.jpg",
+        "stimuli/objects/58.jpg",
+        "stimuli/objects/59.jpg",
+        "stimuli/objects/6.jpg",
+        "stimuli/objects/60.jpg",
+        "stimuli/objects/7.jpg",
+        "stimuli/objects/8.jpg",
+        "stimuli/objects/9.jpg"
+    ]
+};
@@ -0,0 +1,55 @@
+// Service worker for the demo pages: everything in precache.js (pages, vendored
+// jsPsych, resized stimuli; written by build_offline.py) is cached on install,
+// and unpkg files are cached the first time they are used, so later sessions
+// load from the browser even with no network.
+importScripts('precache.js'); // self.WEBDEMO_PRECACHE = { version, files }; a new version replaces the old cache
+
+const PRECACHE = `webdemo-${self.WEBDEMO_PRECACHE.version}`;
+const RUNTIME = 'webdemo-runtime';
+
+self.addEventListener('install', event => {
+    event.waitUntil(caches.open(PRECACHE)
+        .then(cache => cache.addAll(self.WEBDEMO_PRECACHE.files))
+        .then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(caches.keys()
+        .then(keys => Promise.all(keys.filter(k => k !== PRECACHE && k !== RUNTIME).map(k => caches.delete(k))))
+        .then(() => self.clients.claim()));
+});
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || (url.origin !== location.origin && url.hostname !== 'unpkg.com')) {
+        return; // data uploads and other sites go to the network as usual
+    }
+    if (event.request.mode === 'navigate') {
+        // pages: the cached copy right away, refreshed in the background for next time
+        const cached = caches.match(event.request, { ignoreSearch: true });
+        const fresh = fetch(event.request).then(response => {
+            if (response.ok) {
+                const copy = response.clone();
+                caches.open(PRECACHE).then(cache => cache.put(url.origin + url.pathname, copy));
+            }
+            return response;
+        });
+        event.waitUntil(fresh.catch(() => { }));
+        event.respondWith(cached.then(hit => hit || fresh));
+        return;
+    }
+    const save = response => {
+        if (response.ok || response.type === 'opaque') {
+            const copy = response.clone();
+            caches.open(RUNTIME).then(cache => cache.put(event.request, copy));
+        }
+        return response;
+    };
+    if (url.origin === location.origin || /@\d+\.\d+\.\d+/.test(url.pathname)) {
+        // vendored files, stimuli and exact-version unpkg URLs don't change: cache first
+        event.respondWith(caches.match(event.request).then(hit => hit || fetch(event.request).then(save)));
+    } else {
+        // version ranges (e.g. plugin-pipe@0.3) can move: network first, the cached copy when offline
+        event.respondWith(fetch(event.request).then(save).catch(() => caches.match(event.request)));
+    }
+});
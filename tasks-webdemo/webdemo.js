@@ -0,0 +1,198 @@
+// Local-first loading, caching and load timing for the demo pages.
+//
+// Pages list the scripts they need by name; each is loaded from vendor/ when
+// build_offline.py has vendored it (vendor/vendor.js lists what it fetched) and
+// from unpkg otherwise. Add ?cdn to a page's URL to force unpkg, e.g. to compare
+// load times. sw.js keeps pages, vendored files and stimuli in the browser's
+// cache, so a second session starts without waiting for the network.
+//
+// With an upload URL (WEBDEMO_UPLOAD_URL, or ?upload=http://host:8001 on the page),
+// trial data also goes to tasklib/receiver.py in batches during the session
+// instead of in one pipe save at the end.
+//
+// build_offline.py reads WEBDEMO_ASSETS below; keep one "name": "url" per line.
+const WEBDEMO_ASSETS = {
+    "jspsych": "https://unpkg.com/jspsych@7.3.3",
+    "jspsych.css": "https://unpkg.com/jspsych@7.3.3/css/jspsych.css",
+    "plugin-html-keyboard-response": "https://unpkg.com/@jspsych/plugin-html-keyboard-response@1.1.2",
+    "plugin-image-keyboard-response": "https://unpkg.com/@jspsych/plugin-image-keyboard-response@1.1.2",
+    "plugin-survey-html-form": "https://unpkg.com/@jspsych/plugin-survey-html-form@1.0.2",
+    "plugin-survey-text": "https://unpkg.com/@jspsych/plugin-survey-text@1.1.2",
+    "plugin-preload": "https://unpkg.com/@jspsych/plugin-preload@1.1.2",
+    "plugin-pipe": "https://unpkg.com/@jspsych-contrib/plugin-pipe@0.3",
+};
+
+const WEBDEMO_UPLOAD_URL = null; // e.g. 'http://lab-pc.local:8001'; null keeps the DataPipe save
+
+const webdemo = (function () {
+    const forceCdn = new URLSearchParams(location.search).has('cdn');
+    const vendored = forceCdn ? {} : (window.WEBDEMO_VENDOR || {});
+    const source = Object.keys(vendored).length ? 'local' : 'cdn';
+    let firstTrialMs = null;
+    const preloaded = []; // decoded images stay in the memory cache while referenced
+
+    // Parser-blocking tags written in order, so each plugin runs after jsPsych itself
+    function load(names) {
+        for (const name of names) {
+            const url = vendored[name] || WEBDEMO_ASSETS[name];
+            if (name.endsWith('.css')) {
+                document.write(`<link href="${url}" rel="stylesheet" type="text/css" />`);
+            } else {
+                document.write(`<script src="${url}"><\/script>`);
+            }
+        }
+    }
+
+    if ('serviceWorker' in navigator && location.protocol !== 'file:') {
+        navigator.serviceWorker.register('sw.js').catch(() => { }); // needs https or localhost
+    }
+
+    // initJsPsych({ on_trial_start: webdemo.trialStarted }): records when the first trial was shown
+    function trialStarted() {
+        if (firstTrialMs === null) {
+            firstTrialMs = performance.now(); // since navigation start
+            jsPsych.data.addProperties({ asset_source: source, time_to_first_trial_ms: Math.round(firstTrialMs) });
+        }
+    }
+
+    // Fetch and decode images before the timeline starts; resolves with the ms it took
+    function preloadImages(urls) {
+        const start = performance.now();
+        return Promise.all(urls.map(url => {
+            const img = new Image();
+            img.src = url;
+            preloaded.push(img);
+            return img.decode().catch(() => { });
+        })).then(() => performance.now() - start);
+    }
+
+    // Time from a trial's on_load until its images are decoded (about 0 if they were preloaded):
+    // call start() in on_load and record(data) in on_finish, which sets data.media_latency_ms
+    function mediaLatency() {
+        let latency = null;
+        return {
+            start: function () {
+                const started = performance.now();
+                const imgs = Array.from(jsPsych.getDisplayElement().querySelectorAll('img'));
+                latency = null;
+                Promise.all(imgs.map(img => img.decode().catch(() => { })))
+                    .then(() => { latency = performance.now() - started; });
+            },
+            record: function (data) {
+                data.media_latency_ms = latency === null ? null : Math.round(latency * 10) / 10;
+            }
+        };
+    }
+
+    // ===== BATCHED UPLOAD =====
+    const BATCH_ROWS = 20; // send after this many trials...
+    const BATCH_MS = 10000; // ...or this long after the oldest unsent one
+    const RETRY_MIN_MS = 1000;
+    const RETRY_MAX_MS = 60000;
+    const QUEUE_KEY = 'webdemo-upload:';
+
+    // Unsent batches live in localStorage until the receiver acknowledges them,
+    // so a closed tab or a dropped network only delays them
+    function saveQueue(q) {
+        try {
+            if (q.batches.length) {
+                localStorage.setItem(QUEUE_KEY + q.session, JSON.stringify({ url: q.url, batches: q.batches, saved: Date.now() }));
+            } else {
+                localStorage.removeItem(QUEUE_KEY + q.session);
+            }
+        } catch (e) { } // storage full or disabled: the batches are still retried while the page is open
+    }
+
+    async function post(url, batch) {
+        const json = JSON.stringify(batch);
+        const headers = { 'Content-Type': 'application/json' };
+        let body = json;
+        if (window.CompressionStream) {
+            const gzipped = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+            body = await new Response(gzipped).arrayBuffer();
+            headers['Content-Encoding'] = 'gzip';
+        }
+        const size = typeof body === 'string' ? body.length : body.byteLength;
+        // keepalive lets a request outlive the page, but only for small bodies
+        return fetch(url + '/upload', { method: 'POST', headers, body, keepalive: size < 60000 });
+    }
+
+    // Send q's batches in order, one at a time, backing off (with jitter) while the receiver is unreachable
+    async function drain(q) {
+        if (q.sending) return;
+        q.sending = true;
+        let delay = RETRY_MIN_MS;
+        while (q.batches.length) {
+            let status = 0;
+            try {
+                status = (await post(q.url, q.batches[0])).status;
+            } catch (e) { } // offline or receiver down
+            if (status === 200 || (status >= 400 && status < 500 && status !== 408 && status !== 429)) {
+                if (status !== 200) console.error(`upload rejected (${status}); batch dropped`, q.batches[0]);
+                q.batches.shift();
+                saveQueue(q);
+                delay = RETRY_MIN_MS;
+            } else {
+                await new Promise(resolve => setTimeout(resolve, delay * (0.5 + Math.random())));
+                delay = Math.min(delay * 2, RETRY_MAX_MS);
+            }
+        }
+        q.sending = false;
+    }
+
+    // initJsPsych({ on_data_update: upload.add, on_finish: () => { upload.finish(); ... } });
+    // the subject is taken from the rows' subject_id. Inert (enabled false) without an upload URL.
+    function uploader(task) {
+        const url = new URLSearchParams(location.search).get('upload') || WEBDEMO_UPLOAD_URL;
+        if (!url) {
+            return { enabled: false, add: function () { }, finish: function () { } };
+        }
+        const session = Array.from(crypto.getRandomValues(new Uint8Array(8)), b => b.toString(16).padStart(2, '0')).join('');
+        const q = { url: url.replace(/\/$/, ''), session, batches: [], sending: false };
+        let rows = [];
+        let subject = null;
+        let timer = null;
+
+        function batch(final) {
+            clearTimeout(timer);
+            timer = null;
+            if (!rows.length && !final) return;
+            q.batches.push({ task, session, subject, rows, final });
+            rows = [];
+            saveQueue(q);
+            drain(q);
+        }
+
+        // batches a previous page left unsent (not those of a page still open in another tab)
+        for (const key of Object.keys(localStorage).filter(k => k.startsWith(QUEUE_KEY))) {
+            try {
+                const old = JSON.parse(localStorage.getItem(key));
+                if (Date.now() - old.saved < RETRY_MAX_MS) continue;
+                drain({ url: old.url, session: key.slice(QUEUE_KEY.length), batches: old.batches, sending: false });
+            } catch (e) {
+                localStorage.removeItem(key);
+            }
+        }
+        addEventListener('pagehide', () => batch(false));
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') batch(false);
+        });
+
+        return {
+            enabled: true,
+            session,
+            add: function (data) {
+                subject = subject || data.subject_id || null;
+                rows.push(data);
+                if (rows.length >= BATCH_ROWS) {
+                    batch(false);
+                } else if (timer === null) {
+                    timer = setTimeout(() => batch(false), BATCH_MS);
+                }
+            },
+            finish: function () { batch(true); }
+        };
+    }
+
+    return { load, trialStarted, preloadImages, mediaLatency, uploader, source };
+})();